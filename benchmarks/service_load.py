@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+from mlmc.service import PricingServer, stream_prices
+from benchmarks.suite import _metric, _timing
+
+'''
+Load generator for the local pricing service
+
+    python -m benchmarks.service_load --clients 32 --requests 8 --workers 4 --out load.json
+
+Starts a PricingServer on a temporary Unix socket, then `clients` concurrent
+connections each send `requests` requests one after another (closed loop)
+for a few underlyings and random strikes. Run once with coalescing
+(--window) and once with max_batch=1 as the unbatched reference; reports
+p50/p99 latency and throughput for both.
+'''
+UNDERLYINGS = [
+    {"S0": 100.0, "mu": 0.05, "sigma": 0.2, "r": 0.05, "T": 1.0},
+    {"S0": 50.0, "mu": 0.03, "sigma": 0.3, "r": 0.03, "T": 0.5},
+]
+
+def _make_request(rng, req_id, max_level, epsilon):
+    model = rng.choice(UNDERLYINGS)
+    req = dict(model, id=req_id, max_level=max_level, epsilon=epsilon)
+    if rng.random() < 0.5:
+        req.update(product="asian", K=model["S0"] * rng.choice([0.9, 0.95, 1.0, 1.05, 1.1]))
+    else:
+        req.update(product="barrier", K=model["S0"] * rng.choice([0.95, 1.0, 1.05]), B=model["S0"] * 1.2, bridge=True)
+    return req
+
+async def _client(path, requests, latencies):
+    for req in requests:
+        start = time.perf_counter()
+        async for response in stream_prices([req], path=path):
+            if "error" in response:
+                raise RuntimeError(response["error"])
+        latencies.append(time.perf_counter() - start)
+
+async def run_load(clients=32, requests=8, workers=2, window=0.005, max_batch=64, max_level=5, epsilon=0.05, rng_seed=0):
+    rng = random.Random(rng_seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mlmc.sock")
+        server = await PricingServer(workers=workers, window=window, max_batch=max_batch).start(path=path)
+        try:
+            per_client = [[_make_request(rng, c * requests + i, max_level, epsilon) for i in range(requests)] for c in range(clients)]
+            latencies = []
+            start = time.perf_counter()
+            await asyncio.gather(*(_client(path, reqs, latencies) for reqs in per_client))
+            elapsed = time.perf_counter() - start
+        finally:
+            await server.close()
+    return {
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p99_s": float(np.percentile(latencies, 99)),
+        "throughput_rps": len(latencies) / elapsed,
+        "mean_batch_size": server.stats["requests"] / max(server.stats["batches"], 1),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pricing service load generator")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=8, help="requests per client")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--window", type=float, default=0.005)
+    parser.add_argument("--max-level", type=int, default=5)
+    parser.add_argument("--epsilon", type=float, default=0.05)
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    metrics = {}
+    for name, max_batch in (("batched", 64), ("unbatched", 1)):
+        stats = asyncio.run(run_load(args.clients, args.requests, args.workers, args.window, max_batch, args.max_level, args.epsilon))
+        metrics[f"service.{name}.p50"] = _timing(stats["p50_s"], "s", "lower")
+        metrics[f"service.{name}.p99"] = _timing(stats["p99_s"], "s", "lower")
+        metrics[f"service.{name}.throughput"] = _timing(stats["throughput_rps"], "req/s", "higher")
+        metrics[f"service.{name}.mean_batch_size"] = _metric(stats["mean_batch_size"], "", "higher")
+    payload = json.dumps({"meta": vars(args), "metrics": metrics}, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
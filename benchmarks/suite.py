@@ -0,0 +1,645 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numba import njit
+from mlmc.engine import _single_level_calc, seed
+from mlmc.payoffs import ASIAN_SPEC, BARRIER_SPEC, asian_params, barrier_params
+from mlmc.mc import warmup, mlmc_asian, mlmc_barrier, asian_price_mc, _asian_mc_sum_sumsq, _barrier_mc_sum_sumsq, mlmc_asian_stream
+from mlmc.mc import mlmc_asian_continuation, mlmc_asian_single_term
+from mlmc.adaptive import mlmc_barrier_adaptive, mean_steps_per_path
+from mlmc.multi_asset import _basket_asian_level_power_sums, _best_of_barrier_level_power_sums
+from mlmc.rates import fit_rates
+from mlmc.engine import mlmc
+from mlmc.scenarios import mlmc_scenarios, make_scenarios
+from mlmc.store import SampleStore
+from mlmc.rng import block_normals
+from mlmc.scheduler import make_pool, mlmc_parallel
+from mlmc.live import LivePricer
+from mlmc.calibration import calibrate_sigma
+from mlmc.engine import mlmc_multi
+from mlmc.nested import nested_variance_estimator
+from mlmc.importance import mlmc_importance
+from mlmc.bermudan import mlmc_bermudan, lsm_bermudan
+from mlmc.profiling import Profiler
+
+'''
+Headless benchmark suite
+
+    python -m benchmarks.suite --quick --out bench.json --baseline benchmarks/baseline.json
+
+Every metric is recorded as {"value", "unit", "better", "gated"} where
+`better` is "higher" (throughput), "lower" (cost) or "target" (fitted rates,
+compared with an absolute tolerance). Exit status is 1 if any gated metric
+regresses past its threshold against the baseline.
+
+Absolute wall-clock figures (times, throughputs, per-sample costs, and SEs
+reached in a time budget) move by 30-70% between back-to-back runs on a
+shared machine, so they are recorded with gated=False for trend plots but
+never fail the comparison. What is gated is measured within one run:
+speedups and overheads between two code paths timed side by side, fitted
+rates, sample counts and accuracies.
+'''
+S0, MU, SIGMA, T, R, K, B = 100.0, 0.05, 0.2, 1.0, 0.05, 100.0, 120.0
+
+CONFIGS = {
+    "quick": {"repeats": 5, "kernel_paths": 20000, "kernel_level": 6, "rate_paths": 20000,
+              "rate_L": 8, "eps": [0.1, 0.05, 0.025], "mlmc_L": 6, "mc_pilot": 20000, "n_assets": 10,
+              "barrier_L": 10, "barrier_eps": 0.2},
+    "full": {"repeats": 5, "kernel_paths": 100000, "kernel_level": 8, "rate_paths": 50000,
+             "rate_L": 10, "eps": [0.1, 0.05, 0.025, 0.0125, 0.00625], "mlmc_L": 10, "mc_pilot": 20000, "n_assets": 20,
+             "barrier_L": 12, "barrier_eps": 0.1},
+}
+
+DEFAULT_TOLERANCES = {"higher": 0.25, "lower": 0.5, "target": 0.35}
+
+def _metric(value, unit, better, gated=True):
+    return {"value": float(value), "unit": unit, "better": better, "gated": gated}
+
+def _timing(value, unit, better):
+    """An absolute wall-clock figure: recorded, not gated (see module docstring)."""
+    return _metric(value, unit, better, gated=False)
+
+def _median_times(fns, repeats, min_seconds=2.0):
+    """Median wall time of each callable in `fns` (a dict) over at least `repeats` rounds.
+
+    The callables take turns within each round, and all of them see the same
+    random numbers in a round (seed(round) before each call), so the load of
+    the machine and the luck of the draw hit both sides of a ratio alike.
+    Rounds go on until min_seconds have been spent, so calls of a few ms get
+    enough of them for a stable median.
+    """
+    times = {name: [] for name in fns}
+    repeat, spent = 0, 0.0
+    while repeat < repeats or spent < min_seconds:
+        for name, fn in fns.items():
+            seed(repeat)
+            start = time.perf_counter()
+            fn()
+            times[name].append(time.perf_counter() - start)
+            spent += times[name][-1]
+        repeat += 1
+    return {name: float(np.median(t)) for name, t in times.items()}
+
+'''
+Benchmarks
+'''
+def bench_kernel_throughput(cfg):
+    """Paths/sec and steps/sec for every compiled kernel at a fixed level."""
+    n_paths, level, repeats = cfg["kernel_paths"], cfg["kernel_level"], cfg["repeats"]
+    n_steps = 2**level
+    d = cfg["n_assets"]
+    corr = np.full((d, d), 0.3) + 0.7 * np.eye(d)
+    chol = np.linalg.cholesky(corr)
+    ones = np.ones(d)
+
+    kernels = {
+        "engine_asian": lambda: _single_level_calc(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, level, n_paths, R, T),
+        "engine_barrier": lambda: _single_level_calc(BARRIER_SPEC, barrier_params(K, B), S0, MU, SIGMA, level, n_paths, R, T),
+        "engine_barrier_bridge": lambda: _single_level_calc(BARRIER_SPEC, barrier_params(K, B, bridge=True), S0, MU, SIGMA, level, n_paths, R, T),
+        "mc_asian": lambda: _asian_mc_sum_sumsq(S0, MU, SIGMA, T, n_steps, n_paths, K, R),
+        "mc_barrier_bridge": lambda: _barrier_mc_sum_sumsq(S0, MU, SIGMA, n_steps, n_paths, K, B, R, T, bridge=True),
+        "basket_asian": lambda: _basket_asian_level_power_sums(S0 * ones, MU * ones, SIGMA * ones, chol, ones / d, T, level, n_paths // d, K, R),
+        "best_of_barrier_bridge": lambda: _best_of_barrier_level_power_sums(MU * ones, SIGMA * ones, chol, T, level, n_paths // d, 1.0, 1.3, R, True, True),
+    }
+    for fn in kernels.values():
+        fn()  # compile
+    elapsed = _median_times(kernels, repeats)
+    metrics = {}
+    for name in kernels:
+        paths = n_paths // d if name in ("basket_asian", "best_of_barrier_bridge") else n_paths
+        metrics[f"throughput.{name}.paths_per_s"] = _timing(paths / elapsed[name], "paths/s", "higher")
+        metrics[f"throughput.{name}.steps_per_s"] = _timing(paths * n_steps / elapsed[name], "steps/s", "higher")
+    # the engine's coupled level-l pass simulates a fine and a coarse path per sample, the dedicated MC kernels one path
+    metrics["throughput.engine_asian.vs_mc_asian"] = _metric(elapsed["mc_asian"] / elapsed["engine_asian"], "x", "higher")
+    metrics["throughput.engine_barrier_bridge.vs_mc_barrier_bridge"] = _metric(
+        elapsed["mc_barrier_bridge"] / elapsed["engine_barrier_bridge"], "x", "higher")
+    return metrics
+
+@njit
+def _numba_normals(n):
+    out = np.empty(n)
+    for i in range(n):
+        out[i] = np.random.normal()
+    return out
+
+def bench_rng(cfg):
+    """Normals/sec from the block ziggurat generator vs numba's scalar np.random.normal()."""
+    n, repeats = cfg["kernel_paths"] * 2**cfg["kernel_level"], cfg["repeats"]
+    block_normals(16, 0)
+    _numba_normals(16)
+    times = _median_times({"block": lambda: block_normals(n, 1), "scalar": lambda: _numba_normals(n)}, repeats)
+    block, scalar = times["block"], times["scalar"]
+    return {
+        "rng.block.normals_per_s": _timing(n / block, "normals/s", "higher"),
+        "rng.numba.normals_per_s": _timing(n / scalar, "normals/s", "higher"),
+        "rng.block.speedup": _metric(scalar / block, "x", "higher"),
+    }
+
+def bench_level_costs_and_rates(cfg):
+    """Per-level cost C_l and fitted alpha/beta/gamma for each product (as in the *_variance_cost experiments)."""
+    L, n_paths = cfg["rate_L"], cfg["rate_paths"]
+    products = {
+        "asian": (ASIAN_SPEC, asian_params(K)),
+        "barrier": (BARRIER_SPEC, barrier_params(K, B)),
+        "barrier_bridge": (BARRIER_SPEC, barrier_params(K, B, bridge=True)),
+    }
+    metrics = {}
+    for name, (spec, params) in products.items():
+        means, vars, costs = np.zeros(L + 1), np.zeros(L + 1), np.zeros(L + 1)
+        for level in range(L + 1):
+            means[level], vars[level], costs[level] = _single_level_calc(spec, params, S0, MU, SIGMA, level, n_paths, R, T)
+            # levels 0-1 take a few ms in total and are too noisy to track
+            if level >= 2:
+                metrics[f"level_cost.{name}.l{level}"] = _timing(costs[level], "ns/sample", "lower")
+        rates = fit_rates(means, vars, costs, T=T)
+        for rate in ("alpha", "beta", "gamma"):
+            # bridge corrections are nearly mean-zero, so their alpha fit is noise
+            if rate == "alpha" and name == "barrier_bridge":
+                continue
+            metrics[f"rates.{name}.{rate}"] = _metric(rates[rate], "", "target")
+    return metrics
+
+def bench_nested(cfg):
+    """Wall time of all per-level corrections from one nested pass vs one coupled pass per level, and the nested beta.
+
+    Only the Asian: knock-out products fall back to the per-level passes (see mlmc.nested).
+    """
+    L, n_paths, repeats = cfg["rate_L"], cfg["rate_paths"], cfg["repeats"]
+    spec, params = ASIAN_SPEC, asian_params(K)
+    nested_variance_estimator(spec, params, S0, MU, SIGMA, 1, R, T, 16)
+    _single_level_calc(spec, params, S0, MU, SIGMA, 1, 16, R, T)
+    means, vars, _, _ = nested_variance_estimator(spec, params, S0, MU, SIGMA, L, R, T, n_paths)
+    times = _median_times({
+        "nested": lambda: nested_variance_estimator(spec, params, S0, MU, SIGMA, L, R, T, n_paths),
+        "per_level": lambda: [_single_level_calc(spec, params, S0, MU, SIGMA, level, n_paths, R, T) for level in range(L + 1)],
+    }, repeats)
+    nested, per_level = times["nested"], times["per_level"]
+    # the nested pass has no per-level costs; beta does not depend on them
+    beta = fit_rates(means, vars, 2.0 ** np.arange(L + 1), T=T)["beta"]
+    return {
+        "nested.asian.time": _timing(nested, "s", "lower"),
+        "nested.asian.per_level_time": _timing(per_level, "s", "lower"),
+        "nested.asian.speedup": _metric(per_level / nested, "x", "higher"),
+        "nested.asian.beta": _metric(beta, "", "target"),
+    }
+
+def bench_cost_vs_eps(cfg):
+    """Wall time of MLMC vs standard MC for the Asian call over an epsilon ladder, and the fitted cost slopes."""
+    eps_list, L, n_pilot = cfg["eps"], cfg["mlmc_L"], cfg["mc_pilot"]
+    metrics = {}
+    mlmc_costs, mc_costs = [], []
+    for eps in eps_list:
+        n_steps = int(np.ceil(2 * T / eps))
+
+        def mc():
+            _, se0 = asian_price_mc(S0, MU, SIGMA, T, n_steps, n_pilot, K, R)
+            n_paths = int(np.ceil(n_pilot * (2 * se0 / eps) ** 2))
+            asian_price_mc(S0, MU, SIGMA, T, n_steps, n_paths, K, R)
+
+        times = _median_times({"mlmc": lambda: mlmc_asian(S0, MU, SIGMA, L, K, R, T, eps), "mc": mc}, cfg["repeats"])
+        mlmc_costs.append(times["mlmc"])
+        mc_costs.append(times["mc"])
+
+        metrics[f"cost_vs_eps.mlmc_asian.eps_{eps:g}"] = _timing(mlmc_costs[-1], "s", "lower")
+        metrics[f"cost_vs_eps.mc_asian.eps_{eps:g}"] = _timing(mc_costs[-1], "s", "lower")
+
+    log_eps = np.log(eps_list)
+    metrics["cost_vs_eps.mlmc_asian.slope"] = _metric(np.polyfit(log_eps, np.log(mlmc_costs), 1)[0], "", "target")
+    metrics["cost_vs_eps.mc_asian.slope"] = _metric(np.polyfit(log_eps, np.log(mc_costs), 1)[0], "", "target")
+    return metrics
+
+def bench_extrapolation(cfg):
+    """Bridge barrier MLMC with full pilots vs online-extrapolated top levels (fixed-overhead regime)."""
+    L, eps, repeats = cfg["barrier_L"], cfg["barrier_eps"], cfg["repeats"]
+    ses = {"full_pilot": [], "extrapolated": []}
+    times = _median_times({
+        name: lambda name=name, extrapolate=extrapolate: ses[name].append(
+            mlmc_barrier(S0, MU, SIGMA, L, K, B, R, T, eps, bridge=True, extrapolate=extrapolate)[1])
+        for name, extrapolate in (("full_pilot", False), ("extrapolated", True))
+    }, repeats)
+    metrics = {}
+    for name in times:
+        metrics[f"extrapolation.barrier_bridge.{name}.time"] = _timing(times[name], "s", "lower")
+        metrics[f"extrapolation.barrier_bridge.{name}.se_over_target"] = _metric(max(ses[name]) / (eps / 2), "", "lower")
+    metrics["extrapolation.barrier_bridge.speedup"] = _metric(times["full_pilot"] / times["extrapolated"], "x", "higher")
+    return metrics
+
+def bench_control_variates(cfg):
+    """Asian (geometric CV) and barrier (analytic continuous-barrier CV) MLMC with and without control variates.
+
+    The barrier CV does not pay (see BARRIER_SPEC); its speedup is tracked to stay near 1x.
+    """
+    eps, L, repeats = cfg["eps"][-1], cfg["mlmc_L"], cfg["repeats"]
+    runs = {
+        "asian": lambda cv: mlmc_asian(S0, MU, SIGMA, L, K, R, T, eps, control_variate=cv),
+        "barrier": lambda cv: mlmc_barrier(S0, MU, SIGMA, L, K, B, R, T, 4 * eps, control_variate=cv),
+    }
+    metrics = {}
+    for name, run in runs.items():
+        times = _median_times({"plain": lambda: run(False), "cv": lambda: run(True)}, repeats)
+        for label in times:
+            metrics[f"control_variates.{name}.{label}.time"] = _timing(times[label], "s", "lower")
+        metrics[f"control_variates.{name}.speedup"] = _metric(times["plain"] / times["cv"], "x", "higher")
+    return metrics
+
+def bench_scenarios(cfg):
+    """Asian repricing under a bump grid: one CRN scenario batch vs independent MLMC runs per scenario."""
+    L, eps = cfg["mlmc_L"], cfg["eps"][0]
+    bumps = np.linspace(-0.02, 0.02, 9)
+    scenarios = make_scenarios(S0 * (1 + bumps), SIGMA, R, mu=MU)
+    params = asian_params(K)
+    mlmc_scenarios(ASIAN_SPEC, params, scenarios, 1, T, 1.0)  # compile
+    batches = []
+    times = _median_times({
+        "batched": lambda: batches.append(mlmc_scenarios(ASIAN_SPEC, params, scenarios, L, T, eps)),
+        "independent": lambda: [mlmc(ASIAN_SPEC, params, row[0], row[1], row[2], L, row[3], T, eps) for row in scenarios],
+    }, cfg["repeats"])
+    batched, independent, batch = times["batched"], times["independent"], batches[0]
+    return {
+        "scenarios.asian.batched.time": _timing(batched, "s", "lower"),
+        "scenarios.asian.independent.time": _timing(independent, "s", "lower"),
+        "scenarios.asian.speedup": _metric(independent / batched, "x", "higher"),
+        # independent runs have difference SE ~ sqrt(2) * SE
+        "scenarios.asian.diff_se_reduction": _metric(np.sqrt(2) * batch.ses[0, 1:].mean() / batch.diff_ses[0, 1:].mean(), "x", "higher"),
+    }
+
+def bench_budget(cfg):
+    """Fixed time-budget mode: how much of the window is used and the SE achieved in it."""
+    metrics = {}
+    for budget in (0.05, 0.2):
+        start = time.perf_counter()
+        result = mlmc_asian(S0, MU, SIGMA, cfg["rate_L"], K, R, T, None, return_result=True, time_budget=budget)
+        elapsed = time.perf_counter() - start
+        metrics[f"budget.asian.{budget:g}s.time_over_budget"] = _metric(elapsed / budget, "", "lower")
+        metrics[f"budget.asian.{budget:g}s.se"] = _timing(result.se, "", "lower")
+    return metrics
+
+def bench_anytime(cfg):
+    """Streaming Asian estimate: latency of the first snapshot and the SE reached by a 50 ms deadline."""
+    start = time.perf_counter()
+    first = None
+    for snap in mlmc_asian_stream(S0, MU, SIGMA, cfg["rate_L"], K, R, T, deadline=0.05):
+        if first is None:
+            first = time.perf_counter() - start
+    return {
+        "anytime.asian.first_snapshot": _timing(first, "s", "lower"),
+        "anytime.asian.se_at_50ms": _timing(snap.se, "", "lower"),
+    }
+
+def bench_continuation(cfg):
+    """Asian epsilon ladder: one continuation run vs independent runs per epsilon (same L) and vs its last element alone."""
+    eps_list, L = cfg["eps"], cfg["mlmc_L"]
+    runs = {"continuation": lambda: mlmc_asian_continuation(S0, MU, SIGMA, L, K, R, T, eps_list)}
+    runs.update({eps: lambda eps=eps: mlmc_asian(S0, MU, SIGMA, L, K, R, T, eps) for eps in eps_list})
+    times = _median_times(runs, cfg["repeats"])
+    continuation, last = times["continuation"], times[eps_list[-1]]
+    ladder = sum(times[eps] for eps in eps_list)
+    return {
+        "continuation.asian.time": _timing(continuation, "s", "lower"),
+        "continuation.asian.independent_ladder.time": _timing(ladder, "s", "lower"),
+        "continuation.asian.speedup": _metric(ladder / continuation, "x", "higher"),
+        "continuation.asian.over_last_eps": _metric(continuation / last, "", "lower"),
+    }
+
+def bench_adaptive(cfg):
+    """Discretely monitored barrier: adaptive vs uniform time-stepping (steps per path at the top level, MLMC wall time)."""
+    L, eps, repeats = cfg["barrier_L"], cfg["barrier_eps"], cfg["repeats"]
+    mlmc_barrier_adaptive(S0, MU, SIGMA, 1, K, B, R, T, 1.0)  # compile
+    times = _median_times({
+        "adaptive": lambda: mlmc_barrier_adaptive(S0, MU, SIGMA, L, K, B, R, T, eps),
+        "uniform": lambda: mlmc_barrier(S0, MU, SIGMA, L, K, B, R, T, eps),
+    }, repeats)
+    adaptive, uniform = times["adaptive"], times["uniform"]
+    return {
+        "adaptive.barrier.steps_per_path": _metric(mean_steps_per_path(S0, MU, SIGMA, L, K, B, T), "steps", "lower"),
+        "adaptive.barrier.uniform_steps_per_path": _metric(2**L, "steps", "lower"),
+        "adaptive.barrier.adaptive.time": _timing(adaptive, "s", "lower"),
+        "adaptive.barrier.uniform.time": _timing(uniform, "s", "lower"),
+        "adaptive.barrier.speedup": _metric(uniform / adaptive, "x", "higher"),
+    }
+
+def bench_single_term(cfg):
+    """Asian: unbiased single-term estimator vs MLMC at the same epsilon, with its tuned P(level >= 3) and variance x cost."""
+    eps, L = cfg["eps"][-1], cfg["mlmc_L"]
+    res = mlmc_asian_single_term(S0, MU, SIGMA, K, R, T, eps, return_result=True)
+    times = _median_times({
+        "single": lambda: mlmc_asian_single_term(S0, MU, SIGMA, K, R, T, eps),
+        "multi": lambda: mlmc_asian(S0, MU, SIGMA, L, K, R, T, eps),
+    }, cfg["repeats"])
+    single, multi = times["single"], times["multi"]
+    return {
+        "single_term.asian.time": _timing(single, "s", "lower"),
+        "single_term.asian.mlmc.time": _timing(multi, "s", "lower"),
+        "single_term.asian.vs_mlmc": _metric(multi / single, "x", "higher"),
+        "single_term.asian.work_variance": _timing(res.work_variance, "ns", "lower"),
+        "single_term.asian.p_level_ge_3": _metric(res.level_probs[3:].sum(), "", "target"),
+    }
+
+def bench_store(cfg):
+    """Asian MLMC with every sample streamed to a memory-mapped store: run overhead, and diagnostics time per 10^6 stored samples."""
+    eps, L = cfg["eps"][-1], cfg["mlmc_L"]
+    with tempfile.TemporaryDirectory() as path:
+        with SampleStore(os.path.join(path, "compile")) as store:
+            mlmc(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, 1, R, T, 1.0, store=store)
+        runs = []
+
+        def stored_run():
+            runs.append(os.path.join(path, f"run{len(runs)}"))
+            with SampleStore(runs[-1], payoffs=True) as store:
+                mlmc(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps, store=store)
+
+        times = _median_times({"plain": lambda: mlmc(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps), "stored": stored_run},
+                              cfg["repeats"])
+        plain, stored = times["plain"], times["stored"]
+        store = SampleStore(runs[-1], mode="r")
+        n_million = store.n_samples.sum() / 1e6
+        start = time.perf_counter()
+        [store.level_moments(level) for level in store.levels]
+        store.bootstrap_ci()
+        diagnostics = time.perf_counter() - start
+    return {
+        "store.asian.overhead": _metric(stored / plain, "", "lower"),
+        "store.asian.diagnostics_per_million": _timing(diagnostics / n_million, "s", "lower"),
+    }
+
+def bench_scheduler(cfg):
+    """Asian MLMC on a warm pool of cpu_count workers: speedup over the sequential driver and pool utilisation,
+    with cost-balanced tasks and with one task per level."""
+    eps, L, repeats = cfg["eps"][-1], cfg["mlmc_L"], cfg["repeats"]
+    workers = os.cpu_count()
+    splits = {"balanced": True, "per_level": False}
+    utilisation = {name: [] for name in splits}
+
+    def parallel(name, pool):
+        profiler = Profiler()
+        mlmc_parallel(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps, executor=pool, split=splits[name], profiler=profiler)
+        utilisation[name].append(profiler.counters["scheduler.busy_ns"] / profiler.counters["scheduler.capacity_ns"])
+
+    metrics = {}
+    with make_pool(workers) as pool:
+        runs = {"sequential": lambda: mlmc(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps)}
+        runs.update({name: lambda name=name: parallel(name, pool) for name in splits})
+        times = _median_times(runs, repeats)
+    for name in splits:
+        metrics[f"scheduler.asian.{name}.speedup"] = _metric(times["sequential"] / times[name], "x", "higher")
+        metrics[f"scheduler.asian.{name}.utilisation"] = _metric(np.median(utilisation[name]), "", "higher")
+    return metrics
+
+def bench_threads(cfg):
+    """Asian MLMC calls per second from 1 and from cpu_count threads (kernels release the GIL), and the scaling between them."""
+    eps, L = cfg["eps"][1], cfg["mlmc_L"]
+    thread_counts = sorted({1, os.cpu_count()})
+    n_calls = 4 * thread_counts[-1]
+    pools = {n_threads: ThreadPoolExecutor(n_threads) for n_threads in thread_counts}
+    try:
+        times = _median_times({
+            n_threads: lambda pool=pool: list(pool.map(lambda _: mlmc_asian(S0, MU, SIGMA, L, K, R, T, eps), range(n_calls)))
+            for n_threads, pool in pools.items()
+        }, cfg["repeats"])
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+    metrics = {}
+    rate = {}
+    for n_threads in thread_counts:
+        rate[n_threads] = n_calls / times[n_threads]
+        metrics[f"threads.asian.calls_per_s.{n_threads}"] = _timing(rate[n_threads], "calls/s", "higher")
+    metrics["threads.asian.scaling"] = _metric(rate[thread_counts[-1]] / rate[1], "x", "higher")
+    return metrics
+
+def bench_live(cfg):
+    """Asian: latency of a LivePricer tick vs a full MLMC rerun over a ladder of small spot moves, and the roughness of the
+    quoted prices along the ladder (largest second difference, in units of epsilon). Medians over cfg["repeats"] pricers."""
+    eps, L = cfg["eps"][-1], cfg["mlmc_L"]
+    spots = S0 * (1.0 + 0.001 * np.arange(1, 11))
+    ticks, roughness = [], []
+
+    def ladder(repeat):
+        live = LivePricer(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, R, T, L, eps, rng=np.random.default_rng(repeat))
+        quotes = [live.update(S0=spot) for spot in spots]
+        ticks.append(np.mean([quote.seconds for quote in quotes]))
+        roughness.append(np.max(np.abs(np.diff([quote.price for quote in quotes], 2))) / eps)
+
+    times = _median_times({
+        "ladder": lambda: ladder(len(ticks)),
+        "full": lambda: mlmc(ASIAN_SPEC, asian_params(K), spots[-1], MU, SIGMA, L, R, T, eps),
+    }, cfg["repeats"])
+    full, tick = times["full"], np.median(ticks)
+    return {
+        "live.asian.tick.time": _timing(tick, "s", "lower"),
+        "live.asian.tick_speedup": _metric(full / tick, "x", "higher"),
+        "live.asian.roughness": _metric(np.median(roughness), "eps", "lower"),
+    }
+
+def bench_importance(cfg):
+    """Out-of-the-money MLMC with a tuned drift shift and stratified level 0 vs plain MLMC: samples and wall time to the same epsilon.
+
+    The IS time includes tuning; the bridge barrier is about break-even, so tune_shift may fall back to plain MLMC there.
+    Every figure is a median over the rounds of _median_times: the deep OTM pilots and the cost-driven N_l otherwise
+    move single runs by up to 5x.
+    """
+    L = cfg["mlmc_L"]
+    cases = {
+        "asian_k140": (ASIAN_SPEC, asian_params(140.0), 0.0005),
+        "barrier_bridge_k115": (BARRIER_SPEC, barrier_params(115.0, B, bridge=True), 0.0015),
+    }
+    metrics = {}
+    for name, (spec, params, eps) in cases.items():
+        mlmc_importance(spec, params, S0, MU, SIGMA, 2, R, T, 0.1)
+        samples = {"plain": [], "is": []}
+        times = _median_times({
+            kind: lambda kind=kind, driver=driver: samples[kind].append(
+                driver(spec, params, S0, MU, SIGMA, L, R, T, eps, return_result=True).n_samples.sum())
+            for kind, driver in (("plain", mlmc), ("is", mlmc_importance))
+        }, cfg["repeats"])
+        plain_time, is_time = times["plain"], times["is"]
+        plain_samples, is_samples = np.median(samples["plain"]), np.median(samples["is"])
+        metrics[f"importance.{name}.plain.time"] = _timing(plain_time, "s", "lower")
+        metrics[f"importance.{name}.plain.samples"] = _metric(int(plain_samples), "", "lower")
+        metrics[f"importance.{name}.is.time"] = _timing(is_time, "s", "lower")
+        # the shift is tuned on timed pilots, so the IS sample counts move with the machine like a wall time
+        metrics[f"importance.{name}.is.samples"] = _timing(int(is_samples), "", "lower")
+        metrics[f"importance.{name}.sample_reduction"] = _timing(plain_samples / is_samples, "x", "higher")
+        metrics[f"importance.{name}.speedup"] = _metric(plain_time / is_time, "x", "higher")
+    return metrics
+
+def bench_bermudan(cfg):
+    """Bermudan Asian (12 exercise dates): multilevel Longstaff-Schwartz vs single-level LSM on the same finest grid, wall time
+    (policy fits included) to the same epsilon."""
+    L = 5
+    mlmc_bermudan(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, 1, R, T, 0.5, n_regression=1000)
+    lsm_bermudan(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, 1, R, T, 0.5, n_regression=1000)
+    metrics = {}
+    for eps in cfg["eps"][1:3]:
+        times = _median_times({
+            "mlmc": lambda: mlmc_bermudan(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps),
+            "lsm": lambda: lsm_bermudan(ASIAN_SPEC, asian_params(K), S0, MU, SIGMA, L, R, T, eps),
+        }, cfg["repeats"])
+        ml, sl = times["mlmc"], times["lsm"]
+        metrics[f"bermudan.asian.eps_{eps:g}.mlmc.time"] = _timing(ml, "s", "lower")
+        metrics[f"bermudan.asian.eps_{eps:g}.lsm.time"] = _timing(sl, "s", "lower")
+        metrics[f"bermudan.asian.eps_{eps:g}.speedup"] = _metric(sl / ml, "x", "higher")
+    return metrics
+
+def _golden_section(f, lo, hi, tol):
+    """Minimize f on [lo, hi] to a bracket of width tol; returns (argmin, evaluations)."""
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    fa, fb = f(a), f(b)
+    n = 2
+    while hi - lo > tol:
+        if fa < fb:
+            hi, b, fb = b, a, fa
+            a = hi - ratio * (hi - lo)
+            fa = f(a)
+        else:
+            lo, a, fa = a, b, fb
+            b = lo + ratio * (hi - lo)
+            fb = f(b)
+        n += 1
+    return (lo + hi) / 2.0, n
+
+def bench_calibration(cfg):
+    """Asian sigma calibration to three strikes: CRN + pathwise vegas + Levenberg-Marquardt vs golden-section search
+    over fresh MLMC runs (the naive loop). Evaluations, wall time and distance to the sigma the quotes were made with."""
+    eps, L, true_sigma = cfg["eps"][1], cfg["mlmc_L"], 0.25
+    params = [asian_params(strike) for strike in (90.0, 100.0, 110.0)]
+    market = np.array([price for price, _ in mlmc_multi(ASIAN_SPEC, params, S0, R, true_sigma, L, R, T, cfg["eps"][-1] / 2.0)])
+    quotes = [(ASIAN_SPEC, row, price) for row, price in zip(params, market)]
+
+    res = calibrate_sigma(quotes, S0, R, T, L, eps, sigma0=0.2, rng=np.random.default_rng(11))
+
+    def naive_objective(sigma):
+        prices = np.array([price for price, _ in mlmc_multi(ASIAN_SPEC, params, S0, R, sigma, L, R, T, eps)])
+        return np.sum((prices - market)**2)
+
+    naive_runs = []
+    times = _median_times({
+        "crn": lambda: calibrate_sigma(quotes, S0, R, T, L, eps, sigma0=0.2, rng=np.random.default_rng(11)),
+        "naive": lambda: naive_runs.append(_golden_section(naive_objective, 0.1, 0.4, res.sigma_se)),
+    }, cfg["repeats"])
+    crn, naive = times["crn"], times["naive"]
+    naive_sigma, naive_evals = naive_runs[0]
+    return {
+        "calibration.asian.crn.time": _timing(crn, "s", "lower"),
+        "calibration.asian.crn.evaluations": _metric(res.n_evaluations, "", "lower"),
+        "calibration.asian.crn.sigma_error": _metric(abs(res.sigma - true_sigma), "", "target"),
+        "calibration.asian.naive.time": _timing(naive, "s", "lower"),
+        "calibration.asian.speedup": _metric(naive / crn, "x", "higher"),
+        "calibration.asian.naive.evaluations": _metric(naive_evals, "", "lower"),
+        "calibration.asian.naive.sigma_error": _metric(abs(naive_sigma - true_sigma), "", "target"),
+    }
+
+BENCHMARKS = {
+    "throughput": bench_kernel_throughput,
+    "rng": bench_rng,
+    "level_costs": bench_level_costs_and_rates,
+    "nested": bench_nested,
+    "cost_vs_eps": bench_cost_vs_eps,
+    "extrapolation": bench_extrapolation,
+    "control_variates": bench_control_variates,
+    "scenarios": bench_scenarios,
+    "budget": bench_budget,
+    "anytime": bench_anytime,
+    "continuation": bench_continuation,
+    "adaptive": bench_adaptive,
+    "single_term": bench_single_term,
+    "store": bench_store,
+    "scheduler": bench_scheduler,
+    "threads": bench_threads,
+    "live": bench_live,
+    "importance": bench_importance,
+    "calibration": bench_calibration,
+    "bermudan": bench_bermudan,
+}
+
+'''
+Running and baseline comparison
+'''
+def run_suite(mode="quick", only=None, rng_seed=1234):
+    cfg = CONFIGS[mode]
+    warmup()
+    seed(rng_seed)
+    started = time.perf_counter()
+    metrics = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        metrics.update(bench(cfg))
+    return {
+        "meta": {
+            "mode": mode,
+            "seed": rng_seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_time_s": time.perf_counter() - started,
+        },
+        "metrics": metrics,
+    }
+
+def compare(results, baseline, tolerances=None):
+    """Return a list of (name, baseline, current, message) for every gated metric outside its threshold."""
+    tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    regressions = []
+    for name, base in baseline["metrics"].items():
+        cur = results["metrics"].get(name)
+        if cur is None or not base.get("gated", True):
+            continue
+        b, c, better = base["value"], cur["value"], base["better"]
+        tol = tolerances[better]
+        if better == "higher" and c < b * (1.0 - tol):
+            regressions.append((name, b, c, f"dropped {100 * (1 - c / b):.1f}% (> {100 * tol:.0f}%)"))
+        elif better == "lower" and c > b * (1.0 + tol):
+            regressions.append((name, b, c, f"rose {100 * (c / b - 1):.1f}% (> {100 * tol:.0f}%)"))
+        elif better == "target" and not abs(c - b) <= tol:
+            regressions.append((name, b, c, f"moved by {c - b:+.3f} (> {tol})"))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MLMC benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="small configuration, finishes in about a minute and a half")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="run a subset of the benchmarks")
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite --baseline with these results")
+    parser.add_argument("--seed", type=int, default=1234)
+    for better, tol in DEFAULT_TOLERANCES.items():
+        parser.add_argument(f"--tol-{better}", type=float, default=tol)
+    args = parser.parse_args(argv)
+
+    results = run_suite("quick" if args.quick else "full", only=args.only, rng_seed=args.seed)
+    payload = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(payload)
+        return 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["mode"] != results["meta"]["mode"]:
+            print(f"warning: baseline mode {baseline['meta']['mode']} != {results['meta']['mode']}", file=sys.stderr)
+        tolerances = {"higher": args.tol_higher, "lower": args.tol_lower, "target": args.tol_target}
+        regressions = compare(results, baseline, tolerances)
+        for name, b, c, msg in regressions:
+            print(f"REGRESSION {name}: baseline={b:.6g} current={c:.6g} {msg}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"no regressions against {args.baseline}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 from mlmc.mc import _single_level_calc_barrier
+from mlmc.nested import nested_variance_estimator
+from mlmc.payoffs import BARRIER_SPEC, barrier_params
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -15,19 +17,18 @@ def main():
     print("levels:", levels)
 
 
-    vars = np.array([])
-    hs = np.array([])
-    costs = np.array([])
+    # means and variances of every level from one nested pass; costs from the best of three short per-level runs,
+    # which one pass cannot give
+    means, vars, _, _ = nested_variance_estimator(BARRIER_SPEC, barrier_params(K, barrier), S0, mu, sigma, L, r, T, 50000)
+    hs = T / 2.0**levels
+    costs = np.zeros(L+1)
 
-    _single_level_calc_barrier(S0, mu, sigma, 0, 50000, K, barrier, r, T)
-    _single_level_calc_barrier(S0, mu, sigma, 1, 50000, K, barrier, r, T)
+    _single_level_calc_barrier(S0, mu, sigma, 0, 2000, K, barrier, r, T)
+    _single_level_calc_barrier(S0, mu, sigma, 1, 2000, K, barrier, r, T)
 
     for idx, level in enumerate(levels):
-        mean, var, cost = _single_level_calc_barrier(S0, mu, sigma, level, 50000, K, barrier, r, T)
-        vars = np.append(vars, var)
-        hs = np.append(hs, T / (2**level))
-        costs = np.append(costs, cost)
-        print(f"level={level:4d}  h={hs[idx]:.6f} mean correction={mean:.6f}  cost≈{costs[idx]:.6f}, sample var={var:.6f}")
+        costs[idx] = min(_single_level_calc_barrier(S0, mu, sigma, level, 2000, K, barrier, r, T)[2] for _ in range(3))
+        print(f"level={level:4d}  h={hs[idx]:.6f} mean correction={means[idx]:.6f}  cost≈{costs[idx]:.6f}, sample var={vars[idx]:.6f}")
 
     plt.figure()
     plt.loglog(hs, vars, marker="o")
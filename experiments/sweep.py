@@ -0,0 +1,352 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from mlmc.engine import _single_level_calc, seed
+from mlmc.mc import warmup, mlmc_asian, mlmc_barrier, asian_price_mc, barrier_price_mc
+from mlmc.payoffs import ASIAN_SPEC, BARRIER_SPEC, asian_params, barrier_params
+
+'''
+Headless parameter sweeps over the experiments in this directory
+
+    python -m experiments.sweep variance_cost --grid product=asian,barrier sigma=0.1,0.2,0.3 --workers 4
+    python -m experiments.sweep mlmc_vs_mc --grid product=barrier bridge=1 barrier=110,120 --plot --out figures/
+    python -m experiments.sweep convergence --grid product=barrier barrier=110,120,130 --plot
+
+Every experiment is a curve along one axis (n_steps, level or epsilon) for a
+fixed model. The grid is expanded into (model, axis value) points; each
+point is computed once on a warm worker process, with numba's RNG seeded
+from the point, and stored as JSON under --cache keyed by the experiment,
+its parameters and a hash of the mlmc sources and this file. Reruns only
+compute the points that are missing, so --plot on an existing sweep is
+instant. Plots are the ones the individual scripts draw, one set per model.
+
+Points that record wall time (variance_cost costs, mlmc_vs_mc runtimes) are
+measured while other workers run, so use --workers 1 when the timings
+themselves are the result.
+'''
+DEFAULT_MODEL = {"product": "asian", "bridge": 0, "S0": 100.0, "mu": 0.05, "r": 0.05, "sigma": 0.2, "T": 1.0, "K": 100.0, "barrier": 120.0}
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sweep_cache")
+
+'''
+Per-point computations
+'''
+def _convergence_point(p):
+    """Single-level MC price with n_steps steps (the n_steps = n_steps_ref point is the reference)."""
+    n_paths = p["n_paths_ref"] if p["n_steps"] == p["n_steps_ref"] else p["n_paths"]
+    if p["product"] == "asian":
+        price, se = asian_price_mc(p["S0"], p["mu"], p["sigma"], p["T"], p["n_steps"], n_paths, p["K"], p["r"])
+    else:
+        price, se = barrier_price_mc(p["S0"], p["mu"], p["sigma"], p["n_steps"], n_paths, p["K"], p["barrier"], p["r"], p["T"], bridge=bool(p["bridge"]))
+    return {"price": float(price), "se": float(se)}
+
+def _spec_and_params(p):
+    if p["product"] == "asian":
+        return ASIAN_SPEC, asian_params(p["K"])
+    return BARRIER_SPEC, barrier_params(p["K"], p["barrier"], bridge=bool(p["bridge"]))
+
+def _variance_cost_point(p):
+    """Mean, variance and cost (s per path) of the level-l correction."""
+    spec, params = _spec_and_params(p)
+    mean, var, cost = _single_level_calc(spec, params, p["S0"], p["mu"], p["sigma"], p["level"], p["n_paths"], p["r"], p["T"])
+    return {"mean": float(mean), "var": float(var), "cost": float(cost) * 1e-9}
+
+def _mlmc_vs_mc_point(p):
+    """Wall time, price and SE of MLMC and of a pilot-sized single-level MC at the same epsilon (as in *_mlmc_vs_mc.py)."""
+    eps, T = p["epsilon"], p["T"]
+    if p["product"] == "asian":
+        L, n_steps = p["L"], int(np.ceil(2 * T / eps))
+    elif p["bridge"]:
+        L = int(np.ceil(np.log2(2 * T / eps)))
+        n_steps = 2**L
+    else:
+        L, n_steps = int(np.ceil(np.log2(4 * T / eps**2))), int(np.ceil(4 * T / eps**2))
+
+    def mlmc_run():
+        if p["product"] == "asian":
+            return mlmc_asian(p["S0"], p["mu"], p["sigma"], L, p["K"], p["r"], T, eps)
+        return mlmc_barrier(p["S0"], p["mu"], p["sigma"], L, p["K"], p["barrier"], p["r"], T, eps, bridge=bool(p["bridge"]))
+
+    def mc_run(n_paths):
+        if p["product"] == "asian":
+            return asian_price_mc(p["S0"], p["mu"], p["sigma"], T, n_steps, n_paths, p["K"], p["r"])
+        return barrier_price_mc(p["S0"], p["mu"], p["sigma"], n_steps, n_paths, p["K"], p["barrier"], p["r"], T, bridge=bool(p["bridge"]))
+
+    start = time.perf_counter()
+    price, se = mlmc_run()
+    mlmc_time = time.perf_counter() - start
+    start = time.perf_counter()
+    _, se0 = mc_run(p["n_paths0"])
+    mc_price, mc_se = mc_run(int(np.ceil(p["n_paths0"] * (2 * se0 / eps)**2)))
+    mc_time = time.perf_counter() - start
+    return {"L": L, "n_steps": n_steps, "mlmc_time": mlmc_time, "mlmc_price": float(price), "mlmc_se": float(se),
+            "mc_time": mc_time, "mc_price": float(mc_price), "mc_se": float(mc_se)}
+
+'''
+Plots (from cached points only)
+'''
+def _title(model):
+    if model["product"] == "asian":
+        return "Asian call"
+    return "Barrier call" + (" (bridge)" if model["bridge"] else "")
+
+def _plot_convergence(plt, model, points):
+    ref = next(res for p, res in points if p["n_steps"] == p["n_steps_ref"])
+    rows = sorted((p["n_steps"], res) for p, res in points if p["n_steps"] != p["n_steps_ref"])
+    steps = np.array([n for n, _ in rows])
+    prices = np.array([res["price"] for _, res in rows])
+    ses = np.array([res["se"] for _, res in rows])
+    hs = model["T"] / steps
+
+    fig1 = plt.figure()
+    plt.loglog(hs, np.abs(prices - ref["price"]), marker="o")
+    plt.xlabel("time step h = T / n_steps, smaller is better")
+    plt.ylabel("|price - reference|")
+    plt.title(f"{_title(model)}: discretization bias vs time step")
+    plt.grid(True, which="both")
+
+    fig2 = plt.figure()
+    plt.errorbar(steps, prices, yerr=ses, fmt="o")
+    plt.axhline(ref["price"], linestyle="--")
+    plt.xlabel("n_steps")
+    plt.ylabel("price")
+    plt.title(f"{_title(model)}: price vs n_steps (with MC SE)")
+    plt.grid(True)
+    return [fig1, fig2]
+
+def _plot_variance_cost(plt, model, points):
+    rows = sorted((p["level"], res) for p, res in points)
+    levels = np.array([level for level, _ in rows])
+    vars = np.array([res["var"] for _, res in rows])
+    costs = np.array([res["cost"] for _, res in rows])
+    hs = model["T"] / 2.0**levels
+    fit = levels >= 2
+    beta, _ = np.polyfit(np.log(hs[fit]), np.log(vars[fit]), 1)
+    anchor = min(4, len(levels) - 1)
+
+    fig1 = plt.figure()
+    plt.loglog(hs, vars, marker="o")
+    plt.loglog(hs, vars[anchor] * (hs / hs[anchor])**beta, linestyle="--", label=f"O(h^{beta:.3g}) reference")
+    plt.xlabel("time step h = T / n_steps, smaller is better")
+    plt.ylabel("Correction sample variance")
+    plt.title(f"{_title(model)}: Correction sample variance decay")
+    plt.grid(True, which="both")
+    plt.legend()
+
+    fig2 = plt.figure()
+    plt.semilogy(levels, costs, marker="o")
+    plt.semilogy(levels, costs[anchor] * 2.0**(levels - levels[anchor]), linestyle="--", label="O(2^l) reference")
+    plt.xlabel("level, larger is better")
+    plt.ylabel("cost (s)")
+    plt.title(f"{_title(model)}: Cost per level (s)")
+    plt.grid(True, which="both")
+    plt.legend()
+    return [fig1, fig2]
+
+def _plot_mlmc_vs_mc(plt, model, points):
+    rows = sorted(((p["epsilon"], res) for p, res in points), reverse=True)
+    eps = np.array([e for e, _ in rows])
+    mlmc_costs = np.array([res["mlmc_time"] for _, res in rows])
+    mc_costs = np.array([res["mc_time"] for _, res in rows])
+    # complexity exponents of the README: MC eps^-3 (Asian, bridge barrier) / eps^-4, MLMC eps^-2 / eps^-3
+    rough = model["product"] != "asian" and not model["bridge"]
+    mc_rate, mlmc_rate = (4, 3) if rough else (3, 2)
+
+    fig = plt.figure(figsize=(7, 5))
+    plt.loglog(eps, mlmc_costs, "o-", label="MLMC")
+    plt.loglog(eps, mc_costs, "o-", label="Standard MC")
+    plt.loglog(eps, mlmc_costs[0] * (eps / eps[0])**(-mlmc_rate), "--", label=rf"$O(\varepsilon^{{-{mlmc_rate}}})$")
+    plt.loglog(eps, mc_costs[0] * (eps / eps[0])**(-mc_rate), "--", label=rf"$O(\varepsilon^{{-{mc_rate}}})$")
+    plt.xlabel(r"Target accuracy $\varepsilon$")
+    plt.ylabel("Runtime (seconds)")
+    plt.title(f"Cost vs Accuracy ({_title(model)})")
+    plt.grid(True, which="both", linestyle="--", alpha=0.6)
+    plt.legend()
+    plt.tight_layout()
+    return [fig]
+
+'''
+Experiment registry: axis, its default values, extra per-point settings, compute and plot
+'''
+EXPERIMENTS = {
+    "convergence": {
+        "axis": "n_steps",
+        "values": lambda model: [16, 32, 64, 128, 256, 512],
+        "settings": {"n_paths": 50000, "n_paths_ref": 300000, "n_steps_ref": 4096},
+        "compute": _convergence_point,
+        "plot": _plot_convergence,
+    },
+    "variance_cost": {
+        "axis": "level",
+        "values": lambda model: list(range(11)),
+        "settings": {"n_paths": 50000},
+        "compute": _variance_cost_point,
+        "plot": _plot_variance_cost,
+    },
+    "mlmc_vs_mc": {
+        "axis": "epsilon",
+        "values": lambda model: ([0.2, 0.1, 0.05, 0.025, 0.0125, 0.00625, 0.003125] if model["product"] == "asian"
+                                 else [0.2, 0.1, 0.05, 0.025, 0.0125, 0.00625] if model["bridge"] else [0.2, 0.1, 0.05, 0.025, 0.0125]),
+        "settings": {"L": 10, "n_paths0": 20000},
+        "compute": _mlmc_vs_mc_point,
+        "plot": _plot_mlmc_vs_mc,
+    },
+}
+
+'''
+Grid expansion and cache
+'''
+# model parameters that are always floats: --grid K=100 must key and label like the default K=100.0
+FLOAT_MODEL_FIELDS = {name for name in DEFAULT_MODEL if name not in ("product", "bridge")}
+
+def _parse_value(text, name=None):
+    if name in FLOAT_MODEL_FIELDS:
+        return float(text)
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+def parse_grid(items):
+    """['sigma=0.1,0.2', 'product=asian'] -> {'sigma': [0.1, 0.2], 'product': ['asian']}"""
+    grid = {}
+    for item in items or []:
+        name, sep, values = item.partition("=")
+        if not sep or not values:
+            raise ValueError(f"grid entries look like name=v1,v2,..., got {item!r}")
+        grid[name] = [_parse_value(v, name) for v in values.split(",")]
+    return grid
+
+def expand_grid(experiment, grid):
+    """All points of the sweep: the model grid crossed with the axis values (default ones unless the axis is in the grid)."""
+    exp = EXPERIMENTS[experiment]
+    known = set(DEFAULT_MODEL) | set(exp["settings"]) | {exp["axis"]}
+    unknown = set(grid) - known
+    if unknown:
+        raise ValueError(f"unknown parameters {sorted(unknown)} for {experiment}; expected some of {sorted(known)}")
+    fixed = {name: values for name, values in grid.items() if name != exp["axis"]}
+    points = []
+    for combo in itertools.product(*fixed.values()):
+        base = dict(DEFAULT_MODEL, **exp["settings"])
+        base.update(zip(fixed, combo))
+        axis_values = grid.get(exp["axis"]) or exp["values"](base)
+        if experiment == "convergence" and base["n_steps_ref"] not in axis_values:
+            axis_values = list(axis_values) + [base["n_steps_ref"]]
+        points += [dict(base, **{exp["axis"]: value}) for value in axis_values]
+    return points
+
+def code_version():
+    """Hash of the mlmc sources and this file: cached points are recomputed whenever either changes."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = sorted(os.path.join(root, "mlmc", name) for name in os.listdir(os.path.join(root, "mlmc")) if name.endswith(".py"))
+    digest = hashlib.sha256()
+    for path in paths + [os.path.abspath(__file__)]:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def point_key(experiment, point, version):
+    payload = json.dumps({"experiment": experiment, "point": point, "code": version}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+def _cache_path(cache_dir, experiment, key):
+    return os.path.join(cache_dir, experiment, f"{key}.json")
+
+def load_point(cache_dir, experiment, key):
+    try:
+        with open(_cache_path(cache_dir, experiment, key)) as f:
+            return json.load(f)["result"]
+    except FileNotFoundError:
+        return None
+
+def _store_point(cache_dir, experiment, key, point, version, result):
+    path = _cache_path(cache_dir, experiment, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"experiment": experiment, "point": point, "code": version, "result": result}, f, indent=1)
+    os.replace(tmp, path)
+
+'''
+Runner
+'''
+def _init_worker():
+    warmup()
+
+def _compute_point(experiment, point, key):
+    seed(int(key[:8], 16))
+    return EXPERIMENTS[experiment]["compute"](point)
+
+def _log(message):
+    print(message, file=sys.stderr)
+
+def run_sweep(experiment, grid, workers=None, cache_dir=CACHE_DIR, progress=_log):
+    """Compute every missing point of the sweep on a process pool; returns [(point, result)] in grid order."""
+    version = code_version()
+    points = expand_grid(experiment, grid)
+    keys = [point_key(experiment, point, version) for point in points]
+    results = [load_point(cache_dir, experiment, key) for key in keys]
+    missing = [i for i, res in enumerate(results) if res is None]
+    progress(f"{experiment}: {len(points)} points, {len(points) - len(missing)} cached, computing {len(missing)}")
+    if missing:
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker) as pool:
+            jobs = {pool.submit(_compute_point, experiment, points[i], keys[i]): i for i in missing}
+            for done, job in enumerate(as_completed(jobs), 1):
+                i = jobs[job]
+                results[i] = job.result()
+                _store_point(cache_dir, experiment, keys[i], points[i], version, results[i])
+                progress(f"  [{done}/{len(missing)}] {_point_label(experiment, points[i])}")
+    return list(zip(points, results))
+
+def _point_label(experiment, point):
+    changed = {name: value for name, value in point.items() if DEFAULT_MODEL.get(name, object()) != value and name in DEFAULT_MODEL}
+    return " ".join(f"{name}={value}" for name, value in {**changed, EXPERIMENTS[experiment]["axis"]: point[EXPERIMENTS[experiment]["axis"]]}.items())
+
+def plot_sweep(experiment, points, out=None):
+    """Draw the experiment's plots for every model of the sweep; save PNGs under `out` or show them."""
+    import matplotlib
+    if out is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    axis = EXPERIMENTS[experiment]["axis"]
+    groups = {}
+    for point, result in points:
+        model = {name: value for name, value in point.items() if name != axis}
+        groups.setdefault(json.dumps(model, sort_keys=True), (model, []))[1].append((point, result))
+    for model, members in groups.values():
+        figures = EXPERIMENTS[experiment]["plot"](plt, model, members)
+        if out is not None:
+            os.makedirs(out, exist_ok=True)
+            stem = experiment + "_" + point_key(experiment, model, "")[:8]
+            for i, fig in enumerate(figures):
+                fig.savefig(os.path.join(out, f"{stem}_{i}.png"), dpi=120)
+                plt.close(fig)
+    if out is None:
+        plt.show()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel, cached parameter sweeps of the MLMC experiments")
+    parser.add_argument("experiment", choices=sorted(EXPERIMENTS))
+    parser.add_argument("--grid", nargs="*", default=[], help="name=v1,v2,... (model parameters, experiment settings or the axis)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--cache", default=CACHE_DIR, help="cache directory")
+    parser.add_argument("--plot", action="store_true", help="plot the sweep once it is computed")
+    parser.add_argument("--out", help="save the plots as PNGs here instead of showing them")
+    args = parser.parse_args(argv)
+
+    points = run_sweep(args.experiment, parse_grid(args.grid), workers=args.workers, cache_dir=args.cache)
+    if args.plot or args.out:
+        plot_sweep(args.experiment, points, out=args.out)
+    else:
+        print(json.dumps([dict(point=point, result=result) for point, result in points], indent=1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import numpy as np
+from numba import njit
+import time
+from mlmc.engine import _mlmc_from_level_calc, _sums_to_level_stats, _level_return, _accumulate_power_sums
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.sde import _brownian_bridge_calc
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Adaptive (path-dependent) time-stepping for the up-and-out barrier call
+
+Instead of a uniform grid, each path is built top-down on the dyadic tree
+of [0, T]: S_T is drawn first, and an interval of length h = T / 2^d is only
+split (its midpoint drawn from the Brownian bridge, which does not depend
+on the drift) when an endpoint is within near * sigma * sqrt(h) of the
+barrier in log-space. Level l allows depth l, so paths far from the barrier
+cost a handful of normals while paths that approach it get the full 2^l
+resolution exactly where it matters.
+
+Coupling: the coarse estimator uses the same rule capped at depth l-1 on
+the same tree, so its intervals are a subset of the fine ones and the two
+only differ on near-barrier intervals at depth l-1, which the fine path
+splits once more. With bridge=True each unsplit interval is tested with its
+exact crossing probability; an interval that is a leaf of both trees uses
+one uniform for both, and the split ones use the min-of-two-uniforms
+coupling of the uniform-grid kernels.
+
+Missing a crossing inside an unsplit interval needs the path to travel more
+than near * sigma * sqrt(h) from both endpoints, probability below
+exp(-2 near^2), so without the bridge the bias matches the uniform grid of
+the same level up to that (1.5e-8 for near = 3).
+'''
+@njit(nogil=True)
+def _adaptive_barrier_level_power_sums(S0, mu, sigma, T, level, n_paths, strike_price, barrier, r, bridge=False, near=3.0, key=-1):
+    """Return (power sums of the level-l corrections, total normals drawn)."""
+    b = np.log(barrier)
+    x0 = np.log(S0)
+    drift = mu - 0.5 * sigma * sigma
+    disc = np.exp(-r * T)
+    has_coarse = level > 0
+
+    # DFS stack of pending intervals: depth, left and right log-price
+    stack_depth = np.zeros(level + 2, dtype=np.int64)
+    stack_left = np.zeros(level + 2)
+    stack_right = np.zeros(level + 2)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros(4)
+    n_normals = 0
+
+    for p in range(n_paths):
+        if kz == BLOCK_SIZE:
+            kz = _fill_normals(keys, normals)
+        x_T = x0 + drift * T + sigma * np.sqrt(T) * normals[kz]
+        kz += 1
+        n_normals += 1
+        knocked_f = x0 >= b or x_T >= b
+        knocked_c = knocked_f or not has_coarse
+
+        sp = 0
+        stack_depth[0] = 0
+        stack_left[0] = x0
+        stack_right[0] = x_T
+        sp = 1
+        while sp > 0 and not (knocked_f and knocked_c):
+            sp -= 1
+            d = stack_depth[sp]
+            x_l = stack_left[sp]
+            x_r = stack_right[sp]
+            h = T / 2.0**d
+            is_near = b - max(x_l, x_r) < near * sigma * np.sqrt(h)
+            fine_split = is_near and d < level
+            coarse_split = is_near and d < level - 1
+
+            if not fine_split:
+                # leaf of both trees (a fine leaf here is never below a coarse one)
+                if bridge:
+                    if ku == BLOCK_SIZE:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u = uniforms[ku]
+                    ku += 1
+                    if u < _brownian_bridge_calc(x_l, x_r, h, b, sigma):
+                        knocked_f = True
+                        knocked_c = True
+                continue
+
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x_m = 0.5 * (x_l + x_r) + 0.5 * sigma * np.sqrt(h) * normals[kz]
+            kz += 1
+            n_normals += 1
+
+            if has_coarse and not coarse_split:
+                # coarse leaf at depth l-1, fine splits it into two depth-l leaves
+                if x_m >= b:
+                    knocked_f = True
+                if bridge:
+                    if ku > BLOCK_SIZE - 2:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u1 = uniforms[ku]
+                    u2 = uniforms[ku + 1]
+                    ku += 2
+                    u_min = u1 if u1 < u2 else u2
+                    uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+                    if not knocked_c and uc < _brownian_bridge_calc(x_l, x_r, h, b, sigma):
+                        knocked_c = True
+                    if not knocked_f:
+                        if u1 < _brownian_bridge_calc(x_l, x_m, 0.5 * h, b, sigma):
+                            knocked_f = True
+                        elif u2 < _brownian_bridge_calc(x_m, x_r, 0.5 * h, b, sigma):
+                            knocked_f = True
+                continue
+
+            # both trees split: the midpoint is a node of both
+            if x_m >= b:
+                knocked_f = True
+                knocked_c = True
+            stack_depth[sp] = d + 1
+            stack_left[sp] = x_m
+            stack_right[sp] = x_r
+            stack_depth[sp + 1] = d + 1
+            stack_left[sp + 1] = x_l
+            stack_right[sp + 1] = x_m
+            sp += 2
+
+        S_T = np.exp(x_T)
+        payoff = S_T - strike_price if S_T > strike_price else 0.0
+        correction = (0.0 if knocked_f else payoff) - (0.0 if knocked_c or not has_coarse else payoff)
+        _accumulate_power_sums(sums, disc * correction)
+
+    return sums, n_normals
+
+'''
+Single level correction, sample variance, and cost calculations
+'''
+def _single_level_calc_adaptive_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_correction_sum=False, return_power_sums=False,
+                                        bridge=False, near=3.0, profiler=NULL_PROFILER):
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_adaptive_barrier_level_power_sums], level=level):
+        sums, n_normals = _adaptive_barrier_level_power_sums(S0, mu, sigma, T, level, n_paths, strike_price, barrier, r, bridge, near)
+    end = time.perf_counter_ns()
+    profiler.count(f"adaptive.normals.level_{level}", int(n_normals))
+    with profiler.span("reduce", level=level):
+        mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    cost = end - start
+    return _level_return(mean, var, cost / n_paths, sums, return_correction_sum, return_power_sums)
+
+def mean_steps_per_path(S0, mu, sigma, level, strike_price, barrier, T, bridge=False, near=3.0, n_paths=20000):
+    """Average number of normals (time steps) an adaptive level-l path draws; 2^l on the uniform grid."""
+    _, n_normals = _adaptive_barrier_level_power_sums(float(S0), float(mu), float(sigma), float(T), level, n_paths, float(strike_price), float(barrier), 0.0, bridge, near)
+    return n_normals / n_paths
+
+'''
+MLMC Estimator
+'''
+def mlmc_barrier_adaptive(S0, mu, sigma, max_level, strike_price, barrier, r, T, epsilon, bridge=False, near=3.0, profiler=NULL_PROFILER, return_result=False, extrapolate=False):
+    """MLMC price and SE of the up-and-out call with adaptive time-stepping (drop-in for mlmc_barrier)."""
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    strike_price, barrier = float(strike_price), float(barrier)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc_adaptive_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_power_sums=True,
+                                                   bridge=bridge, near=near, profiler=profiler)
+
+    return _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=1000, profiler=profiler, return_result=return_result, T=T, extrapolate=extrapolate)
@@ -0,0 +1,56 @@
+import math
+
+'''
+Closed-form GBM prices used as control-variate means
+
+All functions return *undiscounted* expectations under the drift mu
+(E[payoff] with dS = mu S dt + sigma S dW), so they can be used for any
+mu / r combination the simulators accept.
+'''
+def _norm_cdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2.0))
+
+def _lognormal_call(m, v, strike_price):
+    """E[max(exp(X) - K, 0)] for X ~ N(m, v)."""
+    if v <= 0.0:
+        return max(math.exp(m) - strike_price, 0.0)
+    sd = math.sqrt(v)
+    d2 = (m - math.log(strike_price)) / sd
+    return math.exp(m + 0.5 * v) * _norm_cdf(d2 + sd) - strike_price * _norm_cdf(d2)
+
+def european_call(S0, mu, sigma, T, strike_price):
+    return _lognormal_call(math.log(S0) + (mu - 0.5 * sigma**2) * T, sigma**2 * T, strike_price)
+
+def geometric_asian_call(S0, mu, sigma, T, n_steps, strike_price):
+    """Discretely monitored geometric-average call on the n_steps + 1 points t_i = i T / n_steps (S0 included).
+
+    log G = mean_i log S(t_i) is normal with mean log S0 + (mu - sigma^2/2) T/2
+    and variance sigma^2 T (2n + 1) / (6 (n + 1)).
+    """
+    n = n_steps
+    m = math.log(S0) + (mu - 0.5 * sigma**2) * 0.5 * T
+    v = sigma**2 * T * (2 * n + 1) / (6.0 * (n + 1))
+    return _lognormal_call(m, v, strike_price)
+
+def up_and_out_call(S0, mu, sigma, T, strike_price, barrier):
+    """Continuously monitored up-and-out call (Reiner-Rubinstein), K < B."""
+    if S0 >= barrier or strike_price >= barrier:
+        return 0.0
+    sd = sigma * math.sqrt(T)
+    lam = (mu - 0.5 * sigma**2) / sigma**2
+    growth = math.exp(mu * T)
+    hs = barrier / S0
+
+    def term(x, y_scale, sign):
+        # S N(sign x) - K e^{-mu T} N(sign (x - sd)), optionally reflected through the barrier
+        return (y_scale[0] * S0 * _norm_cdf(sign * x)
+                - y_scale[1] * strike_price / growth * _norm_cdf(sign * (x - sd)))
+
+    x1 = math.log(S0 / strike_price) / sd + (1 + lam) * sd
+    x2 = math.log(S0 / barrier) / sd + (1 + lam) * sd
+    y1 = math.log(barrier**2 / (S0 * strike_price)) / sd + (1 + lam) * sd
+    y2 = math.log(barrier / S0) / sd + (1 + lam) * sd
+    plain = (1.0, 1.0)
+    reflected = (hs ** (2 * (lam + 1)), hs ** (2 * lam))
+    price = term(x1, plain, 1) - term(x2, plain, 1) + term(y1, reflected, -1) - term(y2, reflected, -1)
+    return max(price, 0.0) * growth
@@ -0,0 +1,103 @@
+import time
+import numpy as np
+from mlmc.engine import _single_level_calc
+from mlmc.profiling import NULL_PROFILER
+from mlmc.rates import fit_rates
+from mlmc.result import _build_result, _level_moments, _bias_from_means
+
+'''
+Anytime (deadline-driven) MLMC
+
+    for snap in mlmc_stream(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 8, 0.05, 1.0, deadline=0.05):
+        print(snap.price, snap.se, snap.n_samples)
+
+Yields an MLMCResult snapshot after every batch, starting with a small pilot
+on the first levels, so the first estimate is available within a few ms.
+Batches grow geometrically in wall time. Each one tops levels up towards the
+cost-optimal N_l ~ sqrt(V_l / C_l) for all the work done so far including
+the batch, so the estimate at any moment is close to what a one-shot MLMC
+run of the same cost would have produced. A finer level is added whenever
+the bias estimate exceeds the current SE.
+
+Stop early by breaking out of the loop (or calling .close()), by passing a
+`cancel` object with is_set() (e.g. threading.Event) that another thread
+sets, or with `deadline` (seconds from the call).
+'''
+def _anytime_from_level_calc(level_calc, max_level, T=1.0, deadline=None, cancel=None, n_first=100, start_levels=3,
+                             first_batch=0.002, growth=2.0, profiler=NULL_PROFILER):
+    start = time.perf_counter_ns()
+    end = None if deadline is None else start + deadline * 1e9
+    power_sums = np.zeros((max_level+1, 4))
+    n_samples = np.zeros(max_level+1, dtype=np.int64)
+    time_ns = np.zeros(max_level+1)
+
+    def draw(level, n):
+        _, _, cost_p_path, sums = level_calc(level, int(n))
+        power_sums[level] += sums
+        n_samples[level] += n
+        time_ns[level] += cost_p_path * n
+
+    def snapshot(top):
+        return _build_result(power_sums[:top+1], n_samples[:top+1], time_ns[:top+1], float("nan"), T=T)
+
+    def stopped():
+        return (cancel is not None and cancel.is_set()) or (end is not None and time.perf_counter_ns() >= end)
+
+    top = min(start_levels, max_level+1) - 1
+    with profiler.span("pilot", samples=n_first * (top + 1)):
+        for level in range(top+1):
+            draw(level, n_first)
+    yield snapshot(top)
+
+    batch_ns = first_batch * 1e9
+    while not stopped():
+        means, vars, _ = _level_moments(power_sums[:top+1], n_samples[:top+1])
+        costs = time_ns[:top+1] / n_samples[:top+1]
+        se = np.sqrt(np.sum(vars / n_samples[:top+1]))
+        if top < max_level and top >= 1:
+            alpha = fit_rates(means, vars, costs, T=T, start=1)["alpha"] if top >= 2 else float("nan")
+            if _bias_from_means(means, alpha) > se:
+                top += 1
+                with profiler.span("pilot", level=top, samples=n_first):
+                    draw(top, n_first)
+                profiler.count("anytime.levels_added")
+                yield snapshot(top)
+                continue
+
+        if end is not None:
+            batch_ns = min(batch_ns, max(end - time.perf_counter_ns(), 0))
+        root_vc = np.sqrt(np.maximum(vars, 1e-300) * costs)
+        work = np.sum(time_ns[:top+1]) + batch_ns
+        target = work * np.sqrt(np.maximum(vars, 1e-300) / costs) / np.sum(root_vc)
+        deficit = np.maximum(target - n_samples[:top+1], 0.0)
+        deficit_ns = np.sum(deficit * costs)
+        if deficit_ns > 0:
+            deficit *= min(batch_ns / deficit_ns, 1.0)
+        with profiler.span("refine", samples=int(deficit.sum())):
+            for level in range(top+1):
+                if deficit[level] >= 1 and not stopped():
+                    draw(level, np.floor(deficit[level]))
+        profiler.count("anytime.batches")
+        yield snapshot(top)
+        batch_ns *= growth
+
+def mlmc_stream(spec, params, S0, mu, sigma, max_level, r, T, deadline=None, cancel=None, profiler=NULL_PROFILER, **schedule):
+    """Generator of MLMCResult snapshots for the product `spec`; see the module docstring.
+
+    `schedule` is passed on to the scheduler (n_first, start_levels, first_batch, growth).
+    """
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_power_sums=True, profiler=profiler)
+
+    return _anytime_from_level_calc(level_calc, max_level, T=T, deadline=deadline, cancel=cancel, profiler=profiler, **schedule)
+
+def mlmc_anytime(spec, params, S0, mu, sigma, max_level, r, T, deadline, callback=None, cancel=None, profiler=NULL_PROFILER, **schedule):
+    """Callback form of mlmc_stream: callback(snapshot) after every batch, returning False stops; returns the last snapshot."""
+    last = None
+    for snap in mlmc_stream(spec, params, S0, mu, sigma, max_level, r, T, deadline=deadline, cancel=cancel, profiler=profiler, **schedule):
+        last = snap
+        if callback is not None and callback(snap) is False:
+            break
+    return last
@@ -0,0 +1,232 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from mlmc.engine import mlmc_multi
+from mlmc.service import PRODUCTS, _init_worker, _parse_request
+
+'''
+Bulk pricing of trade files
+
+    python -m mlmc.batch trades.csv prices.csv --workers 8
+    python -m mlmc.batch trades.parquet prices.jsonl --chunk-size 20000
+
+Trades are rows of a .csv, .jsonl or .parquet file (parquet needs pyarrow)
+with the fields of a pricing-service request: id, product ("asian" or
+"barrier"), S0, mu, sigma, r, T, K, B and bridge for barriers, max_level and
+epsilon. mu defaults to r and a missing id to the row number.
+
+The file is read chunk_size trades at a time. Within a chunk, trades of the
+same product on the same model (S0, mu, sigma, r, T, max_level) are priced
+together by mlmc_multi on shared paths, max_batch at a time, on warm worker
+processes; sorting the file by underlying therefore makes the batches
+larger. At most `workers * 2` batches are in flight, so memory is bounded
+by the chunk and not by the file.
+
+Each result (id, price, se, per-level n_samples and variances, the
+extrapolated bias and any MLMCResult.diagnostics warnings, or an error) is
+appended to the .csv or .jsonl output as soon as its batch finishes, in
+completion order. Rerunning the same command after a crash skips every id
+already in the output (a partly written last line is dropped) and prices
+the rest.
+'''
+OUTPUT_FIELDS = ("id", "price", "se", "n_samples", "variances", "bias", "warnings", "error")
+
+'''
+Trade input
+'''
+def _format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".csv", ".jsonl", ".parquet"):
+        raise ValueError(f"unsupported file type {ext!r}; expected .csv, .jsonl or .parquet")
+    return ext
+
+def _read_rows(path):
+    ext = _format(path)
+    if ext == ".csv":
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+    elif ext == ".jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("reading .parquet trade files requires pyarrow") from None
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=65536):
+            yield from record_batch.to_pylist()
+
+def _to_request(row, row_number):
+    """Service request dict of a trade row, blanks dropped.
+
+    Numbers stay as read: _parse_request converts them, so a bad cell becomes that trade's error row instead of
+    stopping the run.
+    """
+    req = {name: value for name, value in row.items() if value is not None and value != ""}
+    if "bridge" in req:
+        req["bridge"] = str(req["bridge"]).strip().lower() in ("1", "1.0", "true", "yes")
+    if "mu" not in req and "r" in req:
+        req["mu"] = req["r"]
+    req["id"] = str(req.get("id", row_number))
+    return req
+
+def read_trades(path, chunk_size=10000):
+    """Yield lists of at most chunk_size trade requests."""
+    chunk = []
+    for row_number, row in enumerate(_read_rows(path)):
+        chunk.append(_to_request(row, row_number))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _batches(chunks, done_ids, max_batch):
+    """(key, ids, rows, epsilons) batches of one chunk at a time, or (None, [id], error) for malformed trades."""
+    for chunk in chunks:
+        groups = {}
+        for req in chunk:
+            if req["id"] in done_ids:
+                continue
+            try:
+                key, row, epsilon = _parse_request(req)
+            except (ValueError, TypeError) as exc:
+                yield None, [req["id"]], f"{type(exc).__name__}: {exc}"
+                continue
+            groups.setdefault(key, []).append((req["id"], row, epsilon))
+        for key, items in groups.items():
+            for start in range(0, len(items), max_batch):
+                part = items[start:start + max_batch]
+                yield key, [i for i, _, _ in part], ([row for _, row, _ in part], [eps for _, _, eps in part])
+
+'''
+Worker side
+'''
+def _price_batch(product, model, rows, epsilons):
+    spec = PRODUCTS[product][0]
+    S0, mu, sigma, r, T, max_level = model
+    results = mlmc_multi(spec, np.array(rows), S0, mu, sigma, int(max_level), r, T, epsilons, return_result=True)
+    return [{
+        "price": float(res.price), "se": float(res.se),
+        "n_samples": [int(n) for n in res.n_samples], "variances": [float(v) for v in res.variances],
+        "bias": float(res.bias_estimate()), "warnings": res.diagnostics(),
+    } for res in results]
+
+'''
+Result output
+'''
+class ResultWriter:
+    """Appends one result per line to a .csv or .jsonl file, flushed per batch; knows the ids already written."""
+    def __init__(self, path):
+        self.ext = _format(path)
+        if self.ext == ".parquet":
+            raise ValueError("results are written as .csv or .jsonl (append-only, so that runs can resume)")
+        self.done_ids = set()
+        if os.path.exists(path):
+            _drop_partial_line(path)
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self.done_ids = self._read_ids(path)
+        self.f = open(path, "a", newline="")
+        if self.ext == ".csv":
+            self.writer = csv.DictWriter(self.f, fieldnames=OUTPUT_FIELDS)
+            if not exists:
+                self.writer.writeheader()
+
+    def _read_ids(self, path):
+        with open(path, newline="") as f:
+            if self.ext == ".csv":
+                return {row["id"] for row in csv.DictReader(f)}
+            return {json.loads(line)["id"] for line in f if line.strip()}
+
+    def write(self, results):
+        for res in results:
+            if self.ext == ".csv":
+                self.writer.writerow({
+                    name: ";".join(map(str, value)) if isinstance(value, list) else value
+                    for name, value in res.items()
+                })
+            else:
+                self.f.write(json.dumps(res) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def _drop_partial_line(path):
+    """Truncate the file after its last newline (a crash mid-write leaves at most one partial line)."""
+    with open(path, "r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                f.truncate(pos - step + newline + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+'''
+Driver
+'''
+def price_file(trades_path, output_path, workers=None, chunk_size=10000, max_batch=64, progress=None):
+    """Price every trade of `trades_path` not yet in `output_path`, appending results; returns (priced, failed)."""
+    workers = workers or os.cpu_count()
+    out = ResultWriter(output_path)
+    priced = failed = 0
+    pending = {}
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            def collect(block):
+                nonlocal priced, failed
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED if block else ALL_COMPLETED)
+                for job in finished:
+                    ids = pending.pop(job)
+                    if job.exception() is not None:
+                        error = f"{type(job.exception()).__name__}: {job.exception()}"
+                        out.write([{"id": i, "error": error} for i in ids])
+                        failed += len(ids)
+                    else:
+                        out.write([dict(id=i, **res) for i, res in zip(ids, job.result())])
+                        priced += len(ids)
+                if progress is not None:
+                    progress(f"{priced} priced, {failed} failed")
+
+            for key, ids, payload in _batches(read_trades(trades_path, chunk_size), out.done_ids, max_batch):
+                if key is None:
+                    out.write([{"id": ids[0], "error": payload}])
+                    failed += 1
+                    continue
+                while len(pending) >= 2 * workers:
+                    collect(block=True)
+                product, model = key
+                pending[pool.submit(_price_batch, product, model, *payload)] = ids
+            if pending:
+                collect(block=False)
+    finally:
+        out.close()
+    return priced, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price a trade file with MLMC")
+    parser.add_argument("trades", help=".csv, .jsonl or .parquet trade file")
+    parser.add_argument("output", help=".csv or .jsonl result file (appended to; rerun to resume)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="trades read and grouped at a time")
+    parser.add_argument("--max-batch", type=int, default=64, help="trades priced together on shared paths")
+    args = parser.parse_args(argv)
+    priced, failed = price_file(args.trades, args.output, args.workers, args.chunk_size, args.max_batch,
+                                progress=lambda message: print(message, file=sys.stderr, flush=True))
+    print(f"{priced} trades priced, {failed} failed -> {args.output}")
+
+if __name__ == "__main__":
+    main()
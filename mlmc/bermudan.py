@@ -0,0 +1,294 @@
+import time
+import numpy as np
+from numba import njit
+from mlmc.engine import _level_kernel_args, _mlmc_from_level_calc, _accumulate_power_sums, _sums_to_level_stats
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Multilevel Longstaff-Schwartz for Bermudan exercise
+
+    price, se = mlmc_bermudan(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 5, 0.05, 1.0, 0.01, n_dates=12)
+    price, se = lsm_bermudan(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 5, 0.05, 1.0, 0.01, n_dates=12)
+
+Any PayoffSpec becomes Bermudan: at each of n_dates equally spaced dates
+(maturity included) the holder may take terminal(state, x, steps so far),
+the payoff as if the product ended there (the running average so far for an
+Asian). Level l uses n_dates * 2^l time steps, so every exercise date is a
+grid point on every level.
+
+Exercise policy per grid (Longstaff-Schwartz). n_regression paths are
+simulated on the grid, keeping only the log-price and the exercise value at
+each date. Going backwards from maturity, the discounted cash flow of the
+current policy is regressed on the compact basis
+
+    1, s, v, s^2, v^2, s v     (s = S / S0, v = exercise value / S0)
+
+over the in-the-money paths, and the path exercises where its exercise value
+beats the fitted continuation value. The basis does not depend on the cash
+flows, so the Gram matrices of all dates are formed in one batched einsum.
+The right-hand side at date k is the regression of the cash flow under the
+policy after k, so it cannot be formed before that policy is fitted: the
+right-hand sides and the 6x6 solves run in a backward Python loop over the
+in-memory (n_regression, n_dates) features, one np.linalg.solve per date.
+
+Coupling. Each grid has one policy, used wherever that grid appears: for
+P_l on level l (fine) and on level l+1 (coarse), so the levels telescope
+to E[P_L] under the grid-L policy. Any policy is admissible, and the
+features (s, v) hardly depend on the grid, so only the coarse grids
+0..policy_level are fitted and every finer grid reuses the last fit. Above
+it fine and coarse paths exercise by the very same rule on the same
+Brownian increments (and bridge uniforms), so they mostly exercise on the
+same date and the corrections are small; the fits also stay cheap. A
+policy fitted on grid 2 prices the grid-5 Asian within 0.005 of the
+grid-5 fit. As usual for LSM the price is low-biased by the policy's
+suboptimality; the pricing paths are independent of the regression paths.
+'''
+N_BASIS = 6
+
+def _basis(s, v):
+    """Basis functions (..., N_BASIS) at s = S / S0 and v = exercise value / S0."""
+    return np.stack([np.ones_like(s), s, v, s * s, v * v, s * v], axis=-1)
+
+@njit(nogil=True)
+def _continuation(coef, k, s, v):
+    """The fitted continuation value at date k, the same basis as _basis."""
+    return coef[k, 0] + coef[k, 1] * s + coef[k, 2] * v + coef[k, 3] * s * s + coef[k, 4] * v * v + coef[k, 5] * s * v
+
+@njit(nogil=True)
+def _exercise_features(S0, mu, sigma, T, level, n_dates, n_paths, r, params, n_state, init, step, active, terminal, uses_uniforms, key=-1):
+    """Log-price and exercise value (n_paths, n_dates) at every exercise date on the level-l grid."""
+    per_date = 2**level
+    dt = T / (n_dates * per_date)
+    drift = (mu - 0.5 * sigma * sigma) * dt
+    vol = sigma * np.sqrt(dt)
+
+    state = np.zeros(n_state)
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    xs = np.zeros((n_paths, n_dates))
+    values = np.zeros((n_paths, n_dates))
+
+    for p in range(n_paths):
+        init(state, x0, params)
+        x = x0
+        for k in range(n_dates):
+            for _ in range(per_date):
+                if not active(state, params):
+                    break
+                if kz == BLOCK_SIZE:
+                    kz = _fill_normals(keys, normals)
+                x_next = x + drift + vol * normals[kz]
+                kz += 1
+                u = 0.0
+                if uses_uniforms:
+                    if ku == BLOCK_SIZE:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u = uniforms[ku]
+                    ku += 1
+                step(state, x, x_next, dt, sigma, params, u)
+                x = x_next
+            xs[p, k] = x
+            values[p, k] = terminal(state, x, (k + 1) * per_date, params)
+
+    return xs, values
+
+@njit(nogil=True)
+def _exercise(coef, k, n_dates, x, x0, value, S0, disc_k):
+    """True if the policy exercises value (undiscounted) at date k."""
+    if value <= 0.0:
+        return False
+    if k == n_dates - 1:
+        return True
+    return disc_k * value >= _continuation(coef, k, np.exp(x - x0), value / S0)
+
+@njit(nogil=True)
+def _level_power_sums_bermudan(S0, mu, sigma, T, level, n_dates, n_paths, r, params, n_state, init, step, active, terminal,
+                               uses_uniforms, coef_fine, coef_coarse, coupled, key=-1):
+    """Power sums of the level-l corrections of the exercised cash flows, P_l under coef_fine minus P_{l-1} under coef_coarse.
+
+    With coupled=False (always at level 0) they are the sums of P_l alone.
+    """
+    per_date = 2**level
+    dt_fine = T / (n_dates * per_date)
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+
+    state_fine = np.zeros(n_state)
+    state_coarse = np.zeros(n_state)
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros(4)
+
+    for p in range(n_paths):
+        init(state_fine, x0, params)
+        init(state_coarse, x0, params)
+        x_fine = x0
+        x_coarse = x0
+        cash_fine = 0.0
+        cash_coarse = 0.0
+        done_fine = False
+        done_coarse = not coupled
+
+        for k in range(n_dates):
+            if done_fine and done_coarse:
+                break
+            if not coupled:
+                for _ in range(per_date):
+                    if not active(state_fine, params):
+                        break
+                    if kz == BLOCK_SIZE:
+                        kz = _fill_normals(keys, normals)
+                    x_next = x_fine + drift_fine + vol_fine * normals[kz]
+                    kz += 1
+                    u = 0.0
+                    if uses_uniforms:
+                        if ku == BLOCK_SIZE:
+                            ku = _fill_uniforms(keys, uniforms)
+                        u = uniforms[ku]
+                        ku += 1
+                    step(state_fine, x_fine, x_next, dt_fine, sigma, params, u)
+                    x_fine = x_next
+            else:
+                for _ in range(per_date // 2):
+                    if (done_fine or not active(state_fine, params)) and (done_coarse or not active(state_coarse, params)):
+                        break
+                    if kz > BLOCK_SIZE - 2:
+                        kz = _fill_normals(keys, normals)
+                    z1 = normals[kz]
+                    z2 = normals[kz + 1]
+                    kz += 2
+                    x_f1 = x_fine + drift_fine + vol_fine * z1
+                    x_f2 = x_f1 + drift_fine + vol_fine * z2
+                    x_c1 = x_coarse + 2.0 * drift_fine + vol_fine * (z1 + z2)
+
+                    u1 = 0.0
+                    u2 = 0.0
+                    uc = 0.0
+                    if uses_uniforms:
+                        if ku > BLOCK_SIZE - 2:
+                            ku = _fill_uniforms(keys, uniforms)
+                        u1 = uniforms[ku]
+                        u2 = uniforms[ku + 1]
+                        ku += 2
+                        u_min = u1 if u1 < u2 else u2
+                        # F_min(u) = 1 - (1-u)^2 maps the min of two uniforms back to Unif(0,1)
+                        uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+                    step(state_fine, x_fine, x_f1, dt_fine, sigma, params, u1)
+                    step(state_fine, x_f1, x_f2, dt_fine, sigma, params, u2)
+                    step(state_coarse, x_coarse, x_c1, dt_coarse, sigma, params, uc)
+                    x_fine = x_f2
+                    x_coarse = x_c1
+
+            disc_k = np.exp(-r * T * (k + 1) / n_dates)
+            if not done_fine:
+                value = terminal(state_fine, x_fine, (k + 1) * per_date, params)
+                if _exercise(coef_fine, k, n_dates, x_fine, x0, value, S0, disc_k):
+                    cash_fine = disc_k * value
+                    done_fine = True
+            if not done_coarse:
+                value = terminal(state_coarse, x_coarse, (k + 1) * (per_date // 2), params)
+                if _exercise(coef_coarse, k, n_dates, x_coarse, x0, value, S0, disc_k):
+                    cash_coarse = disc_k * value
+                    done_coarse = True
+
+        _accumulate_power_sums(sums, cash_fine - cash_coarse)
+
+    return sums
+
+def fit_exercise_policy(spec, params, S0, mu, sigma, level, r, T, n_dates, n_regression, profiler=NULL_PROFILER):
+    """Longstaff-Schwartz continuation coefficients (n_dates, N_BASIS) for the level-l grid (see module docstring)."""
+    args = _level_kernel_args(spec, params)
+    with profiler.span("regression", level=level, samples=n_regression), compile_watch(profiler, [_exercise_features], level=level):
+        xs, values = _exercise_features(S0, mu, sigma, T, level, n_dates, n_regression, r, *args)
+
+        discs = np.exp(-r * T * np.arange(1, n_dates + 1) / n_dates)
+        basis = _basis(np.exp(xs - np.log(S0)), values / S0)
+        itm = values > 0.0
+        # Gram matrices of every date at once; the right-hand sides depend on the policy after the date, so they and
+        # the solves go date by date, backwards
+        masked = basis * itm[..., None]
+        gram = np.einsum("nkb,nkc->kbc", masked, basis)
+        gram += 1e-10 * np.trace(gram, axis1=1, axis2=2)[:, None, None] * np.eye(N_BASIS)
+
+        coef = np.zeros((n_dates, N_BASIS))
+        cash = discs[-1] * values[:, -1]
+        for k in range(n_dates - 2, -1, -1):
+            if not np.any(itm[:, k]):
+                continue
+            coef[k] = np.linalg.solve(gram[k], masked[:, k].T @ cash)
+            exercise = itm[:, k] & (discs[k] * values[:, k] >= basis[:, k] @ coef[k])
+            cash = np.where(exercise, discs[k] * values[:, k], cash)
+    return coef
+
+def _single_level_calc_bermudan(spec, params, S0, mu, sigma, level, n_dates, n_paths, r, T, coef_fine, coef_coarse, coupled=True,
+                                profiler=NULL_PROFILER):
+    args = _level_kernel_args(spec, params)
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_power_sums_bermudan], level=level):
+        sums = _level_power_sums_bermudan(S0, mu, sigma, T, level, n_dates, n_paths, r, *args, coef_fine, coef_coarse,
+                                          coupled and level > 0)
+    cost = time.perf_counter_ns() - start
+    mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    return mean, var, cost / n_paths, sums
+
+def mlmc_bermudan(spec, params, S0, mu, sigma, max_level, r, T, epsilon, n_dates=12, n_regression=50000, policy_level=2,
+                  profiler=NULL_PROFILER, return_result=False):
+    """MLMC price and SE of `spec` with Bermudan exercise on n_dates dates (see module docstring).
+
+    Exercise policies are fitted from n_regression paths on grids
+    0..policy_level; finer grids reuse the policy of grid policy_level. The
+    driver then allocates N_l for SE <= epsilon/2 as usual.
+    """
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    policies = {}
+
+    def policy(level):
+        grid = min(level, policy_level)
+        if grid not in policies:
+            policies[grid] = fit_exercise_policy(spec, params, S0, mu, sigma, grid, r, T, n_dates, n_regression, profiler=profiler)
+        return policies[grid]
+
+    def level_calc(level, n_paths):
+        coarse = policy(level - 1) if level > 0 else np.zeros((n_dates, N_BASIS))
+        return _single_level_calc_bermudan(spec, params, S0, mu, sigma, level, n_dates, n_paths, r, T, policy(level), coarse,
+                                           profiler=profiler)
+
+    result = _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=spec.n_pilot, profiler=profiler, return_result=True, T=T)
+    if return_result:
+        return result
+    return result.price, result.se
+
+def lsm_bermudan(spec, params, S0, mu, sigma, level, r, T, epsilon, n_dates=12, n_regression=50000, n_pilot=None, profiler=NULL_PROFILER,
+                 return_result=False):
+    """Single-level Longstaff-Schwartz price and SE on the level-l grid, with enough pricing paths for SE <= epsilon/2.
+
+    The reference the multilevel version is measured against; return_result
+    gives an MLMCResult with the grid as its only level.
+    """
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    coef = fit_exercise_policy(spec, params, S0, mu, sigma, level, r, T, n_dates, n_regression, profiler=profiler)
+
+    def level_calc(_, n_paths):
+        return _single_level_calc_bermudan(spec, params, S0, mu, sigma, level, n_dates, n_paths, r, T, coef, coef, coupled=False,
+                                           profiler=profiler)
+
+    n_pilot = spec.n_pilot if n_pilot is None else n_pilot
+    result = _mlmc_from_level_calc(level_calc, 0, epsilon, n_pilot=n_pilot, profiler=profiler, return_result=True, T=T)
+    if return_result:
+        return result
+    return result.price, result.se
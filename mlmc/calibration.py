@@ -0,0 +1,178 @@
+import time
+from dataclasses import dataclass
+import numpy as np
+from mlmc.engine import _always_active, _level_kernel_args, _per_level_path_calc
+from mlmc.profiling import NULL_PROFILER
+from mlmc.result import _level_moments
+from mlmc.scenarios import _level_power_sums_scenarios
+
+'''
+Volatility calibration on common random numbers
+
+    quotes = [(ASIAN_SPEC, asian_params(K), price) for K, price in asian_quotes]
+    quotes += [(BARRIER_SPEC, barrier_params(K, B, bridge=True), price) for K, B, price in barrier_quotes]
+    res = calibrate_sigma(quotes, S0=100, r=0.05, T=1.0, max_level=6, epsilon=0.01)
+    res.sigma, res.sigma_se, res.n_evaluations
+
+Minimizes sum_j ((P_j(sigma) - market_j) / weight_j)^2 with Levenberg-Marquardt.
+A fresh MLMC run per objective evaluation makes the objective noisy, so an
+optimizer chases the noise. Instead the levels are piloted and N_l allocated
+once, at sigma0 (for the worst-resolved quote), and every level keeps one RNG
+key: each evaluation replays the same Brownian increments and uniforms at
+the new sigma, so the objective is a deterministic, smooth function of sigma
+(the sample-average problem), and LM converges in a handful of evaluations.
+
+Each evaluation is one scenario-kernel pass per product and level over the
+rows sigma and sigma + h on the same noise, which gives the prices and their
+pathwise sigma derivatives, (P(sigma + h) - P(sigma)) / h per path (h = 1e-4
+of an O(1) path derivative), for every PayoffSpec without derivative
+callbacks. Paths run to
+maturity (no early exit), so the streams are consumed identically for every
+sigma. Knock-out payoffs are only piecewise smooth pathwise; use bridge=True
+barriers, whose pathwise price moves with the bridge probabilities.
+
+The first iterations run on a prefix (warm_fraction) of every level's
+stream, which is itself a fixed sample, just a noisier one; from its
+optimum, one or two full evaluations finish the job. Iteration stops once
+the LM step is a small fraction (tol) of sigma_se, well below the MC error.
+
+The fitted sigma carries the MC error of the fixed streams; sigma_se bounds
+its delta-method SE from the quotes' price SEs and vegas.
+'''
+@dataclass
+class CalibrationResult:
+    sigma: float
+    sigma_se: float
+    prices: np.ndarray        # model prices at sigma, in quote order
+    ses: np.ndarray           # their MC SEs
+    residuals: np.ndarray     # prices - market
+    vegas: np.ndarray         # dP / dsigma
+    n_evaluations: int        # price + gradient passes, including the pilot
+    n_iterations: int
+    converged: bool
+    seconds: float
+
+class _FixedStreams:
+    """Prices and sigma-derivatives of one product's quotes on per-level RNG keys fixed at construction."""
+    def __init__(self, spec, params_batch, S0, r, T, max_level, sigma0, epsilon, rng, profiler):
+        self.spec = spec
+        self.params_batch = np.atleast_2d(np.asarray(params_batch, dtype=np.float64))
+        self.S0, self.r, self.T = float(S0), float(r), float(T)
+        self.max_level = max_level
+        args = _level_kernel_args(spec, self.params_batch[0])[1:]
+        if callable(spec.uses_uniforms):
+            args = args[:-1] + (bool(any(spec.uses_uniforms(params) for params in self.params_batch)),)
+        # the same stream must be consumed for every sigma, so no early exit
+        self.args = args[:3] + (_always_active,) + args[4:]
+        self.keys = rng.integers(0, 2**62, size=max_level+1)
+        self.profiler = profiler
+        _level_power_sums_scenarios(self.T, 1, 0, self._scenarios(sigma0, 0.0)[:1], self.params_batch, *self.args, 0)   # compile
+
+        # pilot at sigma0 on the first paths of each level's stream, then allocate for the worst-resolved quote
+        self.n_samples = np.full(max_level+1, spec.n_pilot, dtype=np.int64)
+        with profiler.span("pilot", samples=int(self.n_samples.sum())):
+            sums, _, time_ns = self._level_sums(self._scenarios(sigma0, 0.0)[:1], self.n_samples)
+        costs = time_ns / self.n_samples
+        targets = np.zeros(max_level+1, dtype=np.int64)
+        for j in range(len(self.params_batch)):
+            _, vars, _ = _level_moments(sums[:, j, 0], self.n_samples)
+            targets = np.maximum(targets, [_per_level_path_calc(max_level, level, vars, costs, epsilon) for level in range(max_level+1)])
+        self.n_samples = np.maximum(targets, spec.n_pilot)
+
+    def _scenarios(self, sigma, h):
+        mu = self.r    # risk-neutral
+        return np.array([[self.S0, mu, sigma, self.r], [self.S0, mu, sigma + h, self.r]])
+
+    def _level_sums(self, scenarios, n_samples):
+        L = self.max_level
+        m, s = len(self.params_batch), len(scenarios)
+        sums = np.zeros((L+1, m, s, 4))
+        diffs = np.zeros((L+1, m, s, 2))
+        time_ns = np.zeros(L+1)
+        for level in range(L+1):
+            start = time.perf_counter_ns()
+            sums[level], diffs[level] = _level_power_sums_scenarios(self.T, level, int(n_samples[level]), scenarios, self.params_batch, *self.args,
+                                                                    int(self.keys[level]))
+            time_ns[level] = time.perf_counter_ns() - start
+        return sums, diffs, time_ns
+
+    def evaluate(self, sigma, h, fraction=1.0):
+        """(prices, ses, vegas) of every quote at sigma on the first `fraction` of each level's fixed stream."""
+        n_samples = np.maximum(np.ceil(self.n_samples * fraction).astype(np.int64), 2)
+        with self.profiler.span("sample", samples=int(n_samples.sum())):
+            sums, diffs, _ = self._level_sums(self._scenarios(sigma, h), n_samples)
+        n = n_samples.astype(np.float64)
+        prices = np.zeros(len(self.params_batch))
+        ses = np.zeros(len(self.params_batch))
+        for j in range(len(self.params_batch)):
+            means, vars, _ = _level_moments(sums[:, j, 0], n_samples)
+            prices[j] = np.sum(means)
+            ses[j] = np.sqrt(np.sum(vars / n))
+        vegas = np.sum(diffs[:, :, 1, 0] / n[:, None], axis=0) / h
+        return prices, ses, vegas
+
+def calibrate_sigma(quotes, S0, r, T, max_level, epsilon, sigma0=0.2, weights=None, h=1e-4, tol=0.1, max_iter=30,
+                    warm_fraction=1/16, sigma_bounds=(1e-3, 5.0), rng=None, profiler=NULL_PROFILER):
+    """Least-squares GBM volatility for quotes [(spec, params, market_price), ...] (see module docstring).
+
+    epsilon is the price accuracy (SE <= epsilon/2) the allocation targets at
+    sigma0; weights default to 1 (absolute price errors). Iterations stop once
+    the LM step is below tol * sigma_se. The first iterations run on the first
+    warm_fraction of every level's stream (None to skip), the rest on all of it.
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng() if rng is None else rng
+    market = np.array([price for _, _, price in quotes], dtype=np.float64)
+    weights = np.ones(len(quotes)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    # one set of fixed streams per product; the quotes of a product share its paths
+    groups = []
+    for spec in dict.fromkeys(spec for spec, _, _ in quotes):
+        idx = [i for i, (s, _, _) in enumerate(quotes) if s is spec]
+        params_batch = [quotes[i][1] for i in idx]
+        groups.append((idx, _FixedStreams(spec, params_batch, S0, r, T, max_level, sigma0, epsilon, rng, profiler)))
+    n_evaluations = 1
+
+    def evaluate(sigma, fraction):
+        nonlocal n_evaluations
+        n_evaluations += 1
+        prices, ses, vegas = np.zeros(len(quotes)), np.zeros(len(quotes)), np.zeros(len(quotes))
+        for idx, streams in groups:
+            prices[idx], ses[idx], vegas[idx] = streams.evaluate(sigma, h, fraction)
+        res = (prices - market) / weights
+        return prices, ses, vegas, res, res @ res
+
+    def sigma_se_of(ses, jac):
+        # delta method, d sigma / d P_j = -J_j / (w_j J^T J); the quotes of a product share paths and their errors are
+        # positively correlated, so the errors are added linearly (an upper bound)
+        return float(np.sum(np.abs(jac / weights * ses)) / (jac @ jac)) if jac @ jac > 0 else float("nan")
+
+    # a prefix of the streams is itself a fixed sample, just a noisier one: iterate there first, then polish on all paths
+    sigma = float(sigma0)
+    iteration = 0
+    converged = False
+    for fraction in ([warm_fraction] if warm_fraction and warm_fraction < 1 else []) + [1.0]:
+        prices, ses, vegas, res, cost = evaluate(sigma, fraction)
+        jac = vegas / weights
+        lam = 1e-3 * (jac @ jac)
+        converged = False
+        for _ in range(max_iter):
+            step = -(jac @ res) / (jac @ jac + lam)
+            if not abs(step) > tol * sigma_se_of(ses, jac):     # also stops on a flat (nan) objective
+                converged = True
+                break
+            iteration += 1
+            trial = float(np.clip(sigma + step, *sigma_bounds))
+            trial_prices, trial_ses, trial_vegas, trial_res, trial_cost = evaluate(trial, fraction)
+            if trial_cost <= cost:
+                sigma, prices, ses, vegas, res, cost = trial, trial_prices, trial_ses, trial_vegas, trial_res, trial_cost
+                jac = vegas / weights
+                lam *= 0.1
+            else:
+                lam = max(lam * 10.0, 1e-12)
+    profiler.count("calibration.evaluations", n_evaluations)
+
+    return CalibrationResult(
+        sigma=sigma, sigma_se=sigma_se_of(ses, jac), prices=prices, ses=ses, residuals=prices - market, vegas=vegas,
+        n_evaluations=n_evaluations, n_iterations=iteration, converged=converged, seconds=time.perf_counter() - start,
+    )
@@ -0,0 +1,929 @@
+import numpy as np
+from numba import njit
+import time
+from math import comb
+from collections import namedtuple
+from mlmc.profiling import NULL_PROFILER, compile_watch, record_level_decomposition
+from mlmc.profiling import _noop_init, _noop_step, _noop_active, _noop_terminal
+from mlmc.result import _build_result, _level_moments, _bias_from_means
+from mlmc.rates import fit_rates
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Generic coupled-level engine
+
+A product is described by a PayoffSpec of njit-compiled callbacks that act on a
+small per-path state vector. The engine only evolves the log-price x = log S
+(exact GBM increments), so products that never need S itself (e.g. barrier
+checks, bridge probabilities) pay no exp per step:
+
+    init(state, x0, params)                              -> None
+    step(state, x_prev, x_next, h, sigma, params, u)     -> None
+    active(state, params)                                -> bool (False once the payoff is fixed, e.g. knocked out)
+    terminal(state, x_T, n_steps, params)                -> undiscounted payoff
+
+`u` is a Unif(0,1) draw that is only generated when `uses_uniforms` (a bool, or
+a plain Python function of params for products where it depends on them) is set. On
+the coarse path it is derived from the two fine uniforms of the same coarse
+step (min trick), which keeps Brownian bridge tests coupled.
+
+The callbacks are passed straight into the compiled kernels, so numba
+specializes (and inlines) each product: no Python is executed per path or step.
+Read the state and params a callback needs into locals first and write the
+state back once, with nothing in it that can raise: with array accesses spread
+over several branches, or an exception path, numba keeps an atomic
+incref/decref of the arrays on every call, which made a barrier step ~3x
+dearer than the dedicated array kernels it replaced.
+
+Products with an analytically priced companion payoff can also set
+
+    control(state, x_T, n_steps, params)                 -> undiscounted control payoff on the same path
+    control_mean(params, S0, mu, sigma, T, n_steps)      -> its exact expectation on an n_steps grid (plain Python)
+
+which mlmc(..., control_variate=True) uses as a control variate on every level.
+'''
+PayoffSpec = namedtuple("PayoffSpec", ["name", "n_state", "init", "step", "active", "terminal", "uses_uniforms", "n_pilot",
+                                       "control", "control_mean"], defaults=(None, None))
+
+@njit(nogil=True)
+def seed(seed):
+    """Seed numba's RNG for the calling thread; np.random.seed called from Python does not reach compiled kernels.
+
+    Each later kernel call is reproducible for a given sample count. MLMC runs are not, because N_l follows the
+    measured wall-clock costs.
+    """
+    np.random.seed(seed)
+
+@njit(nogil=True)
+def _always_active(state, params):
+    return True
+
+@njit(nogil=True)
+def _accumulate_power_sums(sums, x):
+    x2 = x * x
+    sums[0] += x
+    sums[1] += x2
+    sums[2] += x2 * x
+    sums[3] += x2 * x2
+
+@njit(nogil=True)
+def _accumulate_mixed_sums(mixed, y, x):
+    """mixed[a, c] += y^a x^c for 0 < a + c <= 4."""
+    y_pow = 1.0
+    for a in range(5):
+        term = y_pow
+        for c in range(5 - a):
+            if a + c > 0:
+                mixed[a, c] += term
+            term *= x
+        y_pow *= y
+
+@njit(nogil=True)
+def _level_power_sums(S0, mu, sigma, T, level, n_paths, r, params, n_state, init, step, active, terminal, uses_uniforms, key=-1):
+    """Return [sum D, sum D^2, sum D^3, sum D^4] of discounted level-l corrections D = P_l - P_{l-1} (P_0 at level 0)."""
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+
+    state_fine = np.zeros(n_state)
+    state_coarse = np.zeros(n_state)
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros(4)
+
+    for p in range(n_paths):
+        init(state_fine, x0, params)
+        x_fine = x0
+
+        if level == 0:
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x_next = x_fine + drift_fine + vol_fine * normals[kz]
+            kz += 1
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+            step(state_fine, x_fine, x_next, dt_fine, sigma, params, u)
+            correction = terminal(state_fine, x_next, 1, params)
+        else:
+            init(state_coarse, x0, params)
+            x_coarse = x0
+            for _ in range(n_fine // 2):
+                if not active(state_fine, params) and not active(state_coarse, params):
+                    break
+                if kz > BLOCK_SIZE - 2:
+                    kz = _fill_normals(keys, normals)
+                z1 = normals[kz]
+                z2 = normals[kz + 1]
+                kz += 2
+                x_f1 = x_fine + drift_fine + vol_fine * z1
+                x_f2 = x_f1 + drift_fine + vol_fine * z2
+                x_c1 = x_coarse + 2.0 * drift_fine + vol_fine * (z1 + z2)
+
+                u1 = 0.0
+                u2 = 0.0
+                uc = 0.0
+                if uses_uniforms:
+                    if ku > BLOCK_SIZE - 2:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u1 = uniforms[ku]
+                    u2 = uniforms[ku + 1]
+                    ku += 2
+                    u_min = u1 if u1 < u2 else u2
+                    # F_min(u) = 1 - (1-u)^2 maps the min of two uniforms back to Unif(0,1)
+                    uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+                step(state_fine, x_fine, x_f1, dt_fine, sigma, params, u1)
+                step(state_fine, x_f1, x_f2, dt_fine, sigma, params, u2)
+                step(state_coarse, x_coarse, x_c1, dt_coarse, sigma, params, uc)
+                x_fine = x_f2
+                x_coarse = x_c1
+
+            correction = terminal(state_fine, x_fine, n_fine, params) - terminal(state_coarse, x_coarse, n_fine // 2, params)
+
+        _accumulate_power_sums(sums, disc * correction)
+
+    return sums
+
+@njit(nogil=True)
+def _level_mixed_sums(S0, mu, sigma, T, level, n_paths, r, params, n_state, init, step, active, terminal, uses_uniforms,
+                      control, control_mean, key=-1):
+    """Mixed power sums mixed[a, c] = sum Y^a X^c (a + c <= 4) of the level-l corrections.
+
+    Y is the discounted correction P_l - P_{l-1} (P_0 at level 0) and X the
+    discounted control correction centred by its exact mean `control_mean`,
+    so the power sums of Y - b X can be formed afterwards for any b. Only used
+    with a control variate on; plain runs use _level_power_sums.
+    """
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+
+    state_fine = np.zeros(n_state)
+    state_coarse = np.zeros(n_state)
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    mixed = np.zeros((5, 5))
+
+    for p in range(n_paths):
+        init(state_fine, x0, params)
+        x_fine = x0
+
+        if level == 0:
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x_next = x_fine + drift_fine + vol_fine * normals[kz]
+            kz += 1
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+            step(state_fine, x_fine, x_next, dt_fine, sigma, params, u)
+            correction = terminal(state_fine, x_next, 1, params)
+            control_correction = control(state_fine, x_next, 1, params)
+        else:
+            init(state_coarse, x0, params)
+            x_coarse = x0
+            for _ in range(n_fine // 2):
+                if not active(state_fine, params) and not active(state_coarse, params):
+                    break
+                if kz > BLOCK_SIZE - 2:
+                    kz = _fill_normals(keys, normals)
+                z1 = normals[kz]
+                z2 = normals[kz + 1]
+                kz += 2
+                x_f1 = x_fine + drift_fine + vol_fine * z1
+                x_f2 = x_f1 + drift_fine + vol_fine * z2
+                x_c1 = x_coarse + 2.0 * drift_fine + vol_fine * (z1 + z2)
+
+                u1 = 0.0
+                u2 = 0.0
+                uc = 0.0
+                if uses_uniforms:
+                    if ku > BLOCK_SIZE - 2:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u1 = uniforms[ku]
+                    u2 = uniforms[ku + 1]
+                    ku += 2
+                    u_min = u1 if u1 < u2 else u2
+                    # F_min(u) = 1 - (1-u)^2 maps the min of two uniforms back to Unif(0,1)
+                    uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+                step(state_fine, x_fine, x_f1, dt_fine, sigma, params, u1)
+                step(state_fine, x_f1, x_f2, dt_fine, sigma, params, u2)
+                step(state_coarse, x_coarse, x_c1, dt_coarse, sigma, params, uc)
+                x_fine = x_f2
+                x_coarse = x_c1
+
+            correction = terminal(state_fine, x_fine, n_fine, params) - terminal(state_coarse, x_coarse, n_fine // 2, params)
+            control_correction = control(state_fine, x_fine, n_fine, params) - control(state_coarse, x_coarse, n_fine // 2, params)
+
+        correction *= disc
+        _accumulate_mixed_sums(mixed, correction, control_correction * disc - control_mean)
+
+    return mixed
+
+@njit(nogil=True)
+def _level_samples(S0, mu, sigma, T, level, n_paths, r, params, n_state, init, step, active, terminal, uses_uniforms, out, key=-1):
+    """Write the discounted fine and coarse payoffs of n_paths coupled paths into out[:n_paths, 0] and out[:n_paths, 1] (coarse 0 at level 0)."""
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+
+    state_fine = np.zeros(n_state)
+    state_coarse = np.zeros(n_state)
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    for p in range(n_paths):
+        init(state_fine, x0, params)
+        x_fine = x0
+
+        if level == 0:
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x_next = x_fine + drift_fine + vol_fine * normals[kz]
+            kz += 1
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+            step(state_fine, x_fine, x_next, dt_fine, sigma, params, u)
+            out[p, 0] = disc * terminal(state_fine, x_next, 1, params)
+            out[p, 1] = 0.0
+            continue
+
+        init(state_coarse, x0, params)
+        x_coarse = x0
+        for _ in range(n_fine // 2):
+            if not active(state_fine, params) and not active(state_coarse, params):
+                break
+            if kz > BLOCK_SIZE - 2:
+                kz = _fill_normals(keys, normals)
+            z1 = normals[kz]
+            z2 = normals[kz + 1]
+            kz += 2
+            x_f1 = x_fine + drift_fine + vol_fine * z1
+            x_f2 = x_f1 + drift_fine + vol_fine * z2
+            x_c1 = x_coarse + 2.0 * drift_fine + vol_fine * (z1 + z2)
+
+            u1 = 0.0
+            u2 = 0.0
+            uc = 0.0
+            if uses_uniforms:
+                if ku > BLOCK_SIZE - 2:
+                    ku = _fill_uniforms(keys, uniforms)
+                u1 = uniforms[ku]
+                u2 = uniforms[ku + 1]
+                ku += 2
+                u_min = u1 if u1 < u2 else u2
+                uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+            step(state_fine, x_fine, x_f1, dt_fine, sigma, params, u1)
+            step(state_fine, x_f1, x_f2, dt_fine, sigma, params, u2)
+            step(state_coarse, x_coarse, x_c1, dt_coarse, sigma, params, uc)
+            x_fine = x_f2
+            x_coarse = x_c1
+
+        out[p, 0] = disc * terminal(state_fine, x_fine, n_fine, params)
+        out[p, 1] = disc * terminal(state_coarse, x_coarse, n_fine // 2, params)
+
+@njit(nogil=True)
+def _level_power_sums_multi(S0, mu, sigma, T, level, n_paths, r, params_batch, n_state, init, step, active, terminal, uses_uniforms, key=-1):
+    """Power sums (m, 4) for m payoffs of the same spec (one params row each) evaluated on shared coupled paths."""
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+    m = params_batch.shape[0]
+
+    states_fine = np.zeros((m, n_state))
+    states_coarse = np.zeros((m, n_state))
+    x0 = np.log(S0)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros((m, 4))
+
+    for p in range(n_paths):
+        for j in range(m):
+            init(states_fine[j], x0, params_batch[j])
+        x_fine = x0
+
+        if level == 0:
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x_next = x_fine + drift_fine + vol_fine * normals[kz]
+            kz += 1
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+            for j in range(m):
+                step(states_fine[j], x_fine, x_next, dt_fine, sigma, params_batch[j], u)
+                _accumulate_power_sums(sums[j], disc * terminal(states_fine[j], x_next, 1, params_batch[j]))
+            continue
+
+        for j in range(m):
+            init(states_coarse[j], x0, params_batch[j])
+        x_coarse = x0
+        for _ in range(n_fine // 2):
+            any_active = False
+            for j in range(m):
+                if active(states_fine[j], params_batch[j]) or active(states_coarse[j], params_batch[j]):
+                    any_active = True
+                    break
+            if not any_active:
+                break
+            if kz > BLOCK_SIZE - 2:
+                kz = _fill_normals(keys, normals)
+            z1 = normals[kz]
+            z2 = normals[kz + 1]
+            kz += 2
+            x_f1 = x_fine + drift_fine + vol_fine * z1
+            x_f2 = x_f1 + drift_fine + vol_fine * z2
+            x_c1 = x_coarse + 2.0 * drift_fine + vol_fine * (z1 + z2)
+
+            u1 = 0.0
+            u2 = 0.0
+            uc = 0.0
+            if uses_uniforms:
+                if ku > BLOCK_SIZE - 2:
+                    ku = _fill_uniforms(keys, uniforms)
+                u1 = uniforms[ku]
+                u2 = uniforms[ku + 1]
+                ku += 2
+                u_min = u1 if u1 < u2 else u2
+                uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+            for j in range(m):
+                step(states_fine[j], x_fine, x_f1, dt_fine, sigma, params_batch[j], u1)
+                step(states_fine[j], x_f1, x_f2, dt_fine, sigma, params_batch[j], u2)
+                step(states_coarse[j], x_coarse, x_c1, dt_coarse, sigma, params_batch[j], uc)
+            x_fine = x_f2
+            x_coarse = x_c1
+
+        for j in range(m):
+            correction = terminal(states_fine[j], x_fine, n_fine, params_batch[j]) - terminal(states_coarse[j], x_coarse, n_fine // 2, params_batch[j])
+            _accumulate_power_sums(sums[j], disc * correction)
+
+    return sums
+
+'''
+Single level correction, sample variance, and cost calculations
+'''
+def _level_kernel_args(spec, params):
+    params = np.asarray(params, dtype=np.float64)
+    uses_uniforms = spec.uses_uniforms(params) if callable(spec.uses_uniforms) else spec.uses_uniforms
+    return (params, spec.n_state, spec.init, spec.step, spec.active, spec.terminal, bool(uses_uniforms))
+
+def _sums_to_level_stats(total, total_sq, n_paths):
+    mean = total / n_paths
+    if n_paths > 1:
+        var = max((total_sq - n_paths * mean * mean) / (n_paths - 1), 0.0)
+    else:
+        var = 0.0
+    return mean, var
+
+def _level_return(mean, var, cost_p_path, sums, return_correction_sum, return_power_sums):
+    if return_power_sums:
+        return mean, var, cost_p_path, sums
+    if return_correction_sum:
+        return mean, var, cost_p_path, sums[0], sums[1]
+    return mean, var, cost_p_path
+
+def _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_correction_sum=False, return_power_sums=False, profiler=NULL_PROFILER):
+    args = _level_kernel_args(spec, params)
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_power_sums], level=level):
+        sums = _level_power_sums(S0, mu, sigma, T, level, n_paths, r, *args)
+    end = time.perf_counter_ns()
+    with profiler.span("reduce", level=level):
+        mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    cost = end - start
+    if profiler.decompose:
+        _decompose_level(profiler, args, S0, mu, sigma, level, n_paths, r, T, cost)
+    return _level_return(mean, var, cost / n_paths, sums, return_correction_sum, return_power_sums)
+
+def _control_mean(spec, params, S0, mu, sigma, level, r, T):
+    """Exact discounted mean of the level-l control correction."""
+    params = np.asarray(params, dtype=np.float64)
+    fine = spec.control_mean(params, S0, mu, sigma, T, 2**level)
+    coarse = spec.control_mean(params, S0, mu, sigma, T, 2**(level-1)) if level > 0 else 0.0
+    return np.exp(-r * T) * (fine - coarse)
+
+def _single_level_calc_cv(spec, params, S0, mu, sigma, level, n_paths, r, T, profiler=NULL_PROFILER):
+    """Mixed power sums of the correction and the centred control correction, and the cost per path."""
+    args = _level_kernel_args(spec, params)
+    control_mean = _control_mean(spec, params, S0, mu, sigma, level, r, T)
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_mixed_sums], level=level):
+        mixed = _level_mixed_sums(S0, mu, sigma, T, level, n_paths, r, *args, spec.control, control_mean)
+    end = time.perf_counter_ns()
+    return mixed, (end - start) / n_paths
+
+def _single_level_calc_stored(spec, params, S0, mu, sigma, level, n_paths, r, T, store, chunk_size=1 << 20, profiler=NULL_PROFILER):
+    """_single_level_calc that also appends every sample to `store` (a mlmc.store.SampleStore), chunk by chunk.
+
+    The cost per path only counts the kernel, not the writes.
+    """
+    args = _level_kernel_args(spec, params)
+    buf = np.empty((min(n_paths, chunk_size), 2))
+    # compile outside the timed region (warmup does not build this kernel), or level 0 looks expensive
+    with compile_watch(profiler, [_level_samples], level=level):
+        _level_samples(S0, mu, sigma, T, level, 0, r, *args, buf)
+    sums = np.zeros(4)
+    cost = 0
+    done = 0
+    while done < n_paths:
+        n = min(chunk_size, n_paths - done)
+        start = time.perf_counter_ns()
+        with profiler.span("sample", level=level, samples=n):
+            _level_samples(S0, mu, sigma, T, level, n, r, *args, buf)
+        cost += time.perf_counter_ns() - start
+        with profiler.span("store", level=level, samples=n):
+            store.append(level, buf[:n])
+        with profiler.span("reduce", level=level):
+            d = buf[:n, 0] - buf[:n, 1]
+            d2 = d * d
+            sums += (d.sum(), d2.sum(), (d2 * d).sum(), (d2 * d2).sum())
+        done += n
+    mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    return mean, var, cost / n_paths, sums
+
+def _controlled_power_sums(mixed, coeff):
+    """[sum Z, ..., sum Z^4] of Z = Y - coeff X from the mixed sums of Y and X."""
+    sums = np.zeros(4)
+    for k in range(1, 5):
+        for c in range(k + 1):
+            sums[k-1] += comb(k, c) * (-coeff)**c * mixed[k-c, c]
+    return sums
+
+class _ControlCoefficients:
+    """Running per-level mixed sums and the control coefficient b_l = Cov(Y, X) / Var(X).
+
+    The coefficient is re-estimated from all samples of a level after every
+    batch and the level's power sums are re-formed with it, so every sample
+    (pilot included) ends up controlled with the same b_l. update() returns
+    Var(Y) (1 - rho^2), the variance the N_l allocation should see.
+    """
+    def __init__(self, max_level):
+        self.mixed = np.zeros((max_level+1, 5, 5))
+        self.n = np.zeros(max_level+1, dtype=np.int64)
+        self.coeffs = np.zeros(max_level+1)
+
+    def update(self, level, mixed, n_paths):
+        self.mixed[level] += mixed
+        self.n[level] += n_paths
+        n = self.n[level]
+        if n < 2:
+            return 0.0
+        m = self.mixed[level]
+        var_x = (m[0, 2] - m[0, 1]**2 / n) / (n - 1)
+        var_y = max((m[2, 0] - m[1, 0]**2 / n) / (n - 1), 0.0)
+        cov = (m[1, 1] - m[1, 0] * m[0, 1] / n) / (n - 1)
+        if var_x <= 1e-14 * max(var_y, 1e-300):
+            # e.g. a control that is identical on the fine and coarse paths
+            self.coeffs[level] = 0.0
+            return var_y
+        self.coeffs[level] = cov / var_x
+        return max(var_y - cov * cov / var_x, 0.0)
+
+    def power_sums(self):
+        return np.array([_controlled_power_sums(self.mixed[level], self.coeffs[level]) for level in range(len(self.n))])
+
+def _decompose_level(profiler, args, S0, mu, sigma, level, n_paths, r, T, sample_ns):
+    params, n_state, uses_uniforms = args[0], args[1], args[6]
+    noop = (params, n_state, _noop_init, _noop_step, _noop_active, _noop_terminal, uses_uniforms)
+
+    def level_kernel(n, use_noop):
+        return _level_power_sums(S0, mu, sigma, T, level, n, r, *(noop if use_noop else args))
+
+    draws = 2**level
+    record_level_decomposition(profiler, level_kernel, level, n_paths, sample_ns, draws, draws if uses_uniforms else 0)
+
+'''
+Generic MLMC driver over a per-level sampler
+'''
+def _variance_estimator(level_calc, max_level, n_paths):
+    """Pilot every level; n_paths is a single count or one count per level."""
+    n_paths = np.broadcast_to(np.asarray(n_paths, dtype=np.int64), (max_level+1,))
+    est_var = np.zeros(max_level+1)
+    est_cost = np.zeros(max_level+1)
+    means = np.zeros(max_level+1)
+    power_sums = np.zeros((max_level+1, 4))
+    for level in range(max_level+1):
+        mean, var, cost_p_path, sums = level_calc(level, int(n_paths[level]))
+        means[level] = mean
+        est_var[level] = var
+        est_cost[level] = cost_p_path
+        power_sums[level] = sums
+    return means, est_var, est_cost, power_sums
+
+def _per_level_path_calc(max_level, level, vars, cost, epsilon):
+    ir = 0.0
+    for lvl in range(max_level+1):
+        ir += np.sqrt(vars[lvl]*cost[lvl])
+    paths = (2/epsilon)**2 * ir * np.sqrt(vars[level]/cost[level])
+    return int(np.ceil(paths))
+
+def _extrapolate_levels(means, vars, costs, fit_levels, max_level, T):
+    """Fit beta/gamma on levels 1..fit_levels and extrapolate V_l, C_l above them.
+
+    Falls back to the last fitted level scaled by the textbook GBM rates when
+    the fit is degenerate (e.g. a level with zero variance).
+    """
+    rates = fit_rates(means[:fit_levels+1], vars[:fit_levels+1], costs[:fit_levels+1], T=T, start=1)
+    vars = vars.copy()
+    costs = costs.copy()
+    beta, gamma = rates["beta"], rates["gamma"]
+    fit_ok = np.isfinite(beta) and beta > 0 and np.isfinite(gamma) and gamma > 0
+    for level in range(fit_levels+1, max_level+1):
+        h = T / 2**level
+        if fit_ok:
+            vars[level] = np.exp(rates["log_c_beta"]) * h**beta
+            costs[level] = np.exp(rates["log_c_gamma"]) * h**(-gamma)
+        else:
+            vars[level] = vars[level-1] / 2.0
+            costs[level] = costs[level-1] * 2.0
+    return vars, costs, rates
+
+def _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=500, profiler=NULL_PROFILER, return_result=False, T=1.0,
+                          extrapolate=False, fit_levels=4, n_min=32, max_passes=3):
+    """MLMC price and SE from `level_calc(level, n_paths) -> (mean, var, cost, power_sums)`.
+
+    Pilots every level with n_pilot samples, allocates N_l from the pilot
+    variance/cost estimates so that SE <= epsilon/2, then combines the
+    pilot and additional power sums per level. `level_calc` is expected to
+    report its own per-level events to `profiler`; the driver adds the
+    pilot / refine spans and the allocation step. With return_result=True an
+    MLMCResult with the per-level diagnostics is returned instead of (price, se).
+
+    With extrapolate=True only levels 0..fit_levels get the full pilot. beta
+    and gamma are fitted on them online, V_l and C_l of the expensive levels
+    above are extrapolated from the fit, and those levels are only sampled
+    n_min times before allocation. Their variance estimates are then
+    refreshed from the samples actually drawn, and up to max_passes top-ups
+    run until the SE target holds.
+    """
+    extrapolate = extrapolate and max_level > fit_levels >= 2
+    pilot_levels = fit_levels if extrapolate else max_level
+    n_first = np.array([n_pilot if level <= pilot_levels else n_min for level in range(max_level+1)], dtype=np.int64)
+
+    with profiler.span("pilot", samples=int(n_first.sum())):
+        means, est_vars, est_costs, power_sums = _variance_estimator(level_calc, max_level, n_first)
+    n_samples = n_first.copy()
+    time_ns = est_costs * n_first
+
+    if extrapolate:
+        with profiler.span("allocate"):
+            model_vars, model_costs, _ = _extrapolate_levels(means, est_vars, est_costs, fit_levels, max_level, T)
+        est_vars, est_costs = model_vars.copy(), model_costs.copy()
+
+    for _ in range(max_passes if extrapolate else 1):
+        with profiler.span("allocate"):
+            paths_p_level = [max(_per_level_path_calc(max_level, level, est_vars, est_costs, epsilon) - int(n_samples[level]), 0) for level in range(max_level+1)]
+
+        with profiler.span("refine", samples=sum(paths_p_level)):
+            for level in range(max_level+1):
+                if paths_p_level[level] > 0:
+                    _, _, cost_p_path, sums = level_calc(level, paths_p_level[level])
+                    power_sums[level] += sums
+                    n_samples[level] += paths_p_level[level]
+                    time_ns[level] += cost_p_path * paths_p_level[level]
+
+        if not extrapolate:
+            break
+        # replace extrapolated variances by sampled ones where there are enough samples to trust them
+        _, sampled_vars, _ = _level_moments(power_sums, n_samples)
+        trusted = n_samples >= n_pilot
+        est_vars = np.where(trusted, sampled_vars, np.maximum(sampled_vars, model_vars))
+        if np.sqrt(np.sum(est_vars / n_samples)) <= epsilon / 2.0:
+            break
+        profiler.count("extrapolation.top_ups")
+
+    for level in range(max_level+1):
+        profiler.count(f"samples.level_{level}", int(n_samples[level]))
+    result = _build_result(power_sums, n_samples, time_ns, epsilon, T=T)
+    if return_result:
+        return result
+    return result.price, result.se
+
+def _mlmc_budget_from_level_calc(level_calc, max_level, n_pilot=500, profiler=NULL_PROFILER, return_result=False, T=1.0,
+                                 time_budget=None, cost_budget=None, pilot_fraction=0.2, n_chunks=4):
+    """MLMC within a fixed budget instead of an epsilon target.
+
+    time_budget is wall-clock seconds for the whole call, cost_budget is in
+    fine time steps (a level-l sample costs 2^l). Levels are piloted from the
+    bottom up while the pilot stays within pilot_fraction of the budget. Then,
+    for every candidate finest level L, the estimated MSE
+        bias(L)^2 + (sum_{l<=L} sqrt(V_l C_l))^2 / budget
+    is evaluated with the optimal N_l ~ sqrt(V_l / C_l), from the same
+    variance / cost estimates as _per_level_path_calc, and the minimizer is
+    sampled. With a time budget the refinement is drawn in n_chunks rounds,
+    each re-planned from the costs measured so far, and stops at the
+    deadline, so a bad cost estimate cannot overrun the window by more than
+    one chunk. The result's epsilon is the achieved accuracy,
+    2 max(SE, bias estimate).
+    """
+    if (time_budget is None) == (cost_budget is None):
+        raise ValueError("give exactly one of time_budget (seconds) or cost_budget (fine steps)")
+    start = time.perf_counter_ns()
+    step_costs = 2.0 ** np.arange(max_level+1)
+    power_sums = np.zeros((max_level+1, 4))
+    n_samples = np.zeros(max_level+1, dtype=np.int64)
+    time_ns = np.zeros(max_level+1)
+    if time_budget is not None:
+        budget = time_budget * 1e9
+        spent = lambda: time.perf_counter_ns() - start
+    else:
+        budget = float(cost_budget)
+        spent = lambda: float(np.sum(n_samples * step_costs))
+
+    top = 0
+    with profiler.span("pilot"):
+        for level in range(max_level+1):
+            if level > 0:
+                next_pilot = n_pilot * (2.0 * time_ns[level-1] / n_samples[level-1] if time_budget is not None else step_costs[level])
+                if spent() + next_pilot > pilot_fraction * budget:
+                    break
+            _, _, cost_p_path, sums = level_calc(level, n_pilot)
+            power_sums[level] = sums
+            n_samples[level] = n_pilot
+            time_ns[level] = cost_p_path * n_pilot
+            top = level
+    profiler.count("budget.pilot_levels", top + 1)
+
+    with profiler.span("allocate"):
+        means, vars, _ = _level_moments(power_sums[:top+1], n_samples[:top+1])
+        costs = time_ns[:top+1] / n_pilot if time_budget is not None else step_costs[:top+1]
+        alpha = fit_rates(means, vars, costs, T=T, start=1)["alpha"] if top >= 2 else float("nan")
+        remaining = max(budget - spent(), 0.0)
+        best = None
+        for L in range(min(top, 1), top+1):
+            sunk = np.sum(n_samples[:L+1] * costs[:L+1])
+            root_vc = np.sqrt(vars[:L+1] * costs[:L+1])
+            total = remaining + sunk
+            bias = _bias_from_means(means[:L+1], alpha) if L > 0 else 0.0
+            mse = bias**2 + np.sum(root_vc)**2 / total
+            if best is None or mse < best[0]:
+                targets = np.floor(total * np.sqrt(vars[:L+1] / costs[:L+1]) / max(np.sum(root_vc), 1e-300)).astype(np.int64)
+                best = (mse, L, bias, targets)
+        _, L, bias, targets = best
+        extra = np.maximum(targets - n_samples[:L+1], 0)
+
+    with profiler.span("refine", samples=int(extra.sum())):
+        for chunk in range(n_chunks):
+            if time_budget is not None and chunk > 0:
+                # re-plan the rest of the window with the costs measured so far
+                costs = time_ns[:L+1] / n_samples[:L+1]
+                root_vc = np.sqrt(vars[:L+1] * costs)
+                # keep a little headroom for the bookkeeping after the last chunk
+                left = max(0.95 * budget - spent(), 0.0) * np.sqrt(vars[:L+1] / costs) / max(np.sum(root_vc), 1e-300)
+                extra = np.floor(left).astype(np.int64)
+            for level in range(L+1):
+                n = int(np.ceil(extra[level] / (n_chunks - chunk)))
+                if n == 0 or (time_budget is not None and spent() >= budget):
+                    continue
+                _, _, cost_p_path, sums = level_calc(level, n)
+                power_sums[level] += sums
+                n_samples[level] += n
+                time_ns[level] += cost_p_path * n
+                extra[level] -= n
+
+    for level in range(L+1):
+        profiler.count(f"samples.level_{level}", int(n_samples[level]))
+    result = _build_result(power_sums[:L+1], n_samples[:L+1], time_ns[:L+1], float("nan"), T=T)
+    result.epsilon = 2.0 * max(result.se, bias)
+    if return_result:
+        return result
+    return result.price, result.se
+
+def _continuation_from_level_calc(level_calc, epsilons, max_level, n_pilot=500, n_min=32, start_level=2, profiler=NULL_PROFILER, T=1.0):
+    """Continuation MLMC over a decreasing epsilon sequence, reusing every sample.
+
+    Level statistics accumulate across the whole sequence. For each epsilon
+    the N_l are topped up to the allocation for that tolerance, then the
+    bias estimate (rates refitted on everything sampled so far) decides
+    whether a finer level is needed; new levels start from n_min samples
+    with V_l and C_l extrapolated from the fit until they have n_pilot
+    samples of their own. Returns one MLMCResult per epsilon, each built
+    from the samples drawn up to that point, so the cost of the whole ladder
+    is close to the cost of its last element.
+    """
+    epsilons = [float(eps) for eps in epsilons]
+    if any(b > a for a, b in zip(epsilons, epsilons[1:])):
+        raise ValueError("epsilons must be non-increasing")
+    power_sums = np.zeros((max_level+1, 4))
+    n_samples = np.zeros(max_level+1, dtype=np.int64)
+    time_ns = np.zeros(max_level+1)
+
+    def draw(level, n):
+        _, _, cost_p_path, sums = level_calc(level, int(n))
+        power_sums[level] += sums
+        n_samples[level] += n
+        time_ns[level] += cost_p_path * n
+
+    L = min(start_level, max_level)
+    with profiler.span("pilot", samples=n_pilot * (L + 1)):
+        for level in range(L+1):
+            draw(level, n_pilot)
+
+    results = []
+    for eps in epsilons:
+        while True:
+            with profiler.span("allocate"):
+                means, vars, _ = _level_moments(power_sums[:L+1], n_samples[:L+1])
+                costs = time_ns[:L+1] / n_samples[:L+1]
+                trusted = n_samples[:L+1] >= n_pilot
+                fit_levels = int(np.max(np.nonzero(trusted)[0]))
+                if fit_levels < L:
+                    model_vars, model_costs, _ = _extrapolate_levels(means, vars, costs, fit_levels, L, T)
+                    vars = np.where(trusted, vars, np.maximum(vars, model_vars))
+                    costs = np.where(trusted, costs, model_costs)
+                extra = [max(_per_level_path_calc(L, level, vars, costs, eps) - int(n_samples[level]), 0) for level in range(L+1)]
+            with profiler.span("refine", samples=sum(extra)):
+                for level in range(L+1):
+                    if extra[level] > 0:
+                        draw(level, extra[level])
+
+            means, vars, _ = _level_moments(power_sums[:L+1], n_samples[:L+1])
+            alpha = fit_rates(means, vars, time_ns[:L+1] / n_samples[:L+1], T=T, start=1)["alpha"] if L >= 2 else float("nan")
+            if L >= max_level or _bias_from_means(means, alpha) <= eps / 2.0:
+                break
+            L += 1
+            profiler.count("continuation.levels_added")
+            with profiler.span("pilot", level=L, samples=n_min):
+                draw(L, n_min)
+        results.append(_build_result(power_sums[:L+1].copy(), n_samples[:L+1].copy(), time_ns[:L+1].copy(), eps, T=T))
+    for level in range(L+1):
+        profiler.count(f"samples.level_{level}", int(n_samples[level]))
+    return results
+
+def mlmc_continuation(spec, params, S0, mu, sigma, max_level, r, T, epsilons, profiler=NULL_PROFILER, return_result=False):
+    """MLMC prices of `spec` for every epsilon of a decreasing sequence, sharing all samples (see _continuation_from_level_calc).
+
+    max_level is only a cap here: levels are added while the bias estimate exceeds eps/2.
+    """
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_power_sums=True, profiler=profiler)
+
+    results = _continuation_from_level_calc(level_calc, epsilons, max_level, n_pilot=spec.n_pilot, profiler=profiler, T=T)
+    if return_result:
+        return results
+    return [(res.price, res.se) for res in results]
+
+def mlmc(spec, params, S0, mu, sigma, max_level, r, T, epsilon, profiler=NULL_PROFILER, return_result=False, extrapolate=False,
+         control_variate=False, time_budget=None, cost_budget=None, store=None):
+    """MLMC price and SE of the single-asset GBM product described by `spec`.
+
+    control_variate=True uses spec.control on every level with a per-level
+    coefficient estimated online; params must switch the control on where the
+    product needs it (see barrier_params). With time_budget (seconds) or
+    cost_budget (fine steps) the finest level and N_l are chosen to minimize
+    the MSE within that budget and epsilon is ignored (see
+    _mlmc_budget_from_level_calc). With `store` (a mlmc.store.SampleStore)
+    every correction drawn is also written to disk for post-hoc analysis.
+    """
+    # integer inputs would compile (and, under a time budget, pay for) a second kernel signature
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    cv = None
+    if store is not None:
+        if control_variate:
+            raise ValueError("store does not support control_variate=True")
+
+        def level_calc(level, n_paths):
+            return _single_level_calc_stored(spec, params, S0, mu, sigma, level, n_paths, r, T, store, profiler=profiler)
+    elif not control_variate:
+        def level_calc(level, n_paths):
+            return _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_power_sums=True, profiler=profiler)
+    else:
+        if spec.control is None:
+            raise ValueError(f"payoff spec {spec.name!r} has no control variate")
+        cv = _ControlCoefficients(max_level)
+
+        def level_calc(level, n_paths):
+            mixed, cost_p_path = _single_level_calc_cv(spec, params, S0, mu, sigma, level, n_paths, r, T, profiler=profiler)
+            var = cv.update(level, mixed, n_paths)
+            sums = _controlled_power_sums(mixed, cv.coeffs[level])
+            return sums[0] / n_paths, var, cost_p_path, sums
+
+    if time_budget is not None or cost_budget is not None:
+        result = _mlmc_budget_from_level_calc(level_calc, max_level, n_pilot=spec.n_pilot, profiler=profiler, return_result=True, T=T,
+                                              time_budget=time_budget, cost_budget=cost_budget)
+    else:
+        result = _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=spec.n_pilot, profiler=profiler, return_result=True, T=T, extrapolate=extrapolate)
+    if cv is not None:
+        # re-form every level with its final coefficient (the batches were drawn before it was known)
+        L = result.max_level
+        result = _build_result(cv.power_sums()[:L+1], result.n_samples, result.costs * result.n_samples, result.epsilon, T=T)
+        result.control_coefficients = cv.coeffs[:L+1].copy()
+    if return_result:
+        return result
+    return result.price, result.se
+
+def _mlmc_multi_from_level_calc(level_calc, max_level, epsilons, n_pilot=500, profiler=NULL_PROFILER, T=1.0):
+    """MLMC for m payoffs sharing paths, from `level_calc(level, n_paths) -> (cost, power_sums[m, 4])`.
+
+    Every payoff gets its own epsilon; each level draws the largest N_l any
+    of them needs, so all m SE targets hold. Returns one MLMCResult per payoff
+    (total_cost is the shared cost of the batch).
+    """
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    m = len(epsilons)
+    power_sums = np.zeros((max_level+1, m, 4))
+    n_samples = np.full(max_level+1, n_pilot, dtype=np.int64)
+    costs = np.zeros(max_level+1)
+    with profiler.span("pilot", samples=int(n_samples.sum())):
+        for level in range(max_level+1):
+            costs[level], power_sums[level] = level_calc(level, n_pilot)
+    time_ns = costs * n_samples
+
+    with profiler.span("allocate"):
+        vars = np.array([_level_moments(power_sums[:, j], n_samples)[1] for j in range(m)])
+        target = np.array([max(_per_level_path_calc(max_level, level, vars[j], costs, epsilons[j]) for j in range(m))
+                           for level in range(max_level+1)])
+        paths_p_level = np.maximum(target - n_samples, 0)
+
+    with profiler.span("refine", samples=int(paths_p_level.sum())):
+        for level in range(max_level+1):
+            if paths_p_level[level] > 0:
+                cost_p_path, sums = level_calc(level, int(paths_p_level[level]))
+                power_sums[level] += sums
+                n_samples[level] += paths_p_level[level]
+                time_ns[level] += cost_p_path * paths_p_level[level]
+
+    return [_build_result(power_sums[:, j], n_samples, time_ns, epsilons[j], T=T) for j in range(m)]
+
+def mlmc_multi(spec, params_batch, S0, mu, sigma, max_level, r, T, epsilons, profiler=NULL_PROFILER, return_result=False):
+    """MLMC prices of several payoffs of one spec (one params row each) on one underlying, sharing all paths.
+
+    Cheaper than pricing them one by one: the path simulation, which
+    dominates the cost, is done once per sample for the whole batch.
+    """
+    params_batch = np.atleast_2d(np.asarray(params_batch, dtype=np.float64))
+    args = _level_kernel_args(spec, params_batch[0])[1:]
+    if callable(spec.uses_uniforms):
+        args = args[:-1] + (bool(any(spec.uses_uniforms(params) for params in params_batch)),)
+
+    def level_calc(level, n_paths):
+        start = time.perf_counter_ns()
+        with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_power_sums_multi], level=level):
+            sums = _level_power_sums_multi(S0, mu, sigma, T, level, n_paths, r, params_batch, *args)
+        return (time.perf_counter_ns() - start) / n_paths, sums
+
+    epsilons = np.broadcast_to(np.asarray(epsilons, dtype=np.float64), (len(params_batch),))
+    results = _mlmc_multi_from_level_calc(level_calc, max_level, epsilons, n_pilot=spec.n_pilot, profiler=profiler, T=T)
+    if return_result:
+        return results
+    return [(res.price, res.se) for res in results]
+
+def warmup_spec(spec, params):
+    """Compile the level kernel for `spec` (both level-0 and coupled branches share one compilation)."""
+    _level_power_sums(100.0, 0.05, 0.2, 1.0, 1, 2, 0.05, *_level_kernel_args(spec, params))
+    if spec.control is not None:
+        _level_mixed_sums(100.0, 0.05, 0.2, 1.0, 1, 2, 0.05, *_level_kernel_args(spec, params), spec.control, 0.0)
+    _level_power_sums_multi(100.0, 0.05, 0.2, 1.0, 1, 2, 0.05, np.atleast_2d(_level_kernel_args(spec, params)[0]), *_level_kernel_args(spec, params)[1:])
@@ -0,0 +1,221 @@
+import time
+from dataclasses import dataclass
+import numpy as np
+from mlmc.engine import _always_active, _level_kernel_args, _per_level_path_calc
+from mlmc.profiling import NULL_PROFILER
+from mlmc.result import _build_result, _level_moments
+from mlmc.scenarios import _level_power_sums_scenarios
+
+'''
+Tick-driven repricing on stored random streams
+
+    live = LivePricer(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 0.05, 1.0, max_level=8, epsilon=0.01)
+    live.base.price
+    price, se = live.update(S0=100.4)
+    quote = live.update(S0=100.3, sigma=0.21)    # quote.delta, quote.rebased, ...
+
+The base run is an ordinary MLMC run (pilot, allocation, refine) at the
+initial model, except that every level's samples are drawn in chunks whose
+RNG keys are kept: replaying a chunk's key through a kernel reproduces its
+Brownian increments (and bridge uniforms) exactly. Under GBM a new S0, mu,
+sigma or r only rescales those increments, so a tick is priced as
+
+    price(new) = base price + mean of [P(new) - P(base)] on replayed paths
+
+with both models evaluated on the same paths in one scenario-kernel pass.
+For small moves the difference has a tiny variance, so only the first few
+chunks of each level are replayed (the count is allocated from the
+difference variances of the previous tick, about 1/30 of the base work for a
+1% spot move); the same chunks are reused tick after tick, so quotes are a
+smooth function of the parameters. Replays run every path to maturity
+(no early exit on knock-out), so each chunk consumes its stream identically
+whatever the parameters. Payoffs that jump pathwise (knock-outs) change by
+O(1) on the paths that cross the barrier, so their differences are far
+noisier and ticks replay a large share of the base work.
+
+Nothing is re-piloted per tick. The allocation is only redone, by rebasing
+on the new model (replaying the stored chunks there and drawing more where
+N_l must grow), when the tick shows that the level variances have drifted:
+the stored N_l would miss the SE target by more than drift_tol, or the
+difference can no longer be resolved from the stored chunks.
+
+epsilon is split between the two parts: the base run gets a variance budget
+of (1 - delta_share) (epsilon/2)^2 and the tick difference delta_share of it,
+so every quote has SE <= epsilon/2 up to the covariance of the two. The
+difference is measured on the first paths of the base sample, so the two are
+correlated; the quoted se includes 2 Cov(base, delta) from the replayed paths.
+'''
+@dataclass
+class LiveQuote:
+    price: float
+    se: float
+    delta: float           # price - base price
+    delta_se: float        # SE of delta (CRN on the replayed paths)
+    n_replayed: int        # paths replayed for this tick, over all levels
+    rebased: bool          # the tick triggered a new allocation on the new model
+    seconds: float
+
+    def __iter__(self):
+        yield self.price
+        yield self.se
+
+class LivePricer:
+    def __init__(self, spec, params, S0, mu, sigma, r, T, max_level, epsilon, delta_share=0.2, n_chunks=64, drift_tol=0.25,
+                 rng=None, profiler=NULL_PROFILER):
+        self.spec = spec
+        self.T = float(T)
+        self.max_level = max_level
+        self.epsilon = epsilon
+        self.delta_share = delta_share
+        self.n_chunks = n_chunks
+        self.drift_tol = drift_tol
+        self.profiler = profiler
+        self._rng = np.random.default_rng() if rng is None else rng
+        self._params_batch = np.atleast_2d(np.asarray(params, dtype=np.float64))
+        kernel_args = _level_kernel_args(spec, params)[1:]
+        # replays must consume every stream the same way whatever the model, so no early exit
+        self._kernel_args = kernel_args[:3] + (_always_active,) + kernel_args[4:]
+        self.model = np.array([S0, mu, sigma, r], dtype=np.float64)
+        self.chunks = [[] for _ in range(max_level+1)]        # (key, n_paths) per level, replayed in order
+        self._delta_chunks = np.ones(max_level+1, dtype=np.int64)
+        # compile outside the timed pilot, whose costs drive the allocation
+        _level_power_sums_scenarios(self.T, 1, 0, self.model[None, :], self._params_batch, *self._kernel_args, 0)
+        self._rebase(self.model, None)
+
+    '''
+    Streams
+    '''
+    def _run_chunk(self, level, key, n_paths, scenarios):
+        start = time.perf_counter_ns()
+        sums, diffs = _level_power_sums_scenarios(self.T, level, n_paths, scenarios, self._params_batch, *self._kernel_args, key)
+        return sums[0], diffs[0], time.perf_counter_ns() - start
+
+    def _new_chunk(self, level, n_paths):
+        self.chunks[level].append((int(self._rng.integers(0, 2**62)), int(n_paths)))
+
+    '''
+    Base run and reallocation
+    '''
+    def _rebase(self, model, vars):
+        """(Re)price the base at `model` on the stored chunks, allocating N_l from `vars` (piloting first if None)."""
+        L = self.max_level
+        scenarios = model[None, :]
+        sums = np.zeros((L+1, 4))
+        n_samples = np.zeros(L+1, dtype=np.int64)
+        time_ns = np.zeros(L+1)
+
+        def run(level, chunks):
+            for key, n in chunks:
+                level_sums, _, ns = self._run_chunk(level, key, n, scenarios)
+                sums[level] += level_sums[0]
+                n_samples[level] += n
+                time_ns[level] += ns
+
+        if vars is None:
+            with self.profiler.span("pilot", samples=self.spec.n_pilot * (L+1)):
+                for level in range(L+1):
+                    self._new_chunk(level, self.spec.n_pilot)
+                    run(level, self.chunks[level])
+            _, vars, _ = _level_moments(sums, n_samples)
+        else:
+            with self.profiler.span("replay", samples=int(sum(n for chunks in self.chunks for _, n in chunks))):
+                for level in range(L+1):
+                    run(level, self.chunks[level])
+        costs = time_ns / np.maximum(n_samples, 1)
+
+        with self.profiler.span("allocate"):
+            base_eps = self.epsilon * np.sqrt(1.0 - self.delta_share)
+            targets = [_per_level_path_calc(L, level, vars, costs, base_eps) for level in range(L+1)]
+        with self.profiler.span("refine", samples=int(sum(max(t - n, 0) for t, n in zip(targets, n_samples)))):
+            for level in range(L+1):
+                chunk_size = max(int(np.ceil(targets[level] / self.n_chunks)), self.spec.n_pilot)
+                first = len(self.chunks[level])
+                while sum(n for _, n in self.chunks[level]) < targets[level]:
+                    self._new_chunk(level, chunk_size)
+                run(level, self.chunks[level][first:])
+
+        self.model = np.array(model, dtype=np.float64)
+        self.base = _build_result(sums, n_samples, time_ns, self.epsilon, T=self.T)
+        self._delta_chunks = np.minimum(self._delta_chunks, [len(chunks) for chunks in self.chunks])
+
+    '''
+    Ticks
+    '''
+    def update(self, S0=None, mu=None, sigma=None, r=None):
+        """Quote at the base model with the given parameters replaced; rebases first if the variances have drifted."""
+        start = time.perf_counter()
+        new = self.model.copy()
+        for i, value in enumerate((S0, mu, sigma, r)):
+            if value is not None:
+                new[i] = value
+        L = self.max_level
+        scenarios = np.vstack([self.model, new])
+        base_sums = np.zeros((L+1, 4))
+        new_sums = np.zeros((L+1, 4))
+        diff_sums = np.zeros((L+1, 2))
+        n_used = np.zeros(L+1, dtype=np.int64)
+        chunks_used = np.zeros(L+1, dtype=np.int64)
+        budget = self.epsilon / 2.0 * np.sqrt(self.delta_share)
+
+        def delta_stats():
+            n = np.maximum(n_used, 1).astype(np.float64)
+            means = diff_sums[:, 0] / n
+            vars = np.maximum(diff_sums[:, 1] / n - means**2, 0.0) * n / np.maximum(n - 1, 1)
+            return means, vars
+
+        for _ in range(2):
+            with self.profiler.span("replay", samples=int(sum(n for level in range(L+1) for _, n in self.chunks[level][chunks_used[level]:self._delta_chunks[level]]))):
+                for level in range(L+1):
+                    for key, n in self.chunks[level][chunks_used[level]:self._delta_chunks[level]]:
+                        sums, diffs, _ = self._run_chunk(level, key, n, scenarios)
+                        base_sums[level] += sums[0]
+                        new_sums[level] += sums[1]
+                        diff_sums[level] += diffs[1]
+                        n_used[level] += n
+                    chunks_used[level] = max(chunks_used[level], self._delta_chunks[level])
+            _, diff_vars = delta_stats()
+            if np.sqrt(np.sum(diff_vars / n_used)) <= budget:
+                break
+            with self.profiler.span("allocate"):
+                self._delta_chunks = self._chunks_for(diff_vars, budget)
+            if np.all(self._delta_chunks <= chunks_used):
+                break
+
+        diff_means, diff_vars = delta_stats()
+        delta, delta_se = float(np.sum(diff_means)), float(np.sqrt(np.sum(diff_vars / n_used)))
+        # keep next tick's replay as small as this tick's differences allow
+        self._delta_chunks = np.maximum(self._chunks_for(diff_vars, budget), 1)
+
+        # variance drift as the ratio new / base on the same replayed paths, which is far less noisy than new_vars itself
+        _, new_vars, _ = _level_moments(new_sums, n_used)
+        _, base_vars, _ = _level_moments(base_sums, n_used)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drift = np.where(base_vars > 0, new_vars / base_vars, 1.0)
+        new_vars = np.where(base_vars > 0, drift * self.base.variances, new_vars)
+        projected_se = np.sqrt(np.sum(new_vars / self.base.n_samples))
+        base_budget = self.epsilon / 2.0 * np.sqrt(1.0 - self.delta_share)
+        if projected_se > (1.0 + self.drift_tol) * base_budget or delta_se > (1.0 + self.drift_tol) * budget:
+            self.profiler.count("live.rebases")
+            self._rebase(new, new_vars)
+            return LiveQuote(self.base.price, self.base.se, 0.0, 0.0, int(n_used.sum()), True, time.perf_counter() - start)
+
+        self.profiler.count("live.ticks")
+        price = self.base.price + delta
+        # the delta is measured on the first paths of the base sample, so add 2 Cov(base, delta) per level
+        n = np.maximum(n_used, 1).astype(np.float64)
+        cross = 0.5 * (new_sums[:, 1] + base_sums[:, 1] - diff_sums[:, 1]) - base_sums[:, 1]     # sum Y_base * d
+        cov = (cross - base_sums[:, 0] * diff_sums[:, 0] / n) / np.maximum(n - 1, 1)
+        se = float(np.sqrt(max(self.base.se**2 + delta_se**2 + 2.0 * np.sum(cov / self.base.n_samples), 0.0)))
+        return LiveQuote(price, se, delta, delta_se, int(n_used.sum()), False, time.perf_counter() - start)
+
+    def _chunks_for(self, diff_vars, budget):
+        """Per-level chunk counts whose paths resolve the difference to SE <= budget (cost-optimal split, capped at the stored chunks)."""
+        costs = self.base.costs
+        target = (1.0 / budget)**2 * np.sum(np.sqrt(diff_vars * costs)) * np.sqrt(diff_vars / costs)
+        counts = np.zeros(self.max_level+1, dtype=np.int64)
+        for level, chunks in enumerate(self.chunks):
+            total = 0
+            while counts[level] < len(chunks) and total < target[level]:
+                total += chunks[counts[level]][1]
+                counts[level] += 1
+        return counts
@@ -1,12 +1,29 @@
+import threading
 import numpy as np
 from numba import njit
 from mlmc.payoffs import barrier_payoff_per_path
 from mlmc.sde import simulate_gbm_paths_recursive, simulate_gbm_coupled_paths
 from mlmc.payoffs import asian_payoff_per_path, barrier_corrections, asian_corrections
-import time
+from mlmc.payoffs import ASIAN_SPEC, BARRIER_SPEC, asian_params, barrier_params
 from mlmc.sde import _brownian_bridge_calc
+from mlmc.engine import _single_level_calc, warmup_spec, mlmc, mlmc_continuation
+from mlmc.anytime import mlmc_stream
+from mlmc.randomized import mlmc_single_term
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+_warmup_lock = threading.Lock()
+_warmed_up = False
 
 def warmup():
+    """Compile every kernel; runs once per process, concurrent callers wait for the first one."""
+    global _warmed_up
+    with _warmup_lock:
+        if not _warmed_up:
+            _compile_kernels()
+            _warmed_up = True
+
+def _compile_kernels():
     S0, mu, sigma, T = 100.0, 0.05, 0.2, 1.0
     r, K, B = 0.05, 100.0, 120.0
 
@@ -28,15 +45,14 @@ def warmup():
     barrier_corrections(fine, coarse, K, B, 1, 1)
 
     # estimators
-    _variance_estimator_asian(S0, mu, sigma, 10, n_paths, K, r, T)
-    #_variance_estimator_barrier(S0, mu, sigma, 10, n_paths, K, B, r, T)
-    #mlmc_asian(S0, mu, sigma, 5, K, r, T, 0.2)
+    warmup_spec(ASIAN_SPEC, asian_params(K))
+    warmup_spec(BARRIER_SPEC, barrier_params(K, B, bridge=True, control_variate=True))
 
     # stats
     x = np.array([1.0, 2.0])
     _mean_and_var(x)
 
-@njit
+@njit(nogil=True)
 def _mean_and_var(arr):
     n = np.shape(arr)[0]
     mean = 0.0
@@ -56,7 +72,7 @@ def _mean_and_var(arr):
 '''
 Asian + Barrier MC pricing
 '''
-@njit
+@njit(nogil=True)
 def _inner_asian_price_mc(paths, strike_price, r, T):
     payoffs = asian_payoff_per_path(paths, strike_price)
     num_paths = np.shape(payoffs)[0]
@@ -66,7 +82,7 @@ def _inner_asian_price_mc(paths, strike_price, r, T):
     se = np.sqrt(var / num_paths)
     return mean, se, var
 
-@njit
+@njit(nogil=True)
 def _inner_barrier_price_mc(paths, strike_price, barrier, r, T, sigma, bridge=False):
     num_paths, n_steps = np.shape(paths)
     h = T / (n_steps-1)
@@ -77,8 +93,8 @@ def _inner_barrier_price_mc(paths, strike_price, barrier, r, T, sigma, bridge=Fa
     se = np.sqrt(var / num_paths)
     return mean, se, var
 
-@njit
-def _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r):
+@njit(nogil=True)
+def _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r, key=-1):
     """Return (sum, sumsq) of discounted Asian call payoffs without storing full paths."""
     dt = T / n_steps
     drift = (mu - 0.5 * sigma * sigma) * dt
@@ -88,13 +104,20 @@ def _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r):
     total = 0.0
     total_sq = 0.0
 
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+
     for p in range(n_paths):
         S = S0
         # include S0 in the average to match your payoff convention
         running_sum = S
 
         for _ in range(n_steps):
-            z = np.random.normal()
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            z = normals[kz]
+            kz += 1
             S = S * np.exp(drift + vol * z)
             running_sum += S
 
@@ -109,7 +132,7 @@ def _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r):
 
     return total, total_sq
 
-def asian_price_mc(S0, mu, sigma, T, n_steps, n_paths, strike_price, r):
+def asian_price_mc(S0, mu, sigma, T, n_steps, n_paths, strike_price, r, profiler=NULL_PROFILER):
     n_paths = int(n_paths)
     n_steps = int(n_steps)
     if n_paths <= 1:
@@ -117,19 +140,21 @@ def asian_price_mc(S0, mu, sigma, T, n_steps, n_paths, strike_price, r):
         total, _ = _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, max(n_paths, 1), strike_price, r)
         return total / max(n_paths, 1), float('inf')
 
-    total, total_sq = _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r)
+    with profiler.span("sample", samples=n_paths), compile_watch(profiler, [_asian_mc_sum_sumsq]):
+        total, total_sq = _asian_mc_sum_sumsq(S0, mu, sigma, T, n_steps, n_paths, strike_price, r)
 
-    mean = total / n_paths
-    # Unbiased sample variance of discounted payoffs
-    var = (total_sq - n_paths * mean * mean) / (n_paths - 1)
-    se = np.sqrt(var / n_paths)
+    with profiler.span("reduce"):
+        mean = total / n_paths
+        # Unbiased sample variance of discounted payoffs
+        var = (total_sq - n_paths * mean * mean) / (n_paths - 1)
+        se = np.sqrt(var / n_paths)
 
     return mean, se
 
 
 
-@njit
-def _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=False):
+@njit(nogil=True)
+def _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=False, key=-1):
     """Return (sum, sumsq) of discounted barrier call payoffs without storing full paths."""
     dt = T / n_steps
     drift = (mu - 0.5 * sigma * sigma) * dt
@@ -139,13 +164,22 @@ def _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier
     total = 0.0
     total_sq = 0.0
 
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
     for p in range(n_paths):
         S = S0
         # include S0 in the average to match your payoff convention
         knocked_out = False
 
         for _ in range(n_steps):
-            z = np.random.normal()
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            z = normals[kz]
+            kz += 1
             S_prev = S
             S = S * np.exp(drift + vol * z)
             if S > barrier:
@@ -156,7 +190,10 @@ def _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier
                 y = np.log(S)
                 b = np.log(barrier)
                 prob = _brownian_bridge_calc(x, y, dt, b, sigma)
-                U = np.random.random()
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                U = uniforms[ku]
+                ku += 1
                 if prob > U:
                     knocked_out = True
                     break
@@ -171,7 +208,7 @@ def _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier
 
     return total, total_sq
 
-def barrier_price_mc(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=False):
+def barrier_price_mc(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=False, profiler=NULL_PROFILER):
     n_paths = int(n_paths)
     n_steps = int(n_steps)
     if n_paths <= 1:
@@ -179,12 +216,14 @@ def barrier_price_mc(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r,
         total, _ = _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, max(n_paths, 1), strike_price, barrier, r, T, bridge=bridge)
         return total / max(n_paths, 1), float('inf')
 
-    total, total_sq = _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=bridge)
+    with profiler.span("sample", samples=n_paths), compile_watch(profiler, [_barrier_mc_sum_sumsq]):
+        total, total_sq = _barrier_mc_sum_sumsq(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r, T, bridge=bridge)
 
-    mean = total / n_paths
-    # Unbiased sample variance of discounted payoffs
-    var = (total_sq - n_paths * mean * mean) / (n_paths - 1)
-    se = np.sqrt(var / n_paths)
+    with profiler.span("reduce"):
+        mean = total / n_paths
+        # Unbiased sample variance of discounted payoffs
+        var = (total_sq - n_paths * mean * mean) / (n_paths - 1)
+        se = np.sqrt(var / n_paths)
 
     return mean, se
 
@@ -192,226 +231,76 @@ def barrier_price_mc(S0, mu, sigma, n_steps, n_paths, strike_price, barrier, r,
 Single level correction, sample variance, and cost calculations
 '''
 #Asian
-def _single_level_calc_asian(S0, mu, sigma, level, n_paths, strike_price, r, T, return_correction_sum=False):
-    start = time.perf_counter_ns()
-    if level != 0:
-        fine_paths, coarse_paths = simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths)
-        corrections = asian_corrections(fine_paths, coarse_paths, strike_price)
-        mean, var = _mean_and_var(corrections)
-        disc_corr = corrections * np.exp(-r * T)
-        correction_sum = np.sum(disc_corr)
-        correction_sumsq = np.sum(disc_corr * disc_corr)
-        mean *= np.exp(-r * T)
-        var *= np.exp(-2 * r * T)
-        se = np.sqrt(var / n_paths)
-
-    #level 0, just use regular MC estimate of P_0
-    else:
-        paths = simulate_gbm_paths_recursive(S0, mu, sigma, T, 1, n_paths)
-        mean, se, var = _inner_asian_price_mc(paths, strike_price, r, T) #already discounted
-        payoffs0 = asian_payoff_per_path(paths, strike_price)
-        disc_payoffs0 = payoffs0 * np.exp(-r * T)
-        correction_sum = np.sum(disc_payoffs0)
-        correction_sumsq = np.sum(disc_payoffs0 * disc_payoffs0)
-
-    end  = time.perf_counter_ns()
-    cost = end - start
-    if return_correction_sum:
-        return mean, var, cost/n_paths, correction_sum, correction_sumsq
-    return mean, var, cost / n_paths
+def _single_level_calc_asian(S0, mu, sigma, level, n_paths, strike_price, r, T, return_correction_sum=False, return_power_sums=False, profiler=NULL_PROFILER):
+    return _single_level_calc(ASIAN_SPEC, asian_params(strike_price), S0, mu, sigma, level, n_paths, r, T, return_correction_sum=return_correction_sum, return_power_sums=return_power_sums, profiler=profiler)
 
 #Barrier
-def _single_level_calc_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_correction_sum=False, bridge=False):
-    start = time.perf_counter_ns()
-    h_fine = T / 2**level
-    if level != 0:
-        fine_paths, coarse_paths = simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths)
-        corrections = barrier_corrections(fine_paths, coarse_paths, strike_price, barrier, h_fine, sigma, bridge=bridge)
-        mean, var = _mean_and_var(corrections)
-        disc_corr = corrections * np.exp(-r * T)
-        correction_sum = np.sum(disc_corr)
-        correction_sumsq = np.sum(disc_corr * disc_corr)
-        mean *= np.exp(-r * T)
-        var *= np.exp(-2 * r * T)
-        se = np.sqrt(var / n_paths)
-
-    #level 0, just use regular MC estimate of P_0
-    else:
-        paths = simulate_gbm_paths_recursive(S0, mu, sigma, T, 1, n_paths)
-        mean, se, var = _inner_barrier_price_mc(paths, strike_price, barrier, r, T, sigma, bridge=bridge)  # already discounted
-        payoffs0 = barrier_payoff_per_path(paths, strike_price, barrier, h_fine, sigma, bridge=bridge)
-        disc_payoffs0 = payoffs0 * np.exp(-r * T)
-        correction_sum = np.sum(disc_payoffs0)
-        correction_sumsq = np.sum(disc_payoffs0 * disc_payoffs0)
-
-    end = time.perf_counter_ns()
-    cost = end - start
-    if return_correction_sum:
-        return mean, var, cost / n_paths, correction_sum, correction_sumsq
-    return mean, var, cost / n_paths
+def _single_level_calc_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_correction_sum=False, return_power_sums=False, bridge=False, profiler=NULL_PROFILER):
+    return _single_level_calc(BARRIER_SPEC, barrier_params(strike_price, barrier, bridge=bridge), S0, mu, sigma, level, n_paths, r, T, return_correction_sum=return_correction_sum, return_power_sums=return_power_sums, profiler=profiler)
 
 '''
-MLMC Estimator (Asian)
+MLMC Estimators (Asian, Barrier)
 '''
-def _asian_mlmc_estimate(S0, mu, sigma, max_levels, paths_p_level, strike_price, r, T):
-    price = 0.0
-    se = 0.0
-    level_contributions = []
-    corr_sum_p_level = []
-    corr_sumsq_p_level = []
-    assert(max_levels+1 == len(paths_p_level))
-    for level in range(max_levels+1):
-        n_paths = paths_p_level[level]
-        if n_paths != 0:
-            curr_correction, curr_var, curr_cost, corr_sum, corr_sumsq = _single_level_calc_asian(S0, mu, sigma, level, n_paths, strike_price, r, T, return_correction_sum=True)
-            price += curr_correction
-            level_contributions.append(curr_correction)
-            corr_sum_p_level.append(corr_sum)
-            corr_sumsq_p_level.append(corr_sumsq)
-        else:
-            level_contributions.append(0)
-            corr_sum_p_level.append(0)
-            corr_sumsq_p_level.append(0)
-    return price, se, np.array(level_contributions), np.array(corr_sum_p_level), np.array(corr_sumsq_p_level)
-
-def _variance_estimator_asian(S0, mu, sigma, max_level, n_paths, strike_price, r, T):
-    est_var = []
-    est_cost = []
-    means = []
-    corrections_p_lvl = []
-    corrections_sumsq_p_lvl = []
-    for level in range(max_level+1):
-        mean, var, cost_p_path, correction_sum, correction_sumsq = _single_level_calc_asian(S0, mu, sigma, level, n_paths, strike_price, r, T, return_correction_sum=True)
-        est_var.append(var)
-        est_cost.append(cost_p_path)
-        means.append(mean)
-        corrections_p_lvl.append(correction_sum)
-        corrections_sumsq_p_lvl.append(correction_sumsq)
-    return np.array(means), np.array(est_var), np.array(est_cost), np.array(corrections_p_lvl), np.array(corrections_sumsq_p_lvl)
-
-def _per_level_path_calc_asian(max_level, level, vars, cost, epsilon):
-    ir = 0.0
-    for lvl in range(max_level+1):
-        ir += np.sqrt(vars[lvl]*cost[lvl])
-    paths = (2/epsilon)**2 * ir * np.sqrt(vars[level]/cost[level])
-    return int(np.ceil(paths))
-
-def _path_number_calculation_asian(S0, mu, sigma, max_levels, strike_price, r, T, epsilon):
-    add_paths_p_lvl = []
-    n_pilot = 500
-    est_mean, est_vars, est_costs, pilot_corrections_sum, pilot_corrections_sumsq = _variance_estimator_asian(S0, mu, sigma, max_levels, n_pilot, strike_price, r, T)
-    #print("est cost 2:", est_costs)
-    for level in range(max_levels+1):
-        paths_total = _per_level_path_calc_asian(max_levels, level, est_vars, est_costs, epsilon)
-        paths_add = max(paths_total-n_pilot, 0)
-        add_paths_p_lvl.append(paths_add)
-    return np.array(add_paths_p_lvl), pilot_corrections_sum, pilot_corrections_sumsq, est_vars
-
-def mlmc_asian(S0, mu, sigma, max_level, strike_price, r, T, epsilon):
-    warmup()
-    n_pilot = 500
-    paths_p_level, pilot_corrections_sum, pilot_corrections_sumsq, est_vars = _path_number_calculation_asian(S0, mu, sigma, max_level, strike_price, r, T, epsilon)
-    #print("add paths p level:", paths_p_level)
-    _, _, _, add_corr_p_level, add_corr_sq_p_level = _asian_mlmc_estimate(S0, mu, sigma, max_level, paths_p_level, strike_price, r, T)
-    price = 0.0
-    se = 0.0
-    for level in range(max_level+1):
-        n_total = n_pilot + paths_p_level[level]
-        total_sum = pilot_corrections_sum[level] + add_corr_p_level[level]
-        total_corr = total_sum / n_total
-        total_sumsq = pilot_corrections_sumsq[level] + add_corr_sq_p_level[level]
-        price += total_corr
-
-        if n_total > 1:
-            v_l = (total_sumsq - n_total * total_corr * total_corr) / (n_total - 1)
-        else:
-            v_l = 0.0
-
-        se += v_l / n_total
-    se = np.sqrt(se)
-    return price, se
+def mlmc_asian(S0, mu, sigma, max_level, strike_price, r, T, epsilon, profiler=NULL_PROFILER, return_result=False, extrapolate=False,
+               control_variate=False, time_budget=None, cost_budget=None):
+    """control_variate=True uses the geometric-average Asian call (closed form) as a control on every level.
+    time_budget (seconds) / cost_budget (fine steps) replace the epsilon target, see mlmc.engine.mlmc."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc(ASIAN_SPEC, asian_params(strike_price), S0, mu, sigma, max_level, r, T, epsilon, profiler=profiler, return_result=return_result,
+                extrapolate=extrapolate, control_variate=control_variate, time_budget=time_budget, cost_budget=cost_budget)
+
+def mlmc_barrier(S0, mu, sigma, max_level, strike_price, barrier, r, T, epsilon, bridge=False, profiler=NULL_PROFILER, return_result=False, extrapolate=False,
+                 control_variate=False, time_budget=None, cost_budget=None):
+    """control_variate=True uses the bridge-smoothed payoff, whose mean is the analytic continuously monitored price, as a control.
+    It is off by default because it does not pay overall: it only helps on level 0 and costs more per sample on the
+    corrections than it saves (see BARRIER_SPEC).
+    time_budget (seconds) / cost_budget (fine steps) replace the epsilon target, see mlmc.engine.mlmc."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc(BARRIER_SPEC, barrier_params(strike_price, barrier, bridge=bridge, control_variate=control_variate), S0, mu, sigma, max_level, r, T, epsilon,
+                profiler=profiler, return_result=return_result, extrapolate=extrapolate, control_variate=control_variate,
+                time_budget=time_budget, cost_budget=cost_budget)
+
+def mlmc_asian_continuation(S0, mu, sigma, max_level, strike_price, r, T, epsilons, profiler=NULL_PROFILER, return_result=False):
+    """One (price, se) per epsilon of a decreasing sequence, for about the cost of the last one."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_continuation(ASIAN_SPEC, asian_params(strike_price), S0, mu, sigma, max_level, r, T, epsilons, profiler=profiler, return_result=return_result)
+
+def mlmc_barrier_continuation(S0, mu, sigma, max_level, strike_price, barrier, r, T, epsilons, bridge=False, profiler=NULL_PROFILER, return_result=False):
+    """One (price, se) per epsilon of a decreasing sequence, for about the cost of the last one."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_continuation(BARRIER_SPEC, barrier_params(strike_price, barrier, bridge=bridge), S0, mu, sigma, max_level, r, T, epsilons,
+                             profiler=profiler, return_result=return_result)
 
 '''
-MLMC Estimator (Barrier)
+Anytime streaming estimators (see mlmc.anytime)
 '''
-def _barrier_mlmc_estimate(S0, mu, sigma, max_levels, paths_p_level, strike_price, barrier, r, T, bridge=False):
-    price = 0.0
-    se = 0.0
-    level_contributions = []
-    corr_sum_p_level = []
-    corr_sumsq_p_level = []
-    assert(max_levels+1 == len(paths_p_level))
-    for level in range(max_levels+1):
-        n_paths = paths_p_level[level]
-        if n_paths != 0:
-            curr_correction, curr_var, curr_cost, corr_sum, corr_sumsq = _single_level_calc_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_correction_sum=True, bridge=bridge)
-            price += curr_correction
-            level_contributions.append(curr_correction)
-            corr_sum_p_level.append(corr_sum)
-            corr_sumsq_p_level.append(corr_sumsq)
-        else:
-            level_contributions.append(0)
-            corr_sum_p_level.append(0)
-            corr_sumsq_p_level.append(0)
-    return price, se, np.array(level_contributions), np.array(corr_sum_p_level), np.array(corr_sumsq_p_level)
-
-def _variance_estimator_barrier(S0, mu, sigma, max_level, n_paths, strike_price, barrier, r, T, bridge=False):
-    est_var = []
-    est_cost = []
-    means = []
-    corrections_p_lvl = []
-    corrections_sumsq_p_lvl = []
-    for level in range(max_level+1):
-        mean, var, cost_p_path, correction_sum, correction_sumsq = _single_level_calc_barrier(S0, mu, sigma, level, n_paths, strike_price, barrier, r, T, return_correction_sum=True, bridge=bridge)
-        est_var.append(var)
-        est_cost.append(cost_p_path)
-        means.append(mean)
-        corrections_p_lvl.append(correction_sum)
-        corrections_sumsq_p_lvl.append(correction_sumsq)
-    return np.array(means), np.array(est_var), np.array(est_cost), np.array(corrections_p_lvl), np.array(corrections_sumsq_p_lvl)
-
-def _per_level_path_calc_barrier(max_level, level, vars, cost, epsilon):
-    ir = 0.0
-    for lvl in range(max_level+1):
-        ir += np.sqrt(vars[lvl]*cost[lvl])
-    paths = (2/epsilon)**2 * ir * np.sqrt(vars[level]/cost[level])
-    return int(np.ceil(paths))
-
-def _path_number_calculation_barrier(S0, mu, sigma, max_levels, strike_price, barrier, r, T, epsilon, bridge=False):
-    add_paths_p_lvl = []
-    n_pilot = 1000
-    est_mean, est_vars, est_costs, pilot_corrections_sum, pilot_corrections_sumsq = _variance_estimator_barrier(S0, mu, sigma, max_levels, n_pilot, strike_price, barrier, r, T, bridge=bridge)
-    #print("est cost 2:", est_costs)
-    for level in range(max_levels+1):
-        paths_total = _per_level_path_calc_barrier(max_levels, level, est_vars, est_costs, epsilon)
-        paths_add = max(paths_total-n_pilot, 0)
-        add_paths_p_lvl.append(paths_add)
-    return np.array(add_paths_p_lvl), pilot_corrections_sum, pilot_corrections_sumsq, est_vars
-
-def mlmc_barrier(S0, mu, sigma, max_level, strike_price, barrier, r, T, epsilon, bridge=False):
-    warmup()
-    n_pilot = 1000
-    paths_p_level, pilot_corrections_sum, pilot_corrections_sumsq, est_vars = _path_number_calculation_barrier(S0, mu, sigma, max_level, strike_price, barrier, r, T, epsilon, bridge=bridge)
-    #print("add paths p level:", paths_p_level)
-    _, _, _, add_corr_p_level, add_corr_sq_p_level = _barrier_mlmc_estimate(S0, mu, sigma, max_level, paths_p_level, strike_price, barrier, r, T, bridge=bridge)
-    price = 0.0
-    se = 0.0
-    for level in range(max_level+1):
-        n_total = n_pilot + paths_p_level[level]
-        total_sum = pilot_corrections_sum[level] + add_corr_p_level[level]
-        total_corr = total_sum / n_total
-        total_sumsq = pilot_corrections_sumsq[level] + add_corr_sq_p_level[level]
-        price += total_corr
-
-        if n_total > 1:
-            v_l = (total_sumsq - n_total * total_corr**2) / (n_total - 1)
-        else:
-            v_l = 0.0
-
-        se += v_l / n_total
-    se = np.sqrt(se)
-    return price, se
-
-
+def mlmc_asian_stream(S0, mu, sigma, max_level, strike_price, r, T, deadline=None, cancel=None, profiler=NULL_PROFILER, **schedule):
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_stream(ASIAN_SPEC, asian_params(strike_price), S0, mu, sigma, max_level, r, T, deadline=deadline, cancel=cancel, profiler=profiler, **schedule)
 
+def mlmc_barrier_stream(S0, mu, sigma, max_level, strike_price, barrier, r, T, deadline=None, bridge=False, cancel=None, profiler=NULL_PROFILER, **schedule):
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_stream(BARRIER_SPEC, barrier_params(strike_price, barrier, bridge=bridge), S0, mu, sigma, max_level, r, T,
+                       deadline=deadline, cancel=cancel, profiler=profiler, **schedule)
 
+'''
+Unbiased randomized (single-term) estimators (see mlmc.randomized)
+'''
+def mlmc_asian_single_term(S0, mu, sigma, strike_price, r, T, epsilon, profiler=NULL_PROFILER, return_result=False, **tuning):
+    """Unbiased price and SE of the Asian call without choosing max_level."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_single_term(ASIAN_SPEC, asian_params(strike_price), S0, mu, sigma, r, T, epsilon, profiler=profiler, return_result=return_result, **tuning)
+
+def mlmc_barrier_single_term(S0, mu, sigma, strike_price, barrier, r, T, epsilon, bridge=True, profiler=NULL_PROFILER, return_result=False, **tuning):
+    """Unbiased price and SE of the up-and-out call; bridge=True by default since the plain kernel has beta < gamma."""
+    with profiler.span("warmup"):
+        warmup()
+    return mlmc_single_term(BARRIER_SPEC, barrier_params(strike_price, barrier, bridge=bridge), S0, mu, sigma, r, T, epsilon,
+                            profiler=profiler, return_result=return_result, **tuning)
@@ -0,0 +1,319 @@
+import numpy as np
+from numba import njit
+import time
+from mlmc.engine import _mlmc_from_level_calc, _sums_to_level_stats, _level_return, _accumulate_power_sums
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Correlated multi-asset GBM
+
+Every asset follows its own GBM, dS_i = mu_i S_i dt + sigma_i S_i dW_i, with
+corr(dW_i, dW_j) = rho_ij. The correlation matrix is factored once (Cholesky)
+and the kernels below stream per-path accumulators, so memory is O(n_assets)
+per call instead of O(n_assets * n_steps * n_paths). Each path step reads
+its n_assets normals from one RNG block, so n_assets <= BLOCK_SIZE.
+'''
+def _cholesky_factor(corr):
+    corr = np.asarray(corr, dtype=np.float64)
+    if corr.ndim != 2 or corr.shape[0] != corr.shape[1]:
+        raise ValueError("correlation matrix must be square")
+    if not np.allclose(corr, corr.T):
+        raise ValueError("correlation matrix must be symmetric")
+    if not np.allclose(np.diag(corr), 1.0):
+        raise ValueError("correlation matrix must have a unit diagonal")
+    if corr.shape[0] > BLOCK_SIZE:
+        raise ValueError(f"at most {BLOCK_SIZE} assets are supported")
+    return np.linalg.cholesky(corr)
+
+def _as_asset_array(x, n_assets):
+    arr = np.asarray(x, dtype=np.float64)
+    if arr.ndim == 0:
+        arr = np.full(n_assets, float(arr))
+    if arr.shape != (n_assets,):
+        raise ValueError(f"expected a scalar or an array of length {n_assets}")
+    return arr
+
+@njit(nogil=True)
+def _correlated_normals(chol, keys, normals, kz, out):
+    """out = chol @ z for the next d normals of the block; returns the new read position."""
+    d = out.shape[0]
+    if kz > BLOCK_SIZE - d:
+        kz = _fill_normals(keys, normals)
+    for i in range(d):
+        acc = 0.0
+        for k in range(i + 1):
+            acc += chol[i, k] * normals[kz + k]
+        out[i] = acc
+    return kz + d
+
+@njit(nogil=True)
+def _basket_value(log_s, weights):
+    total = 0.0
+    for i in range(log_s.shape[0]):
+        total += weights[i] * np.exp(log_s[i])
+    return total
+
+@njit(nogil=True)
+def _reference_performance(log_perf, best_of):
+    ref = log_perf[0]
+    for i in range(1, log_perf.shape[0]):
+        if best_of:
+            if log_perf[i] > ref:
+                ref = log_perf[i]
+        else:
+            if log_perf[i] < ref:
+                ref = log_perf[i]
+    return np.exp(ref)
+
+@njit(nogil=True)
+def _any_at_or_above(log_perf, log_barrier):
+    for i in range(log_perf.shape[0]):
+        if log_perf[i] >= log_barrier:
+            return True
+    return False
+
+@njit(nogil=True)
+def _multi_bridge_survival(x0, x1, log_barrier, sigma, h):
+    # Per-asset bridges treated as conditionally independent given the endpoints,
+    # which is only exact for uncorrelated assets (mlmc_best_of_barrier enforces it).
+    survival = 1.0
+    for i in range(x0.shape[0]):
+        exponent = -(2.0 * (log_barrier - x0[i]) * (log_barrier - x1[i])) / (sigma[i] ** 2 * h)
+        survival *= 1.0 - np.exp(exponent)
+    return survival
+
+'''
+Basket Asian: payoff max(0, A - K) with A the time average of sum_i w_i S_i(t).
+Undiscounted payoffs inside, discounted power sums of the corrections out.
+'''
+@njit(nogil=True)
+def _basket_asian_level_power_sums(S0, mu, sigma, chol, weights, T, level, n_paths, strike_price, r, key=-1):
+    d = S0.shape[0]
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+
+    log_s0 = np.log(S0)
+    basket0 = _basket_value(log_s0, weights)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    w1 = np.zeros(d)
+    w2 = np.zeros(d)
+    x_fine = np.zeros(d)
+    x_coarse = np.zeros(d)
+
+    sums = np.zeros(4)
+
+    for p in range(n_paths):
+        x_fine[:] = log_s0
+        x_coarse[:] = log_s0
+        sum_fine = basket0
+        sum_coarse = basket0
+
+        if level == 0:
+            kz = _correlated_normals(chol, keys, normals, kz, w1)
+            for i in range(d):
+                x_fine[i] += drift_fine[i] + vol_fine[i] * w1[i]
+            sum_fine += _basket_value(x_fine, weights)
+            avg_fine = sum_fine / 2.0
+            correction = avg_fine - strike_price if avg_fine > strike_price else 0.0
+        else:
+            for _ in range(n_fine // 2):
+                kz = _correlated_normals(chol, keys, normals, kz, w1)
+                kz = _correlated_normals(chol, keys, normals, kz, w2)
+                for i in range(d):
+                    x_fine[i] += drift_fine[i] + vol_fine[i] * w1[i]
+                sum_fine += _basket_value(x_fine, weights)
+                for i in range(d):
+                    x_fine[i] += drift_fine[i] + vol_fine[i] * w2[i]
+                sum_fine += _basket_value(x_fine, weights)
+                # coarse increment is the sum of the two fine increments
+                for i in range(d):
+                    x_coarse[i] += 2.0 * drift_fine[i] + vol_fine[i] * (w1[i] + w2[i])
+                sum_coarse += _basket_value(x_coarse, weights)
+
+            avg_fine = sum_fine / (n_fine + 1)
+            avg_coarse = sum_coarse / (n_fine // 2 + 1)
+            payoff_fine = avg_fine - strike_price if avg_fine > strike_price else 0.0
+            payoff_coarse = avg_coarse - strike_price if avg_coarse > strike_price else 0.0
+            correction = payoff_fine - payoff_coarse
+
+        correction *= disc
+        _accumulate_power_sums(sums, correction)
+
+    return sums
+
+'''
+Best-of / worst-of up-and-out call on performances S_i(t)/S_i(0).
+Payoff max(0, R(T) - K) with R = max_i (best-of) or min_i (worst-of) performance,
+knocked out as soon as any performance reaches the barrier.
+'''
+@njit(nogil=True)
+def _best_of_barrier_level_power_sums(mu, sigma, chol, T, level, n_paths, strike_price, barrier, r, best_of=True, bridge=False, key=-1):
+    d = mu.shape[0]
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    drift_fine = (mu - 0.5 * sigma * sigma) * dt_fine
+    vol_fine = sigma * np.sqrt(dt_fine)
+    disc = np.exp(-r * T)
+    b = np.log(barrier)
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+    w1 = np.zeros(d)
+    w2 = np.zeros(d)
+    xf0 = np.zeros(d)
+    xf1 = np.zeros(d)
+    xf2 = np.zeros(d)
+    xc0 = np.zeros(d)
+    xc1 = np.zeros(d)
+
+    sums = np.zeros(4)
+
+    for p in range(n_paths):
+        # log-performances start at 0
+        xf2[:] = 0.0
+        xc1[:] = 0.0
+        knocked_f = False
+        knocked_c = level == 0
+
+        if level == 0:
+            kz = _correlated_normals(chol, keys, normals, kz, w1)
+            for i in range(d):
+                xf1[i] = drift_fine[i] + vol_fine[i] * w1[i]
+            if _any_at_or_above(xf1, b):
+                knocked_f = True
+            elif bridge:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                U = uniforms[ku]
+                ku += 1
+                if U < 1.0 - _multi_bridge_survival(xf2, xf1, b, sigma, dt_fine):
+                    knocked_f = True
+            xf2[:] = xf1
+        else:
+            for _ in range(n_fine // 2):
+                if knocked_f and knocked_c:
+                    break
+                xf0[:] = xf2
+                xc0[:] = xc1
+                kz = _correlated_normals(chol, keys, normals, kz, w1)
+                kz = _correlated_normals(chol, keys, normals, kz, w2)
+                for i in range(d):
+                    xf1[i] = xf0[i] + drift_fine[i] + vol_fine[i] * w1[i]
+                    xf2[i] = xf1[i] + drift_fine[i] + vol_fine[i] * w2[i]
+                    xc1[i] = xc0[i] + 2.0 * drift_fine[i] + vol_fine[i] * (w1[i] + w2[i])
+
+                if not knocked_c and _any_at_or_above(xc1, b):
+                    knocked_c = True
+                if not knocked_f and (_any_at_or_above(xf1, b) or _any_at_or_above(xf2, b)):
+                    knocked_f = True
+
+                if bridge:
+                    # same uniform coupling as the single-asset kernel: the coarse
+                    # uniform is the min of the two fine uniforms pushed back to Unif(0,1)
+                    if ku > BLOCK_SIZE - 2:
+                        ku = _fill_uniforms(keys, uniforms)
+                    U1 = uniforms[ku]
+                    U2 = uniforms[ku + 1]
+                    ku += 2
+                    Umin = U1 if U1 < U2 else U2
+                    one_minus = 1.0 - Umin
+                    Uc = 1.0 - one_minus * one_minus
+
+                    if not knocked_c:
+                        if Uc < 1.0 - _multi_bridge_survival(xc0, xc1, b, sigma, dt_coarse):
+                            knocked_c = True
+                    if not knocked_f:
+                        if U1 < 1.0 - _multi_bridge_survival(xf0, xf1, b, sigma, dt_fine):
+                            knocked_f = True
+                        elif U2 < 1.0 - _multi_bridge_survival(xf1, xf2, b, sigma, dt_fine):
+                            knocked_f = True
+
+        payoff_fine = 0.0
+        if not knocked_f:
+            ref = _reference_performance(xf2, best_of)
+            if ref > strike_price:
+                payoff_fine = ref - strike_price
+        payoff_coarse = 0.0
+        if not knocked_c:
+            ref = _reference_performance(xc1, best_of)
+            if ref > strike_price:
+                payoff_coarse = ref - strike_price
+
+        correction = (payoff_fine - payoff_coarse) * disc
+        _accumulate_power_sums(sums, correction)
+
+    return sums
+
+'''
+Single level correction, sample variance, and cost calculations
+'''
+def _single_level_calc_basket_asian(S0, mu, sigma, chol, weights, level, n_paths, strike_price, r, T, return_correction_sum=False, return_power_sums=False, profiler=NULL_PROFILER):
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_basket_asian_level_power_sums], level=level):
+        sums = _basket_asian_level_power_sums(S0, mu, sigma, chol, weights, T, level, n_paths, strike_price, r)
+    end = time.perf_counter_ns()
+    with profiler.span("reduce", level=level):
+        mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    cost = end - start
+    return _level_return(mean, var, cost / n_paths, sums, return_correction_sum, return_power_sums)
+
+def _single_level_calc_best_of_barrier(mu, sigma, chol, level, n_paths, strike_price, barrier, r, T, return_correction_sum=False, return_power_sums=False, best_of=True, bridge=False, profiler=NULL_PROFILER):
+    start = time.perf_counter_ns()
+    with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_best_of_barrier_level_power_sums], level=level):
+        sums = _best_of_barrier_level_power_sums(mu, sigma, chol, T, level, n_paths, strike_price, barrier, r, best_of=best_of, bridge=bridge)
+    end = time.perf_counter_ns()
+    with profiler.span("reduce", level=level):
+        mean, var = _sums_to_level_stats(sums[0], sums[1], n_paths)
+    cost = end - start
+    return _level_return(mean, var, cost / n_paths, sums, return_correction_sum, return_power_sums)
+
+'''
+MLMC Estimators
+'''
+def mlmc_basket_asian(S0, mu, sigma, corr, weights, max_level, strike_price, r, T, epsilon, profiler=NULL_PROFILER, return_result=False, extrapolate=False):
+    """MLMC price and SE of an arithmetic-average basket Asian call.
+
+    S0, mu, sigma and weights are per-asset arrays (scalars are broadcast),
+    corr is the n_assets x n_assets correlation matrix of the driving Brownian motions.
+    """
+    chol = _cholesky_factor(corr)
+    n_assets = chol.shape[0]
+    S0 = _as_asset_array(S0, n_assets)
+    mu = _as_asset_array(mu, n_assets)
+    sigma = _as_asset_array(sigma, n_assets)
+    weights = _as_asset_array(weights, n_assets)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc_basket_asian(S0, mu, sigma, chol, weights, level, n_paths, strike_price, r, T, return_power_sums=True, profiler=profiler)
+
+    return _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=500, profiler=profiler, return_result=return_result, T=T, extrapolate=extrapolate)
+
+def mlmc_best_of_barrier(mu, sigma, corr, max_level, strike_price, barrier, r, T, epsilon, best_of=True, bridge=False, profiler=NULL_PROFILER, return_result=False, extrapolate=False):
+    """MLMC price and SE of a best-of (or worst-of) up-and-out call on performances.
+
+    strike_price and barrier are quoted in performance units (e.g. 1.0 and 1.2).
+    bridge=True needs uncorrelated assets: the bridge crossing probability
+    multiplies per-asset survivals, which is biased for any rho != 0.
+    """
+    chol = _cholesky_factor(corr)
+    if bridge and not np.allclose(chol, np.eye(chol.shape[0])):
+        raise ValueError("bridge=True requires an identity correlation matrix (per-asset bridge survivals are multiplied)")
+    n_assets = chol.shape[0]
+    mu = _as_asset_array(mu, n_assets)
+    sigma = _as_asset_array(sigma, n_assets)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc_best_of_barrier(mu, sigma, chol, level, n_paths, strike_price, barrier, r, T, return_power_sums=True, best_of=best_of, bridge=bridge, profiler=profiler)
+
+    return _mlmc_from_level_calc(level_calc, max_level, epsilon, n_pilot=1000, profiler=profiler, return_result=return_result, T=T, extrapolate=extrapolate)
@@ -0,0 +1,143 @@
+import numpy as np
+from numba import njit
+from mlmc.engine import _level_kernel_args, _level_power_sums, _accumulate_power_sums, _always_active
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.result import _level_moments
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Nested all-levels sampler
+
+    means, vars, kurtosis, power_sums = nested_variance_estimator(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 10, 0.05, 1.0, 50000)
+
+Per-level variance and kurtosis diagnostics normally run the coupled-level
+kernel once per level with fresh paths, which redoes the finest level's work
+about twice over. Here each path draws the level-L increments once and walks
+every grid 0..L at the same time: the log-price at a coarse grid point is the
+fine one (exact GBM increments), and a coarse step's bridge uniform is built
+from the two finer ones with the same min trick as the engine. Every level
+then sees exactly the coupling of the per-level kernel, so each D_l = P_l -
+P_{l-1} has the same distribution, for about 2 x 2^L step callbacks and 2^L
+normals per path (the per-level passes take about 3 x 2^L and 2 x 2^L).
+
+That only pays for products without early exit. With knock-outs the coarse
+levels keep running after the fine ones have knocked out, and the nested pass
+is no faster than the per-level passes (L=10, 10000 paths: plain barrier
+1.5 s vs 1.3 s, bridge barrier 1.6 s vs 1.7 s, Asian 0.27 s vs 0.50 s), so
+specs whose `active` is not _always_active get the per-level passes.
+
+The levels share their paths, so the D_l are correlated with each other:
+fine for per-level means, variances and rates, but sum(vars / n) is not the
+SE of their sum (which telescopes to P_L). Use the per-level drivers to
+price. There are no per-level costs either, since one pass cannot measure
+them; time _single_level_calc for cost plots and gamma fits.
+'''
+@njit(nogil=True)
+def _nested_power_sums(S0, mu, sigma, T, max_level, n_paths, r, params, n_state, init, step, active, terminal, uses_uniforms, key=-1):
+    """Power sums (L+1, 4) of the discounted corrections D_l of every level 0..L on the same level-L paths."""
+    L = max_level
+    n_fine = 2**L
+    disc = np.exp(-r * T)
+    x0 = np.log(S0)
+
+    hs = np.zeros(L+1)
+    drifts = np.zeros(L+1)
+    vols = np.zeros(L+1)
+    for level in range(L+1):
+        hs[level] = T / 2**level
+        drifts[level] = (mu - 0.5 * sigma * sigma) * hs[level]
+        vols[level] = sigma * np.sqrt(hs[level])
+    strides = np.zeros(L+1, dtype=np.int64)     # level-L steps per step of each level
+    for level in range(L+1):
+        strides[level] = 1 << (L - level)
+    states = np.zeros((L+1, n_state))
+    live = np.zeros(L+1, dtype=np.bool_)
+    x_last = np.zeros(L+1)
+    pending = np.zeros(L+1)     # first uniform of a level's unfinished step, -1 if none yet
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros((L+1, 4))
+
+    for p in range(n_paths):
+        for level in range(L+1):
+            init(states[level], x0, params)
+            live[level] = active(states[level], params)
+            x_last[level] = x0
+            pending[level] = -1.0
+
+        # levels finer than `top` have fixed payoffs, so once they are all done the path moves on the finest grid
+        # still needed, drawing that grid's increments (and uniforms) directly
+        top = L
+        i = 0
+        while i < n_fine:
+            while top >= 0 and not live[top]:
+                top -= 1
+            if top < 0:
+                break
+            grid = top
+            while i & (strides[grid] - 1) != 0:
+                grid += 1
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            x = x_last[grid] + drifts[grid] + vols[grid] * normals[kz]
+            kz += 1
+            i += strides[grid]
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+
+            # finish this grid's step, then every coarser step that ends at this point
+            level = grid
+            while True:
+                if live[level]:
+                    step(states[level], x_last[level], x, hs[level], sigma, params, u)
+                    live[level] = active(states[level], params)
+                x_last[level] = x
+                if level == 0:
+                    break
+                if pending[level-1] < 0.0:
+                    pending[level-1] = u
+                    break
+                u_min = pending[level-1] if pending[level-1] < u else u
+                pending[level-1] = -1.0
+                # F_min(u) = 1 - (1-u)^2 maps the min of two uniforms back to Unif(0,1)
+                u = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+                level -= 1
+
+        coarse = 0.0
+        for level in range(L+1):
+            payoff = disc * terminal(states[level], x_last[level], 2**level, params)
+            _accumulate_power_sums(sums[level], payoff - coarse)
+            coarse = payoff
+
+    return sums
+
+def nested_variance_estimator(spec, params, S0, mu, sigma, max_level, r, T, n_paths, profiler=NULL_PROFILER):
+    """(means, vars, kurtosis, power_sums) of every level's corrections on n_paths paths (see module docstring).
+
+    One nested pass for products without early exit, one coupled pass per level otherwise.
+    """
+    args = _level_kernel_args(spec, params)
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    L = max_level
+    if spec.active is _always_active:
+        with compile_watch(profiler, [_nested_power_sums]):
+            _nested_power_sums(S0, mu, sigma, T, L, 0, r, *args)
+        with profiler.span("sample", level=L, samples=n_paths):
+            power_sums = _nested_power_sums(S0, mu, sigma, T, L, n_paths, r, *args)
+    else:
+        power_sums = np.zeros((L+1, 4))
+        for level in range(L+1):
+            with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_power_sums], level=level):
+                power_sums[level] = _level_power_sums(S0, mu, sigma, T, level, n_paths, r, *args)
+
+    means, vars, kurtosis = _level_moments(power_sums, np.full(L+1, n_paths))
+    return means, vars, kurtosis, power_sums
@@ -2,16 +2,19 @@ import numpy as np
 from numba import njit
 from mlmc.sde import simulate_gbm_coupled_paths
 from mlmc.sde import _brownian_bridge_calc
+from mlmc.engine import PayoffSpec, _always_active
+from mlmc.analytic import geometric_asian_call, up_and_out_call
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _fill_uniforms
 
 '''
 Asian payoffs
 '''
-@njit
+@njit(nogil=True)
 def asian_payoff_single_path(path, strike_price):
     avg_price = np.mean(path)
     return 0 if avg_price - strike_price < 0 else avg_price - strike_price
 
-@njit
+@njit(nogil=True)
 def asian_payoff_per_path(paths, strike_price):
     n_paths, n_steps = np.shape(paths)
     payoffs = np.zeros(n_paths)
@@ -22,7 +25,7 @@ def asian_payoff_per_path(paths, strike_price):
 '''
 Undiscounted!!!
 '''
-@njit
+@njit(nogil=True)
 def _asian_payoff_coupled_paths(fine_paths, coarse_paths, strike_price):
     n_paths_fine, n_steps_fine = np.shape(fine_paths)
     n_paths_coarse, n_steps_coarse = np.shape(coarse_paths)
@@ -33,7 +36,7 @@ def _asian_payoff_coupled_paths(fine_paths, coarse_paths, strike_price):
         payoffs_coarse[idx] = asian_payoff_single_path(coarse_paths[idx], strike_price)
     return payoffs_fine, payoffs_coarse
 
-@njit
+@njit(nogil=True)
 def asian_corrections(fine_paths, coarse_paths, strike_price):
     payoffs_fine, payoffs_coarse = _asian_payoff_coupled_paths(fine_paths, coarse_paths, strike_price)
     return payoffs_fine - payoffs_coarse
@@ -43,7 +46,7 @@ def asian_corrections(fine_paths, coarse_paths, strike_price):
 Barrier call (up-and-out) payoffs
 '''
 
-@njit
+@njit(nogil=True)
 def barrier_payoff_single_path(path, strike_price, barrier, h, sigma, bridge=False):
     for idx in range(1, len(path)):
         price = path[idx]
@@ -58,7 +61,7 @@ def barrier_payoff_single_path(path, strike_price, barrier, h, sigma, bridge=Fal
 
     return 0 if path[-1] - strike_price < 0 else path[-1] - strike_price
 
-@njit
+@njit(nogil=True)
 def barrier_payoff_per_path(paths, strike_price, barrier, h, sigma, bridge=False):
     n_paths, n_steps = np.shape(paths)
     payoffs = np.zeros(n_paths)
@@ -69,7 +72,7 @@ def barrier_payoff_per_path(paths, strike_price, barrier, h, sigma, bridge=False
 '''
 Undiscounted!!!
 '''
-@njit
+@njit(nogil=True)
 def _barrier_payoff_coupled_paths(fine_paths, coarse_paths, strike_price, barrier, h_fine, sigma, bridge=False):
     n_paths_fine, n_steps_fine = np.shape(fine_paths)
     n_paths_coarse, n_steps_coarse = np.shape(coarse_paths)
@@ -81,6 +84,10 @@ def _barrier_payoff_coupled_paths(fine_paths, coarse_paths, strike_price, barrie
     b = np.log(barrier)
     h_coarse = 2.0 * h_fine
 
+    keys = _rng_keys()
+    uniforms = np.empty(BLOCK_SIZE)
+    ku = BLOCK_SIZE
+
     for i in range(n_paths_fine):
         knocked_f = False
         knocked_c = False
@@ -115,8 +122,11 @@ def _barrier_payoff_coupled_paths(fine_paths, coarse_paths, strike_price, barrie
             if bridge:
                 # Use two independent uniforms for the two fine sub-interval bridge tests.
                 # Then derive a *uniform* Uc from their minimum for the coarse bridge test.
-                U1 = np.random.random()
-                U2 = np.random.random()
+                if ku > BLOCK_SIZE - 2:
+                    ku = _fill_uniforms(keys, uniforms)
+                U1 = uniforms[ku]
+                U2 = uniforms[ku + 1]
+                ku += 2
                 Umin = U1
                 if U2 < Umin:
                     Umin = U2
@@ -153,8 +163,104 @@ def _barrier_payoff_coupled_paths(fine_paths, coarse_paths, strike_price, barrie
 
     return payoffs_fine, payoffs_coarse
 
-@njit
+@njit(nogil=True)
 def barrier_corrections(fine_paths, coarse_paths, strike_price, barrier, h_fine, sigma, bridge=False):
     payoffs_fine, payoffs_coarse = _barrier_payoff_coupled_paths(fine_paths, coarse_paths, strike_price, barrier, h_fine, sigma, bridge=bridge)
     return payoffs_fine - payoffs_coarse
 
+
+'''
+Payoff specs for the generic engine (mlmc.engine); callbacks see log-prices
+'''
+#Asian: state[0] = running sum of the monitored prices (S0 included), state[1] = same for log-prices, params = [K]
+#control: geometric-average call on the same monitoring dates
+@njit(nogil=True)
+def _asian_init(state, x0, params):
+    state[0] = np.exp(x0)
+    state[1] = x0
+
+@njit(nogil=True)
+def _asian_step(state, x_prev, x_next, h, sigma, params, u):
+    state[0] += np.exp(x_next)
+    state[1] += x_next
+
+@njit(nogil=True)
+def _asian_terminal(state, x_T, n_steps, params):
+    avg_price = state[0] / (n_steps + 1)
+    return avg_price - params[0] if avg_price > params[0] else 0.0
+
+@njit(nogil=True)
+def _asian_control(state, x_T, n_steps, params):
+    geo_price = np.exp(state[1] / (n_steps + 1))
+    return geo_price - params[0] if geo_price > params[0] else 0.0
+
+def _asian_control_mean(params, S0, mu, sigma, T, n_steps):
+    return geometric_asian_call(S0, mu, sigma, T, n_steps, params[0])
+
+ASIAN_SPEC = PayoffSpec("asian", 2, _asian_init, _asian_step, _always_active, _asian_terminal, False, 500,
+                        _asian_control, _asian_control_mean)
+
+def asian_params(strike_price):
+    return np.array([strike_price], dtype=np.float64)
+
+#Barrier (up-and-out call): state[0] = knocked-out flag, state[1] = bridge survival probability of the path so far,
+#params = [K, log B, bridge, control]
+#control: (S_T - K)^+ times the survival probability, whose mean is the continuously monitored price on every grid,
+#so it is only tracked (and paths only kept alive past a knock-out) when params[3] is set. It does not pay: it only
+#correlates well with the level-0 payoff (rho^2 ~ 0.6); on the corrections rho^2 is ~0.05-0.2, which the per-step
+#bridge probability and the knocked-out paths kept alive to maturity cost back (10-25% per sample), so keep it off
+@njit(nogil=True)
+def _barrier_init(state, x0, params):
+    state[0] = 1.0 if x0 >= params[1] else 0.0
+    state[1] = 1.0 - state[0] if params[3] != 0.0 else 0.0
+
+#reads state and params into locals and writes state back once (see the callback note in mlmc.engine)
+@njit(nogil=True)
+def _barrier_step(state, x_prev, x_next, h, sigma, params, u):
+    knocked = state[0]
+    survival = state[1]
+    log_barrier = params[1]
+    bridge = params[2] != 0.0
+    control = params[3] != 0.0
+    if control and survival > 0.0:
+        if x_next >= log_barrier:
+            survival = 0.0
+        else:
+            survival *= 1.0 - _brownian_bridge_calc(x_prev, x_next, h, log_barrier, sigma)
+    if knocked == 0.0:
+        if x_next >= log_barrier:
+            knocked = 1.0
+        elif bridge and u < _brownian_bridge_calc(x_prev, x_next, h, log_barrier, sigma):
+            knocked = 1.0
+    state[0] = knocked
+    state[1] = survival
+
+@njit(nogil=True)
+def _barrier_active(state, params):
+    knocked = state[0]
+    survival = state[1]
+    return knocked == 0.0 or survival > 0.0
+
+@njit(nogil=True)
+def _barrier_terminal(state, x_T, n_steps, params):
+    knocked = state[0]
+    strike_price = params[0]
+    S_T = np.exp(x_T)
+    return S_T - strike_price if knocked == 0.0 and S_T > strike_price else 0.0
+
+@njit(nogil=True)
+def _barrier_control(state, x_T, n_steps, params):
+    S_T = np.exp(x_T)
+    return (S_T - params[0]) * state[1] if S_T > params[0] else 0.0
+
+def _barrier_control_mean(params, S0, mu, sigma, T, n_steps):
+    return up_and_out_call(S0, mu, sigma, T, params[0], np.exp(params[1]))
+
+def _barrier_uses_uniforms(params):
+    return params[2] != 0.0
+
+BARRIER_SPEC = PayoffSpec("barrier", 2, _barrier_init, _barrier_step, _barrier_active, _barrier_terminal, _barrier_uses_uniforms, 1000,
+                          _barrier_control, _barrier_control_mean)
+
+def barrier_params(strike_price, barrier, bridge=False, control_variate=False):
+    return np.array([strike_price, np.log(barrier), 1.0 if bridge else 0.0, 1.0 if control_variate else 0.0], dtype=np.float64)
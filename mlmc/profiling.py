@@ -0,0 +1,238 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from numba import njit
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _fill_normals, _fill_uniforms
+
+'''
+Opt-in profiling for the MLMC and MC entry points
+
+    prof = Profiler(track_memory=True, decompose=True)
+    price, se = mlmc_asian(..., profiler=prof)
+    prof.summary()                      # nested dict, per level and per phase
+    prof.to_json("profile.json")
+    prof.to_chrome_trace("trace.json")  # load in chrome://tracing or Perfetto
+
+Phases recorded by the drivers:
+    warmup    the eager warmup() done by mlmc_asian / mlmc_barrier
+    compile   numba compilation triggered during the call (from numba's own timers,
+              nested inside the `sample` span that triggered it)
+    sample    compiled level / MC kernel (RNG + stepping + payoff, fused)
+    reduce    sums -> mean / variance
+    pilot     all pilot levels; refine: all additional samples (both contain `sample`)
+    allocate  choosing N_l from the pilot estimates
+With decompose=True every sampled level is followed by small probe runs that
+split `sample` into rng / stepping / payoff (payoff includes barrier checks and
+bridge probabilities), scaled to the level's sample count. The probes add a
+few percent of runtime and are themselves not part of any estimate.
+
+When no profiler is passed the drivers use NULL_PROFILER, whose span() is a
+shared nullcontext, so the disabled cost is one attribute lookup per level.
+'''
+class _NullProfiler:
+    enabled = False
+    decompose = False
+
+    def span(self, phase, level=None, samples=0):
+        return nullcontext()
+
+    def add(self, phase, dur_ns, level=None, samples=0, nbytes=0, start_ns=None):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+NULL_PROFILER = _NullProfiler()
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, track_memory=False, decompose=False, probe_paths=2000):
+        self.track_memory = track_memory
+        self.decompose = decompose
+        self.probe_paths = probe_paths
+        self.events = []
+        self.counters = {}
+        self._memory_stack = []     # [bytes at entry, peak so far] per open span
+        self._started_tracing = False
+        self._origin_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, phase, level=None, samples=0):
+        nbytes = 0
+        if self.track_memory:
+            self._enter_memory()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            if self.track_memory:
+                nbytes = self._exit_memory()
+            self.add(phase, end - start, level=level, samples=samples, nbytes=nbytes, start_ns=start)
+
+    def _enter_memory(self):
+        # tracemalloc has one global peak: fold it into the enclosing span's running peak before resetting it
+        if not self._memory_stack and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory_stack:
+            self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memory_stack.append([current, current])
+
+    def _exit_memory(self):
+        """Peak bytes above the span's starting point; stops tracemalloc when the outermost span that started it ends."""
+        before, peak = self._memory_stack.pop()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self._memory_stack:
+            self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+            tracemalloc.reset_peak()
+        elif self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return max(peak - before, 0)
+
+    def add(self, phase, dur_ns, level=None, samples=0, nbytes=0, start_ns=None):
+        if start_ns is None:
+            start_ns = time.perf_counter_ns() - dur_ns
+        self.events.append({"phase": phase, "level": level, "start_ns": start_ns - self._origin_ns,
+                            "dur_ns": int(dur_ns), "samples": int(samples), "bytes": int(nbytes)})
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Totals per phase and per (level, phase), with samples/sec for the sampling phases."""
+        phases = {}
+        levels = {}
+        for ev in self.events:
+            for bucket in (phases.setdefault(ev["phase"], _empty_totals()),
+                           levels.setdefault(str(ev["level"]), {}).setdefault(ev["phase"], _empty_totals())):
+                bucket["time_s"] += ev["dur_ns"] * 1e-9
+                bucket["calls"] += 1
+                bucket["samples"] += ev["samples"]
+                bucket["bytes"] += ev["bytes"]
+        for bucket in list(phases.values()) + [b for lvl in levels.values() for b in lvl.values()]:
+            bucket["samples_per_s"] = bucket["samples"] / bucket["time_s"] if bucket["samples"] and bucket["time_s"] > 0 else None
+        wall = 0.0
+        if self.events:
+            wall = (max(e["start_ns"] + e["dur_ns"] for e in self.events) - min(e["start_ns"] for e in self.events)) * 1e-9
+        return {
+            "wall_time_s": wall,
+            "compile_time_s": phases.get("compile", {}).get("time_s", 0.0),
+            "phases": phases,
+            "levels": levels,
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self, path=None):
+        payload = json.dumps({"summary": self.summary(), "events": self.events}, indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(payload)
+        return payload
+
+    def to_chrome_trace(self, path):
+        """Write the events in Chrome trace-event format (one row per level)."""
+        trace = []
+        for ev in self.events:
+            trace.append({
+                "name": ev["phase"], "cat": "mlmc", "ph": "X",
+                "ts": ev["start_ns"] / 1000.0, "dur": ev["dur_ns"] / 1000.0,
+                "pid": 0, "tid": -1 if ev["level"] is None else ev["level"],
+                "args": {"level": ev["level"], "samples": ev["samples"], "bytes": ev["bytes"]},
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+def _empty_totals():
+    return {"time_s": 0.0, "calls": 0, "samples": 0, "bytes": 0}
+
+'''
+Compile-time accounting and kernel decomposition probes
+'''
+def _compile_seconds(dispatchers):
+    total = 0.0
+    for dispatcher in dispatchers:
+        for cres in dispatcher.overloads.values():
+            timers = cres.metadata.get("timers", {}) if cres.metadata else {}
+            total += timers.get("compiler_lock", 0.0)
+    return total
+
+@contextmanager
+def compile_watch(profiler, dispatchers, level=None):
+    """Record numba compilation done by `dispatchers` while the block runs as a `compile` event."""
+    if not profiler.enabled:
+        yield
+        return
+    before = _compile_seconds(dispatchers)
+    try:
+        yield
+    finally:
+        compiled = _compile_seconds(dispatchers) - before
+        if compiled > 0:
+            profiler.add("compile", compiled * 1e9, level=level)
+            profiler.count("compilations")
+
+@njit(nogil=True)
+def _rng_probe(n_normals, n_uniforms):
+    keys = _rng_keys()
+    block = np.empty(BLOCK_SIZE)
+    acc = 0.0
+    for start in range(0, n_normals, BLOCK_SIZE):
+        _fill_normals(keys, block[:min(BLOCK_SIZE, n_normals - start)])
+        acc += block[0]
+    for start in range(0, n_uniforms, BLOCK_SIZE):
+        _fill_uniforms(keys, block[:min(BLOCK_SIZE, n_uniforms - start)])
+        acc += block[0]
+    return acc
+
+@njit(nogil=True)
+def _noop_init(state, x0, params):
+    pass
+
+@njit(nogil=True)
+def _noop_step(state, x_prev, x_next, h, sigma, params, u):
+    pass
+
+@njit(nogil=True)
+def _noop_active(state, params):
+    return True
+
+@njit(nogil=True)
+def _noop_terminal(state, x_T, n_steps, params):
+    return 0.0
+
+def record_level_decomposition(profiler, level_kernel, level, n_samples, sample_ns, n_normals_per_path, n_uniforms_per_path):
+    """Split a level's measured `sample` time (sample_ns) into rng / stepping / payoff.
+
+    `level_kernel(n_paths, noop)` must run the level kernel for n_paths with
+    either the real callbacks or the no-op ones. The three probe timings on
+    profiler.probe_paths paths are rescaled so that they add up to sample_ns;
+    products that exit paths early (knock-outs) are thus split pro rata.
+    """
+    n_probe = max(1, min(profiler.probe_paths, n_samples))
+    # compile outside the timed region
+    _rng_probe(1, 1)
+    level_kernel(1, True)
+
+    start = time.perf_counter_ns()
+    _rng_probe(n_probe * n_normals_per_path, n_probe * n_uniforms_per_path)
+    rng_ns = time.perf_counter_ns() - start
+
+    start = time.perf_counter_ns()
+    level_kernel(n_probe, True)
+    noop_ns = time.perf_counter_ns() - start
+
+    start = time.perf_counter_ns()
+    level_kernel(n_probe, False)
+    full_ns = time.perf_counter_ns() - start
+
+    parts = {"rng": rng_ns, "stepping": max(noop_ns - rng_ns, 0), "payoff": max(full_ns - noop_ns, 0)}
+    total = sum(parts.values())
+    for phase, ns in parts.items():
+        profiler.add(phase, sample_ns * ns / total if total > 0 else 0, level=level, samples=n_samples)
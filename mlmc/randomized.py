@@ -0,0 +1,115 @@
+import warnings
+from dataclasses import dataclass, field
+import numpy as np
+from mlmc.engine import _single_level_calc, _variance_estimator
+from mlmc.profiling import NULL_PROFILER
+from mlmc.rates import fit_rates
+
+'''
+Unbiased randomized MLMC (single-term estimator, Rhee & Glynn)
+
+Every sample draws its level l from a distribution p_l on 0, 1, 2, ... and
+returns the importance-weighted correction Y_l / p_l. Since
+E[Y_l / p_l] = sum_l E[Y_l] = E[P_infinity], the estimator has no
+discretisation bias and no max_level to choose, and samples are i.i.d.
+units of work that can be split across cores or processes freely.
+
+The distribution is tuned from a short pilot of levels 0..n_tune_levels:
+p_l ~ sqrt(V_l / C_l) there, continued geometrically with ratio
+2^-((beta + gamma) / 2) from the fitted rates. Var x cost is finite only if
+beta > gamma (a warning is issued otherwise; the Asian call has beta = 2,
+gamma = 1, the discretely monitored barrier beta ~ 1/2). Levels are capped
+at level_cap (2^20 steps by default), whose probability is negligible.
+'''
+@dataclass
+class SingleTermResult:
+    price: float
+    se: float
+    epsilon: float
+    n_samples: int
+    level_probs: np.ndarray        # tuned p_l, l = 0..level_cap
+    level_counts: np.ndarray       # samples drawn per level
+    variance: float                # Var[Y_l / p_l] per sample
+    mean_cost: float               # measured ns per sample, averaged over the drawn levels
+    work_variance: float           # variance x mean_cost, the figure of merit (lower is better)
+    rates: dict = field(default_factory=dict)
+
+    def __iter__(self):
+        yield self.price
+        yield self.se
+
+def _tune_level_probs(means, vars, costs, level_cap, T):
+    """p_l ~ sqrt(V_l / C_l) on the pilot levels, geometric tail from the fitted beta / gamma."""
+    n_tune = len(vars)
+    rates = fit_rates(means, vars, costs, T=T, start=1)
+    beta, gamma = rates["beta"], rates["gamma"]
+    if not (np.isfinite(beta) and np.isfinite(gamma)) or beta <= gamma:
+        warnings.warn(f"beta = {beta:.2f} <= gamma = {gamma:.2f}: the single-term estimator has infinite variance x cost; "
+                      "prefer the standard MLMC driver for this product", RuntimeWarning, stacklevel=3)
+    ratio = 2.0 ** (-(beta + gamma) / 2.0) if np.isfinite(beta + gamma) and beta + gamma > 0 else 0.5
+    ratio = min(ratio, 0.9)
+    weights = np.zeros(level_cap + 1)
+    weights[:n_tune] = np.sqrt(np.maximum(vars, 1e-300) / costs)
+    for level in range(n_tune, level_cap + 1):
+        weights[level] = weights[level - 1] * ratio
+    return weights / weights.sum(), rates
+
+def _single_term_from_level_calc(level_calc, epsilon, n_tune_levels=5, n_pilot=500, n_first=2000, level_cap=20, rng=None,
+                                 profiler=NULL_PROFILER, return_result=False, T=1.0):
+    rng = np.random.default_rng() if rng is None else rng
+    with profiler.span("pilot", samples=n_pilot * (n_tune_levels + 1)):
+        means, vars, costs, _ = _variance_estimator(level_calc, n_tune_levels, n_pilot)
+    with profiler.span("allocate"):
+        probs, rates = _tune_level_probs(means, vars, costs, level_cap, T)
+
+    counts = np.zeros(level_cap + 1, dtype=np.int64)
+    s1 = np.zeros(level_cap + 1)
+    s2 = np.zeros(level_cap + 1)
+    time_ns = 0.0
+
+    def draw(n_total):
+        nonlocal time_ns
+        batch = rng.multinomial(n_total, probs)
+        with profiler.span("refine", samples=int(n_total)):
+            for level in np.nonzero(batch)[0]:
+                _, _, cost_p_path, sums = level_calc(int(level), int(batch[level]))
+                s1[level] += sums[0]
+                s2[level] += sums[1]
+                counts[level] += batch[level]
+                time_ns += cost_p_path * batch[level]
+
+    def moments():
+        n = counts.sum()
+        mean = np.sum(s1 / probs) / n
+        second = np.sum(s2 / probs**2) / n
+        var = max(second - mean * mean, 0.0) * n / max(n - 1, 1)
+        return n, mean, var
+
+    draw(n_first)
+    n, _, var = moments()
+    n_target = int(np.ceil(var / (epsilon / 2.0)**2))
+    if n_target > n:
+        draw(n_target - n)
+    n, price, var = moments()
+    for level in np.nonzero(counts)[0]:
+        profiler.count(f"samples.level_{level}", int(counts[level]))
+
+    mean_cost = float(time_ns / n)
+    result = SingleTermResult(
+        price=float(price), se=float(np.sqrt(var / n)), epsilon=epsilon, n_samples=int(n),
+        level_probs=probs, level_counts=counts, variance=float(var), mean_cost=mean_cost,
+        work_variance=float(var * mean_cost), rates=rates,
+    )
+    if return_result:
+        return result
+    return result.price, result.se
+
+def mlmc_single_term(spec, params, S0, mu, sigma, r, T, epsilon, n_tune_levels=5, level_cap=20, rng=None, profiler=NULL_PROFILER, return_result=False):
+    """Unbiased randomized-MLMC price with SE <= epsilon/2 for the product `spec` (no max_level; see module docstring)."""
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+
+    def level_calc(level, n_paths):
+        return _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_power_sums=True, profiler=profiler)
+
+    return _single_term_from_level_calc(level_calc, epsilon, n_tune_levels=n_tune_levels, n_pilot=spec.n_pilot, level_cap=level_cap, rng=rng,
+                                        profiler=profiler, return_result=return_result, T=T)
@@ -0,0 +1,46 @@
+import numpy as np
+
+'''
+MLMC rate estimation
+
+With h_l = T / 2^l, MLMC theory assumes
+    |E[P_l - P_{l-1}]| ~ h_l^alpha   (weak order)
+    Var[P_l - P_{l-1}] ~ h_l^beta    (variance decay)
+    C_l                ~ h_l^-gamma  (cost growth)
+The slopes are fitted by least squares on a log-log scale, skipping the
+first `start` levels where the asymptotic regime has not kicked in yet
+(level 0 is a plain MC estimate of P_0, not a correction).
+'''
+def _loglog_fit(hs, ys):
+    """Slope, intercept and R^2 of log(ys) vs log(hs); nan if fewer than 2 usable points."""
+    hs = np.asarray(hs, dtype=np.float64)
+    ys = np.abs(np.asarray(ys, dtype=np.float64))
+    mask = (ys > 0) & np.isfinite(ys)
+    if np.count_nonzero(mask) < 2:
+        return float("nan"), float("nan"), float("nan")
+    x = np.log(hs[mask])
+    y = np.log(ys[mask])
+    slope, intercept = np.polyfit(x, y, 1)
+    resid = y - (slope * x + intercept)
+    ss_tot = np.sum((y - y.mean()) ** 2)
+    r2 = 1.0 - np.sum(resid ** 2) / ss_tot if ss_tot > 0 else 1.0
+    return float(slope), float(intercept), float(r2)
+
+def fit_rates(means, vars, costs, T=1.0, start=2):
+    """Fit alpha, beta, gamma from per-level correction means, variances and costs.
+
+    Returns a dict with the three exponents, their intercepts (log-scale
+    constants, used to extrapolate) and the R^2 of each fit.
+    """
+    levels = np.arange(len(means))
+    hs = T / 2.0 ** levels
+    start = max(start, 1)
+    alpha, log_c_alpha, r2_alpha = _loglog_fit(hs[start:], means[start:])
+    beta, log_c_beta, r2_beta = _loglog_fit(hs[start:], vars[start:])
+    neg_gamma, log_c_gamma, r2_gamma = _loglog_fit(hs[start:], costs[start:])
+    return {
+        "alpha": alpha, "beta": beta, "gamma": -neg_gamma,
+        "log_c_alpha": log_c_alpha, "log_c_beta": log_c_beta, "log_c_gamma": log_c_gamma,
+        "r2_alpha": r2_alpha, "r2_beta": r2_beta, "r2_gamma": r2_gamma,
+        "start": start,
+    }
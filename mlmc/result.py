@@ -0,0 +1,110 @@
+from dataclasses import dataclass, field
+import numpy as np
+from mlmc.rates import fit_rates
+
+'''
+MLMC result object
+
+Returned by the MLMC entry points when called with return_result=True. It
+unpacks like the plain (price, se) tuple, so `price, se = mlmc_asian(...,
+return_result=True)` keeps working.
+'''
+@dataclass
+class MLMCResult:
+    price: float
+    se: float
+    epsilon: float
+    max_level: int
+    n_samples: np.ndarray          # N_l
+    means: np.ndarray              # E[P_l - P_{l-1}] (E[P_0] at level 0), discounted
+    variances: np.ndarray          # Var[P_l - P_{l-1}]
+    kurtosis: np.ndarray           # kurtosis of the corrections; large values mean the variances are unreliable
+    costs: np.ndarray              # measured ns per sample
+    total_cost: float              # sum_l N_l C_l in ns
+    rates: dict = field(default_factory=dict)  # alpha/beta/gamma with R^2 (mlmc.rates.fit_rates)
+    control_coefficients: np.ndarray = None    # per-level control-variate coefficients (control_variate=True only)
+    importance_shift: float = None             # drift shift of the sampling measure (mlmc.importance only)
+
+    def __iter__(self):
+        yield self.price
+        yield self.se
+
+    def bias_estimate(self):
+        """Extrapolated weak error |E[P_L] - E[P]| ~ |Y_L| / (2^alpha - 1).
+
+        |Y_L| is taken as the max over the last three levels rescaled to level L
+        with the fitted alpha, which is far less noisy than Y_L alone.
+        """
+        return _bias_from_means(self.means, self.rates.get("alpha", float("nan")))
+
+    def diagnostics(self, kurtosis_limit=100.0, r2_limit=0.8):
+        """List of human-readable warnings about convergence health; empty if nothing looks off."""
+        warnings = []
+        if self.se > self.epsilon / 2.0 * 1.05:
+            warnings.append(f"SE {self.se:.3g} exceeds the sampling budget eps/2 = {self.epsilon / 2.0:.3g}")
+        bias = self.bias_estimate()
+        if bias > self.epsilon / 2.0:
+            warnings.append(f"estimated bias {bias:.3g} exceeds eps/2 = {self.epsilon / 2.0:.3g}; increase max_level")
+        high_kurt = [l for l in range(1, self.max_level + 1) if self.kurtosis[l] > kurtosis_limit]
+        if high_kurt:
+            warnings.append(f"kurtosis above {kurtosis_limit:g} on levels {high_kurt}; variance estimates are unreliable")
+        for rate in ("alpha", "beta", "gamma"):
+            r2 = self.rates.get(f"r2_{rate}", float("nan"))
+            if np.isfinite(r2) and r2 < r2_limit:
+                warnings.append(f"{rate} fit has R^2 = {r2:.2f}; the level sequence may not be in the asymptotic regime")
+        return warnings
+
+    def to_dict(self):
+        return {
+            "price": float(self.price), "se": float(self.se), "epsilon": float(self.epsilon),
+            "max_level": int(self.max_level),
+            "n_samples": [int(n) for n in self.n_samples],
+            "means": [float(x) for x in self.means],
+            "variances": [float(x) for x in self.variances],
+            "kurtosis": [float(x) for x in self.kurtosis],
+            "costs": [float(x) for x in self.costs],
+            "total_cost": float(self.total_cost),
+            "rates": {k: float(v) for k, v in self.rates.items()},
+            "control_coefficients": None if self.control_coefficients is None else [float(b) for b in self.control_coefficients],
+            "importance_shift": None if self.importance_shift is None else float(self.importance_shift),
+        }
+
+def _bias_from_means(means, alpha):
+    """MLMCResult.bias_estimate for the level means `means` (levels 0..L) and a fitted alpha."""
+    if not np.isfinite(alpha) or alpha <= 0:
+        alpha = 1.0
+    L = len(means) - 1
+    tail = [abs(means[l]) / 2.0**((L - l) * alpha) for l in range(max(L - 2, 1), L + 1)]
+    if not tail:
+        return float("nan")
+    return max(tail) / (2.0**alpha - 1.0)
+
+def _level_moments(power_sums, n_samples):
+    """Means, unbiased variances and kurtosis per level from [sum x, sum x^2, sum x^3, sum x^4]."""
+    n = np.maximum(np.asarray(n_samples, dtype=np.float64), 1.0)
+    s1, s2, s3, s4 = (power_sums[:, k] / n for k in range(4))
+    means = s1
+    m2 = np.maximum(s2 - s1 * s1, 0.0)
+    m4 = s4 - 4.0 * s1 * s3 + 6.0 * s1 * s1 * s2 - 3.0 * s1**4
+    variances = np.where(n > 1, m2 * n / np.maximum(n - 1, 1), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kurtosis = np.where(m2 > 0, m4 / (m2 * m2), np.nan)
+    return means, variances, kurtosis
+
+def _build_result(power_sums, n_samples, time_ns, epsilon, T=1.0):
+    means, variances, kurtosis = _level_moments(power_sums, n_samples)
+    n = np.maximum(n_samples, 1)
+    costs = time_ns / n
+    return MLMCResult(
+        price=float(np.sum(means)),
+        se=float(np.sqrt(np.sum(variances / n))),
+        epsilon=epsilon,
+        max_level=len(means) - 1,
+        n_samples=np.asarray(n_samples, dtype=np.int64),
+        means=means,
+        variances=variances,
+        kurtosis=kurtosis,
+        costs=costs,
+        total_cost=float(np.sum(time_ns)),
+        rates=fit_rates(means, variances, costs, T=T),
+    )
@@ -0,0 +1,136 @@
+import numpy as np
+from numba import njit, uint64
+
+'''
+Block random-variate generation for the compiled kernels
+
+    keys = _rng_keys()
+    normals = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ...
+    if kz > BLOCK_SIZE - 2:
+        kz = _fill_normals(keys, normals)
+    z1 = normals[kz]
+    z2 = normals[kz + 1]
+    kz += 2
+
+numba's np.random.normal() is an MT19937 draw plus a polar-method rejection
+per call (~35 ns). Here the bits come from a counter-based generator
+(splitmix64 of key + counter * golden gamma, so block i of a stream can be
+produced without the ones before it) and normals from a 128-layer ziggurat
+(Marsaglia & Tsang, Doornik's ZIGNOR layout), which needs one 64-bit draw and
+a compare in ~99% of cases. Both are produced BLOCK_SIZE at a time into
+buffers that the hot loops then read sequentially (~7 ns per normal).
+
+The kernels read the buffers inline through a local position rather than a
+_normal(state) helper: passing the buffers to a function per draw costs
+~50 ns of array reference counting, more than the draw itself. A partly used
+block is simply discarded when the next read would run past it.
+
+Keys, counters and buffers are created inside each kernel call, so
+concurrent calls never share state. The key is drawn from numba's RNG, so
+after mlmc.engine.seed the sequence of kernel calls, each with its sample
+count, reproduces exactly. A whole MLMC run does not: the drivers allocate
+N_l from measured wall-clock costs, so the sample counts (and the price)
+change from run to run. numba keeps that
+RNG per thread and every kernel is compiled with nogil=True, so pricing
+calls from several threads run in parallel on independent streams;
+seed() seeds the stream of the thread that calls it.
+
+Every kernel also takes a `key` argument (default -1, draw one as above). A
+key >= 0 runs the kernel on the stream _rng_from_key(key) and leaves the
+thread's RNG alone: drivers that replay streams (LivePricer, calibrate_sigma,
+tune_shift) keep their keys and pass them, so a seed() set by the caller is
+never overwritten.
+'''
+BLOCK_SIZE = 512    # 4 KiB per buffer, stays in L1 next to the path state
+
+_ZIG_R = 3.442619855899
+_ZIG_V = 9.91256303526217e-3
+
+def _ziggurat_tables(n_layers=128):
+    """Layer edges x_i (x_0 is the base strip's virtual width) and ratios x_{i+1} / x_i."""
+    x = np.zeros(n_layers + 1)
+    f = np.exp(-0.5 * _ZIG_R * _ZIG_R)
+    x[0] = _ZIG_V / f
+    x[1] = _ZIG_R
+    for i in range(2, n_layers):
+        x[i] = np.sqrt(-2.0 * np.log(_ZIG_V / x[i-1] + f))
+        f = np.exp(-0.5 * x[i] * x[i])
+    return x, np.append(x[1:] / x[:-1], 0.0)
+
+_ZIG_X, _ZIG_RATIO = _ziggurat_tables()
+
+@njit(inline="always")
+def _splitmix64(z):
+    z = (z ^ (z >> uint64(30))) * uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> uint64(27))) * uint64(0x94D049BB133111EB)
+    return z ^ (z >> uint64(31))
+
+@njit(inline="always")
+def _next_bits(keys):
+    counter = keys[1]
+    keys[1] = counter + uint64(1)
+    return _splitmix64(keys[0] + counter * uint64(0x9E3779B97F4A7C15))
+
+@njit(inline="always")
+def _bits_to_open_unit(bits):
+    """Top 53 bits to a double in (0, 1)."""
+    return ((bits >> uint64(11)) + uint64(1)) * (1.0 / 9007199254740993.0)
+
+@njit(nogil=True)
+def _fill_normals(keys, out):
+    """Fill `out` with standard normals; returns 0, the new read position."""
+    zx = _ZIG_X
+    zr = _ZIG_RATIO
+    for k in range(out.size):
+        while True:
+            bits = _next_bits(keys)
+            i = np.int64(bits & uint64(0x7F))
+            u = 2.0 * ((bits >> uint64(11)) * (1.0 / 9007199254740992.0)) - 1.0
+            if abs(u) < zr[i]:
+                out[k] = u * zx[i]
+                break
+            if i == 0:
+                # tail beyond R (Marsaglia's exponential rejection)
+                while True:
+                    x = np.log(_bits_to_open_unit(_next_bits(keys))) / _ZIG_R
+                    y = np.log(_bits_to_open_unit(_next_bits(keys)))
+                    if -2.0 * y >= x * x:
+                        break
+                out[k] = x - _ZIG_R if u < 0 else _ZIG_R - x
+                break
+            x = u * zx[i]
+            f0 = np.exp(-0.5 * (zx[i] * zx[i] - x * x))
+            f1 = np.exp(-0.5 * (zx[i+1] * zx[i+1] - x * x))
+            if f1 + _bits_to_open_unit(_next_bits(keys)) * (f0 - f1) < 1.0:
+                out[k] = x
+                break
+    return 0
+
+@njit(nogil=True)
+def _fill_uniforms(keys, out):
+    """Fill `out` with Unif(0, 1) draws; returns 0, the new read position."""
+    for k in range(out.size):
+        out[k] = _bits_to_open_unit(_next_bits(keys))
+    return 0
+
+@njit(nogil=True)
+def _rng_from_key(key):
+    keys = np.zeros(2, dtype=np.uint64)
+    keys[0] = _splitmix64(uint64(key))
+    return keys
+
+@njit(nogil=True)
+def _rng_keys():
+    """Key and counter of a fresh stream, keyed off numba's global RNG."""
+    return _rng_from_key(np.random.randint(0, 2**62))
+
+@njit(nogil=True)
+def block_normals(n, key):
+    """n standard normals from the block generator with an explicit key (for tests and benchmarks)."""
+    keys = _rng_from_key(key)
+    out = np.empty(n)
+    for start in range(0, n, BLOCK_SIZE):
+        _fill_normals(keys, out[start:start + BLOCK_SIZE])
+    return out
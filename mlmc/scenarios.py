@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+import numpy as np
+from numba import njit
+import time
+from mlmc.engine import _level_kernel_args, _mlmc_multi_from_level_calc, _accumulate_power_sums
+from mlmc.profiling import NULL_PROFILER, compile_watch
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _rng_from_key, _fill_normals, _fill_uniforms
+
+'''
+Scenario-batched repricing with common random numbers
+
+A scenario is a row (S0, mu, sigma, r). Under GBM the log-price on any
+scenario is log S0 + (mu - sigma^2/2) t + sigma W_t, so one set of coupled
+Brownian increments (and bridge uniforms) serves every scenario: the kernel
+draws them once per path and rescales them per scenario. All payoffs x
+scenarios are evaluated in the same compiled pass, and because they share
+their noise, differences between scenarios (P&L) are far less noisy than
+the prices themselves.
+'''
+def make_scenarios(S0, sigma, r, mu=None):
+    """Broadcast scenario columns into an (n, 4) array of (S0, mu, sigma, r); mu defaults to r (risk-neutral)."""
+    S0, sigma, r = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (S0, sigma, r)))
+    mu = r if mu is None else np.broadcast_to(np.asarray(mu, dtype=np.float64), S0.shape)
+    return np.column_stack([S0.ravel(), np.ravel(mu), sigma.ravel(), r.ravel()])
+
+@njit(nogil=True)
+def _level_power_sums_scenarios(T, level, n_paths, scenarios, params_batch, n_state, init, step, active, terminal, uses_uniforms, key=-1):
+    """Power sums (m, s, 4) of the level-l corrections of m payoffs under s scenarios on shared noise.
+
+    Also returns [sum d, sum d^2] (m, s, 2) of d = D_{j,k} - D_{j,0}, the
+    correction difference to scenario 0, for the SE of scenario P&L.
+    """
+    n_fine = 2**level
+    dt_fine = T / n_fine
+    dt_coarse = 2.0 * dt_fine
+    m = params_batch.shape[0]
+    s = scenarios.shape[0]
+
+    x0 = np.log(scenarios[:, 0])
+    drift_fine = (scenarios[:, 1] - 0.5 * scenarios[:, 2]**2) * dt_fine
+    vol_fine = scenarios[:, 2] * np.sqrt(dt_fine)
+    disc = np.exp(-scenarios[:, 3] * T)
+
+    states_fine = np.zeros((m * s, n_state))
+    states_coarse = np.zeros((m * s, n_state))
+    x_fine = np.zeros(s)
+    x_coarse = np.zeros(s)
+    x_f1 = np.zeros(s)
+    corrections = np.zeros((m, s))
+
+    keys = _rng_keys() if key < 0 else _rng_from_key(key)
+    normals = np.empty(BLOCK_SIZE)
+    uniforms = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+    ku = BLOCK_SIZE
+
+    sums = np.zeros((m, s, 4))
+    diff_sums = np.zeros((m, s, 2))
+
+    for p in range(n_paths):
+        for k in range(s):
+            x_fine[k] = x0[k]
+            x_coarse[k] = x0[k]
+        for j in range(m):
+            for k in range(s):
+                init(states_fine[j * s + k], x0[k], params_batch[j])
+                if level > 0:
+                    init(states_coarse[j * s + k], x0[k], params_batch[j])
+
+        if level == 0:
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            z = normals[kz]
+            kz += 1
+            u = 0.0
+            if uses_uniforms:
+                if ku == BLOCK_SIZE:
+                    ku = _fill_uniforms(keys, uniforms)
+                u = uniforms[ku]
+                ku += 1
+            for k in range(s):
+                x_next = x0[k] + drift_fine[k] + vol_fine[k] * z
+                for j in range(m):
+                    step(states_fine[j * s + k], x0[k], x_next, dt_fine, scenarios[k, 2], params_batch[j], u)
+                    corrections[j, k] = disc[k] * terminal(states_fine[j * s + k], x_next, 1, params_batch[j])
+        else:
+            for _ in range(n_fine // 2):
+                any_active = False
+                for i in range(m * s):
+                    if active(states_fine[i], params_batch[i // s]) or active(states_coarse[i], params_batch[i // s]):
+                        any_active = True
+                        break
+                if not any_active:
+                    break
+                if kz > BLOCK_SIZE - 2:
+                    kz = _fill_normals(keys, normals)
+                z1 = normals[kz]
+                z2 = normals[kz + 1]
+                kz += 2
+                u1 = 0.0
+                u2 = 0.0
+                uc = 0.0
+                if uses_uniforms:
+                    if ku > BLOCK_SIZE - 2:
+                        ku = _fill_uniforms(keys, uniforms)
+                    u1 = uniforms[ku]
+                    u2 = uniforms[ku + 1]
+                    ku += 2
+                    u_min = u1 if u1 < u2 else u2
+                    uc = 1.0 - (1.0 - u_min) * (1.0 - u_min)
+
+                for k in range(s):
+                    sigma_k = scenarios[k, 2]
+                    x_f1[k] = x_fine[k] + drift_fine[k] + vol_fine[k] * z1
+                    x_f2 = x_f1[k] + drift_fine[k] + vol_fine[k] * z2
+                    x_c1 = x_coarse[k] + 2.0 * drift_fine[k] + vol_fine[k] * (z1 + z2)
+                    for j in range(m):
+                        i = j * s + k
+                        step(states_fine[i], x_fine[k], x_f1[k], dt_fine, sigma_k, params_batch[j], u1)
+                        step(states_fine[i], x_f1[k], x_f2, dt_fine, sigma_k, params_batch[j], u2)
+                        step(states_coarse[i], x_coarse[k], x_c1, dt_coarse, sigma_k, params_batch[j], uc)
+                    x_fine[k] = x_f2
+                    x_coarse[k] = x_c1
+
+            for j in range(m):
+                for k in range(s):
+                    i = j * s + k
+                    corrections[j, k] = disc[k] * (terminal(states_fine[i], x_fine[k], n_fine, params_batch[j])
+                                                   - terminal(states_coarse[i], x_coarse[k], n_fine // 2, params_batch[j]))
+
+        for j in range(m):
+            for k in range(s):
+                _accumulate_power_sums(sums[j, k], corrections[j, k])
+                d = corrections[j, k] - corrections[j, 0]
+                diff_sums[j, k, 0] += d
+                diff_sums[j, k, 1] += d * d
+
+    return sums, diff_sums
+
+'''
+Scenario MLMC driver
+'''
+@dataclass
+class ScenarioResult:
+    prices: np.ndarray       # (n_payoffs, n_scenarios)
+    ses: np.ndarray          # SE of each price
+    diff_ses: np.ndarray     # SE of prices[:, k] - prices[:, 0]
+    n_samples: np.ndarray    # N_l, shared by every payoff and scenario
+    total_cost: float        # ns for the whole batch
+
+def mlmc_scenarios(spec, params_batch, scenarios, max_level, T, epsilon, profiler=NULL_PROFILER):
+    """MLMC prices of every payoff (row of params_batch) under every scenario (row of `scenarios`) on common random numbers.
+
+    N_l is chosen so that every individual price meets SE <= epsilon/2; the
+    scenario differences come out much tighter than that for free.
+    """
+    params_batch = np.atleast_2d(np.asarray(params_batch, dtype=np.float64))
+    scenarios = np.atleast_2d(np.asarray(scenarios, dtype=np.float64))
+    if scenarios.shape[1] != 4:
+        raise ValueError("scenarios must have columns (S0, mu, sigma, r); see make_scenarios")
+    m, s = params_batch.shape[0], scenarios.shape[0]
+    args = _level_kernel_args(spec, params_batch[0])[1:]
+    if callable(spec.uses_uniforms):
+        args = args[:-1] + (bool(any(spec.uses_uniforms(params) for params in params_batch)),)
+    diff_sums = np.zeros((max_level+1, m, s, 2))
+
+    def level_calc(level, n_paths):
+        start = time.perf_counter_ns()
+        with profiler.span("sample", level=level, samples=n_paths), compile_watch(profiler, [_level_power_sums_scenarios], level=level):
+            sums, diffs = _level_power_sums_scenarios(T, level, n_paths, scenarios, params_batch, *args)
+        diff_sums[level] += diffs
+        return (time.perf_counter_ns() - start) / n_paths, sums.reshape(m * s, 4)
+
+    results = _mlmc_multi_from_level_calc(level_calc, max_level, np.full(m * s, epsilon), n_pilot=spec.n_pilot, profiler=profiler, T=T)
+    n_samples = results[0].n_samples
+    n = n_samples.astype(np.float64)[:, None, None]
+    diff_vars = np.maximum(diff_sums[..., 1] - diff_sums[..., 0]**2 / n, 0.0) / np.maximum(n - 1, 1)
+    return ScenarioResult(
+        prices=np.array([res.price for res in results]).reshape(m, s),
+        ses=np.array([res.se for res in results]).reshape(m, s),
+        diff_ses=np.sqrt(np.sum(diff_vars / n, axis=0)),
+        n_samples=n_samples,
+        total_cost=results[0].total_cost,
+    )
@@ -0,0 +1,136 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from mlmc.engine import _single_level_calc, _per_level_path_calc
+from mlmc.payoffs import ASIAN_SPEC, BARRIER_SPEC
+from mlmc.profiling import NULL_PROFILER
+from mlmc.result import _build_result
+from mlmc.service import _init_worker, _ping
+
+'''
+Cost-aware parallel level scheduling
+
+    with make_pool(8) as pool:
+        price, se = mlmc_parallel(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 8, 0.05, 1.0, 1e-3, executor=pool)
+
+The sequential driver samples level after level, and the work per level,
+N_l C_l, is very uneven, so one task per level leaves every worker but one
+idle behind the most expensive level. Here each pass (pilot, then refine)
+is cut into tasks of about equal estimated cost: level l's N_l is split into
+ceil(N_l C_l / w) pieces with w = total work / (workers x tasks_per_worker),
+using the pilot's measured C_l (2^l before that). The tasks are submitted
+largest first onto one shared pool queue that idle workers pull from, which
+balances the load the way work stealing would (with a few tasks per worker
+the queue is never contended), and the small tasks at the end fill the gaps.
+
+Each task returns its level's power sums, which are added up per level, so
+the result is the same MLMCResult as the sequential driver's. The pool must
+run processes (or threads over kernels that release the GIL); make_pool
+starts warm worker processes with distinct RNG seeds.
+
+The built-in specs are sent to the workers by name: an unpickled PayoffSpec
+carries new dispatcher objects, which would make every worker compile the
+level kernel again. Other specs are pickled and compile once per worker.
+'''
+_KNOWN_SPECS = {spec.name: spec for spec in (ASIAN_SPEC, BARRIER_SPEC)}
+
+def make_pool(workers=None):
+    """Process pool whose workers have compiled the kernels and been seeded; blocks until they are ready."""
+    workers = workers or os.cpu_count()
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker)
+    for job in [pool.submit(_ping) for _ in range(workers)]:
+        job.result()
+    return pool
+
+def plan_tasks(n_paths, costs, n_workers, tasks_per_worker=4, min_paths=256, split=True):
+    """(level, n_paths) tasks of about equal estimated cost N C, largest first.
+
+    A level is never cut into tasks of fewer than min_paths paths; with
+    split=False every level is one task (the naive per-level schedule).
+    """
+    n_paths = np.asarray(n_paths, dtype=np.int64)
+    work = n_paths * np.asarray(costs, dtype=np.float64)
+    task_work = work.sum() / (n_workers * tasks_per_worker)
+    tasks = []
+    for level in np.nonzero(n_paths > 0)[0]:
+        n = int(n_paths[level])
+        n_tasks = 1
+        if split and task_work > 0:
+            n_tasks = int(np.clip(np.ceil(work[level] / task_work), 1, max(n // min_paths, 1)))
+        sizes = np.full(n_tasks, n // n_tasks)
+        sizes[:n % n_tasks] += 1
+        tasks += [(int(level), int(size)) for size in sizes]
+    tasks.sort(key=lambda task: task[1] * costs[task[0]], reverse=True)
+    return tasks
+
+def _spec_ref(spec):
+    return spec.name if _KNOWN_SPECS.get(spec.name) is spec else spec
+
+def _run_task(spec, params, S0, mu, sigma, level, n_paths, r, T):
+    start = time.perf_counter_ns()
+    spec = _KNOWN_SPECS[spec] if isinstance(spec, str) else spec
+    _, _, cost_p_path, sums = _single_level_calc(spec, params, S0, mu, sigma, level, n_paths, r, T, return_power_sums=True)
+    return cost_p_path, sums, time.perf_counter_ns() - start
+
+def _run_tasks(executor, n_workers, tasks, spec, params, S0, mu, sigma, r, T, power_sums, n_samples, time_ns, profiler):
+    """Run tasks on the pool and merge them into the per-level accumulators; returns (busy ns, wall ns)."""
+    start = time.perf_counter_ns()
+    busy = 0
+    spec = _spec_ref(spec)
+    jobs = {executor.submit(_run_task, spec, params, S0, mu, sigma, level, n, r, T): (level, n) for level, n in tasks}
+    for job in as_completed(jobs):
+        level, n = jobs[job]
+        cost_p_path, sums, task_ns = job.result()
+        power_sums[level] += sums
+        n_samples[level] += n
+        time_ns[level] += cost_p_path * n
+        busy += task_ns
+    wall = time.perf_counter_ns() - start
+    profiler.count("scheduler.tasks", len(tasks))
+    profiler.count("scheduler.busy_ns", busy)
+    profiler.count("scheduler.capacity_ns", wall * n_workers)
+    return busy, wall
+
+def mlmc_parallel(spec, params, S0, mu, sigma, max_level, r, T, epsilon, executor=None, workers=None, tasks_per_worker=4,
+                  min_paths=256, split=True, profiler=NULL_PROFILER, return_result=False):
+    """MLMC price and SE (as mlmc()) with every level's samples spread over a pool in cost-balanced tasks.
+
+    Without `executor` a pool of `workers` processes is started (and
+    compiled) for the call, which only pays off for long runs; pass a
+    make_pool() pool to reuse warm workers. The profiler's
+    scheduler.busy_ns / scheduler.capacity_ns is the pool utilisation.
+    """
+    S0, mu, sigma, r, T = float(S0), float(mu), float(sigma), float(r), float(T)
+    own_pool = executor is None
+    if own_pool:
+        executor = make_pool(workers)
+    n_workers = executor._max_workers if workers is None else workers
+    power_sums = np.zeros((max_level+1, 4))
+    n_samples = np.zeros(max_level+1, dtype=np.int64)
+    time_ns = np.zeros(max_level+1)
+    run = lambda tasks: _run_tasks(executor, n_workers, tasks, spec, params, S0, mu, sigma, r, T, power_sums, n_samples, time_ns, profiler)
+    try:
+        n_pilot = np.full(max_level+1, spec.n_pilot, dtype=np.int64)
+        with profiler.span("pilot", samples=int(n_pilot.sum())):
+            run(plan_tasks(n_pilot, 2.0**np.arange(max_level+1), n_workers, tasks_per_worker, min_paths, split))
+
+        with profiler.span("allocate"):
+            n = n_samples.astype(np.float64)
+            vars = np.maximum(power_sums[:, 1] / n - (power_sums[:, 0] / n)**2, 0.0) * n / np.maximum(n - 1, 1)
+            costs = time_ns / n
+            extra = np.array([max(_per_level_path_calc(max_level, level, vars, costs, epsilon) - n_samples[level], 0) for level in range(max_level+1)])
+            tasks = plan_tasks(extra, costs, n_workers, tasks_per_worker, min_paths, split)
+
+        with profiler.span("refine", samples=int(extra.sum())):
+            run(tasks)
+    finally:
+        if own_pool:
+            executor.shutdown()
+
+    for level in range(max_level+1):
+        profiler.count(f"samples.level_{level}", int(n_samples[level]))
+    result = _build_result(power_sums, n_samples, time_ns, epsilon, T=T)
+    if return_result:
+        return result
+    return result.price, result.se
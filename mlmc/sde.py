@@ -1,8 +1,9 @@
 import numpy as np
 from numba import njit
+from mlmc.rng import BLOCK_SIZE, _rng_keys, _fill_normals
 
 
-@njit
+@njit(nogil=True)
 
 def simulate_gbm_paths_closed_form(S0, mu, sigma, n_steps, n_paths):
     paths = np.zeros((n_paths, n_steps + 1))
@@ -14,22 +15,29 @@ def simulate_gbm_paths_closed_form(S0, mu, sigma, n_steps, n_paths):
 
     return paths
 
-@njit
+@njit(nogil=True)
 def simulate_gbm_paths_recursive(S0, mu, sigma, T, n_steps, n_paths):
     paths = np.zeros((n_paths, n_steps + 1))
     paths[:, 0] = S0
     dt = T / n_steps
     sqrt_dt = dt**0.5
 
+    keys = _rng_keys()
+    normals = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
+
     for i in range(n_paths):
         for t in range(1, n_steps + 1):
-            Z = np.random.normal()
+            if kz == BLOCK_SIZE:
+                kz = _fill_normals(keys, normals)
+            Z = normals[kz]
+            kz += 1
             paths[i, t] = paths[i, t-1] * np.exp((mu - 0.5*sigma**2)*dt + sigma*sqrt_dt*Z)
 
     return paths
 
 # Maybe make a version with variable level difference for fine (n) and coarse (m), n >= m
-@njit
+@njit(nogil=True)
 def simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths):
     n_fine = 2**level
     n_coarse = 2**(level-1)
@@ -44,6 +52,10 @@ def simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths):
 
     coarse_paths[:, 0] = S0
     fine_paths[:, 0] = S0
+
+    keys = _rng_keys()
+    normals = np.empty(BLOCK_SIZE)
+    kz = BLOCK_SIZE
     #fine_paths[:, 1] = S0
 
     for path in range(n_paths):
@@ -52,8 +64,11 @@ def simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths):
             fine_step_1 = coarse_step * 2 - 1
             fine_step_2 = fine_step_1 + 1
 
-            Z1 = np.random.normal()
-            Z2 = np.random.normal()
+            if kz > BLOCK_SIZE - 2:
+                kz = _fill_normals(keys, normals)
+            Z1 = normals[kz]
+            Z2 = normals[kz + 1]
+            kz += 2
             ZC = (Z1 + Z2)/(2**0.5)
 
             coarse_paths[path, coarse_step] = (coarse_paths[path, coarse_step-1] *
@@ -67,6 +82,8 @@ def simulate_gbm_coupled_paths(S0, mu, sigma, T, level, n_paths):
 
     return fine_paths, coarse_paths
 
-@njit
+#numpy error model: a zero-variance step gives exp(-inf) instead of raising, so callers inline it without keeping
+#their arrays referenced for the exception path
+@njit(nogil=True, error_model="numpy")
 def _brownian_bridge_calc(start, end, h, barrier, sigma):
     return np.exp(-(2*(barrier-start)*(barrier-end))/(sigma**2 * h))
@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mlmc.engine import mlmc_multi, seed
+from mlmc.mc import warmup
+from mlmc.payoffs import ASIAN_SPEC, BARRIER_SPEC, asian_params, barrier_params
+
+'''
+Local pricing service
+
+    python -m mlmc.service --socket /tmp/mlmc.sock --workers 4
+    python -m mlmc.service --port 8765
+
+Newline-delimited JSON over a Unix socket or localhost TCP. One request per line:
+
+    {"id": 1, "product": "asian", "S0": 100, "mu": 0.05, "sigma": 0.2, "r": 0.05, "T": 1,
+     "K": 100, "max_level": 6, "epsilon": 0.05}
+
+barrier requests also carry "B" and optionally "bridge". Each response line is
+{"id", "price", "se", "n_samples", "batch_size"} or {"id", "error"} and is
+written as soon as that price is ready, so responses can come back out of order.
+
+Requests for the same product on the same model (S0, mu, sigma, r, T,
+max_level) that arrive within `window` seconds of each other, or while every
+worker is busy, are coalesced into one mlmc_multi run, which prices them all
+on shared paths. Batches run on worker processes that have compiled every
+kernel once at startup, so no request pays numba compilation.
+'''
+def _number(req, name):
+    """float(req[name]); ValueError naming the field if it is missing or not a number."""
+    try:
+        return float(req[name])
+    except KeyError:
+        raise ValueError(f"missing field {name!r}") from None
+    except (TypeError, ValueError):
+        raise ValueError(f"field {name!r} is not a number: {req[name]!r}") from None
+
+PRODUCTS = {
+    "asian": (ASIAN_SPEC, lambda req: asian_params(_number(req, "K"))),
+    "barrier": (BARRIER_SPEC, lambda req: barrier_params(_number(req, "K"), _number(req, "B"), bridge=bool(req.get("bridge", False)))),
+}
+MODEL_FIELDS = ("S0", "mu", "sigma", "r", "T", "max_level")
+
+'''
+Worker side
+'''
+def _init_worker():
+    warmup()
+    # forked workers would otherwise share numba's RNG stream
+    seed(int.from_bytes(os.urandom(4), "little"))
+
+def _ping():
+    return os.getpid()
+
+def _price_batch(product, model, rows, epsilons):
+    spec = PRODUCTS[product][0]
+    S0, mu, sigma, r, T, max_level = model
+    results = mlmc_multi(spec, np.array(rows), S0, mu, sigma, int(max_level), r, T, epsilons, return_result=True)
+    return [{"price": res.price, "se": res.se, "n_samples": [int(n) for n in res.n_samples]} for res in results]
+
+'''
+Server
+'''
+def _parse_request(req):
+    """(batch key, params row, epsilon) of a request; ValueError if it is malformed."""
+    if req.get("product") not in PRODUCTS:
+        raise ValueError(f"unknown product {req.get('product')!r}, expected one of {sorted(PRODUCTS)}")
+    model = tuple(_number(req, name) for name in MODEL_FIELDS)
+    row = PRODUCTS[req["product"]][1](req)
+    epsilon = _number(req, "epsilon")
+    if epsilon <= 0:
+        raise ValueError("epsilon must be positive")
+    return (req["product"], model), row, epsilon
+
+class _Batch:
+    def __init__(self, key):
+        self.key = key
+        self.items = []       # (params row, epsilon, future)
+        self.queued = False
+
+class PricingServer:
+    def __init__(self, workers=None, window=0.005, max_batch=64):
+        self.workers = workers or os.cpu_count()
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = None
+        self.server = None
+        self._open = {}            # key -> batch still accepting requests
+        self._queue = deque()      # batches whose window is over, waiting for a free worker
+        self._busy = 0
+        self.stats = {"requests": 0, "batches": 0}
+
+    async def start(self, path=None, host="127.0.0.1", port=0):
+        """Start the worker pool (warmed before returning) and listen on `path` or host:port."""
+        loop = asyncio.get_running_loop()
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _ping) for _ in range(self.workers)))
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self._handle, host=host, port=port)
+        return self
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def price(self, req):
+        """Price one request dict; resolves once its batch has run.
+
+        A batch is handed to the pool when its window has passed and a worker
+        is free; until then (and up to max_batch) it keeps absorbing matching
+        requests, so batches grow with the load instead of queueing up.
+        """
+        key, row, epsilon = _parse_request(req)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch(key)
+            asyncio.get_running_loop().call_later(self.window, self._enqueue, batch)
+        batch.items.append((row, epsilon, future))
+        self.stats["requests"] += 1
+        if len(batch.items) >= self.max_batch:
+            self._close(batch)
+            self._enqueue(batch)
+        result = await future
+        return dict(result, batch_size=len(batch.items))
+
+    def _close(self, batch):
+        if self._open.get(batch.key) is batch:
+            del self._open[batch.key]
+
+    def _enqueue(self, batch):
+        if not batch.queued:
+            batch.queued = True
+            self._queue.append(batch)
+            self._dispatch()
+
+    def _dispatch(self):
+        while self._queue and self._busy < self.workers:
+            batch = self._queue.popleft()
+            self._close(batch)
+            self._busy += 1
+            self.stats["batches"] += 1
+            product, model = batch.key
+            rows = [row for row, _, _ in batch.items]
+            epsilons = [epsilon for _, epsilon, _ in batch.items]
+            job = asyncio.get_running_loop().run_in_executor(self.executor, _price_batch, product, model, rows, epsilons)
+            job.add_done_callback(lambda done, batch=batch: self._resolve(done, batch))
+
+    def _resolve(self, job, batch):
+        self._busy -= 1
+        for i, (_, _, future) in enumerate(batch.items):
+            if future.done():
+                continue
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result()[i])
+        self._dispatch()
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line, writer):
+        req_id = None
+        try:
+            req = json.loads(line)
+            req_id = req.get("id")
+            response = dict(await self.price(req), id=req_id)
+        except Exception as exc:
+            response = {"id": req_id, "error": f"{type(exc).__name__}: {exc}"}
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+'''
+Client
+'''
+async def stream_prices(requests, path=None, host="127.0.0.1", port=None):
+    """Send all requests on one connection and yield the responses as they arrive."""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    for req in requests:
+        writer.write((json.dumps(req) + "\n").encode())
+    await writer.drain()
+    try:
+        for _ in range(len(requests)):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection before answering every request")
+            yield json.loads(line)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def serve(path=None, host="127.0.0.1", port=8765, workers=None, window=0.005, max_batch=64):
+    server = await PricingServer(workers=workers, window=window, max_batch=max_batch).start(path=path, host=host, port=port)
+    print(f"mlmc pricing service on {server.address} with {server.workers} warm workers", flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local MLMC pricing service")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--window", type=float, default=0.005, help="coalescing window in seconds")
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.socket, args.host, args.port, args.workers, args.window, args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import os
+import numpy as np
+
+'''
+Memory-mapped per-level sample store
+
+    store = SampleStore("run_1e8", payoffs=True)
+    mlmc(ASIAN_SPEC, asian_params(100), 100, 0.05, 0.2, 8, 0.05, 1.0, 1e-3, store=store)
+    store.close()
+
+    store = SampleStore("run_1e8", mode="r")
+    store.level_moments(3)["kurtosis"], store.estimate(), store.bootstrap_ci()
+    store.estimate(lambda c: np.maximum(c["fine"], 1.0) - np.maximum(c["coarse"], 1.0))
+
+One append-only level_<l>.npy per level holding the discounted corrections
+(and with payoffs=True also the fine and coarse payoffs) as float64 rows.
+The .npy header is padded so that the row count can be rewritten in place
+after every appended chunk, so the files are valid (np.load(mmap_mode="r"))
+at any time and a crash leaves at most the last chunk unaccounted for.
+
+Readers map the files instead of loading them and reduce over them in
+chunks, so a 10^8-sample level costs one sequential read per statistic and
+a chunk of RAM. Functions of the samples receive a dict of zero-copy column
+views ("correction", and "fine" / "coarse" when stored).
+'''
+_HEADER_LEN = 128   # total bytes, room for any row count
+_MAGIC = b"\x93NUMPY\x01\x00"
+
+def _write_header(f, n_rows, n_cols):
+    header = repr({"descr": "<f8", "fortran_order": False, "shape": (n_rows, n_cols)}).encode("latin1")
+    header = header.ljust(_HEADER_LEN - len(_MAGIC) - 2 - 1) + b"\n"
+    f.seek(0)
+    f.write(_MAGIC + np.uint16(len(header)).tobytes() + header)
+
+class _LevelFile:
+    """Append-only (n, n_cols) float64 .npy file."""
+    def __init__(self, path, n_cols):
+        self.n_cols = n_cols
+        if os.path.exists(path):
+            self.n_rows = np.load(path, mmap_mode="r").shape[0]
+            self.f = open(path, "r+b")
+            # drop a chunk whose header update never happened
+            self.f.truncate(_HEADER_LEN + self.n_rows * n_cols * 8)
+        else:
+            self.n_rows = 0
+            self.f = open(path, "w+b")
+            _write_header(self.f, 0, n_cols)
+
+    def append(self, rows):
+        self.f.seek(0, os.SEEK_END)
+        self.f.write(np.ascontiguousarray(rows, dtype="<f8").tobytes())
+        self.n_rows += rows.shape[0]
+        _write_header(self.f, self.n_rows, self.n_cols)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class SampleStore:
+    def __init__(self, path, payoffs=False, mode="a"):
+        """Open (mode="a", created if missing) or read (mode="r") the store in directory `path`."""
+        self.path = path
+        self.mode = mode
+        self._writers = {}
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.columns = tuple(json.load(f)["columns"])
+        elif mode == "r":
+            raise FileNotFoundError(f"no sample store at {path!r}")
+        else:
+            self.columns = ("correction", "fine", "coarse") if payoffs else ("correction",)
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump({"columns": list(self.columns)}, f)
+
+    def _level_path(self, level):
+        return os.path.join(self.path, f"level_{level}.npy")
+
+    '''
+    Writing
+    '''
+    def append(self, level, payoffs):
+        """Append rows of (fine, coarse) discounted payoffs (coarse 0 at level 0) to `level`."""
+        if self.mode == "r":
+            raise ValueError("sample store opened read-only")
+        writer = self._writers.get(level)
+        if writer is None:
+            writer = self._writers[level] = _LevelFile(self._level_path(level), len(self.columns))
+        correction = payoffs[:, 0] - payoffs[:, 1]
+        rows = correction[:, None] if len(self.columns) == 1 else np.column_stack([correction, payoffs[:, 0], payoffs[:, 1]])
+        writer.append(rows)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    Reading
+    '''
+    @property
+    def levels(self):
+        found = [int(name[6:-4]) for name in os.listdir(self.path) if name.startswith("level_") and name.endswith(".npy")]
+        return sorted(found)
+
+    def level(self, level):
+        """Read-only (n, n_columns) memory map of a level's samples."""
+        return np.load(self._level_path(level), mmap_mode="r")
+
+    @property
+    def n_samples(self):
+        return np.array([self.level(level).shape[0] for level in self.levels], dtype=np.int64)
+
+    def _chunks(self, level, chunk_size):
+        samples = self.level(level)
+        for start in range(0, samples.shape[0], chunk_size):
+            block = samples[start:start + chunk_size]
+            yield {name: block[:, i] for i, name in enumerate(self.columns)}
+
+    def _values(self, level, fn, chunk_size):
+        for cols in self._chunks(level, chunk_size):
+            yield cols["correction"] if fn is None else np.asarray(fn(cols), dtype=np.float64)
+
+    def level_moments(self, level, fn=None, chunk_size=1 << 22):
+        """n, mean, var, skewness and kurtosis of the corrections (or of fn(columns)) on one level."""
+        n = 0
+        sums = np.zeros(4)
+        shift = None
+        for y in self._values(level, fn, chunk_size):
+            if shift is None and y.size:
+                shift = float(y[0])   # shifted sums keep the central moments accurate when |mean| >> sd
+            d = y - shift
+            d2 = d * d
+            sums += (d.sum(), d2.sum(), (d2 * d).sum(), (d2 * d2).sum())
+            n += y.size
+        if n == 0:
+            return {"n": 0, "mean": float("nan"), "var": float("nan"), "skewness": float("nan"), "kurtosis": float("nan")}
+        m1, m2, m3, m4 = sums / n
+        var = m2 - m1 * m1
+        m3c = m3 - 3 * m1 * m2 + 2 * m1**3
+        m4c = m4 - 4 * m1 * m3 + 6 * m1 * m1 * m2 - 3 * m1**4
+        return {
+            "n": n,
+            "mean": shift + m1,
+            "var": var * n / max(n - 1, 1),
+            "skewness": m3c / var**1.5 if var > 0 else float("nan"),
+            "kurtosis": m4c / var**2 if var > 0 else float("nan"),
+        }
+
+    def estimate(self, fn=None, chunk_size=1 << 22):
+        """(price, se) of the MLMC estimator over the stored levels, optionally of a what-if fn(columns) per sample."""
+        stats = [self.level_moments(level, fn, chunk_size) for level in self.levels]
+        price = sum(s["mean"] for s in stats)
+        se = np.sqrt(sum(s["var"] / s["n"] for s in stats))
+        return price, se
+
+    def bootstrap(self, n_boot=1000, n_blocks=1000, fn=None, rng=None, chunk_size=1 << 22):
+        """Bootstrap replicates of the MLMC estimate.
+
+        The samples are i.i.d., so each level is cut into n_blocks contiguous
+        blocks and the blocks are resampled; one pass over the maps computes
+        the block sums and the replicates cost O(n_boot * n_blocks).
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        replicates = np.zeros(n_boot)
+        for level in self.levels:
+            n = self.level(level).shape[0]
+            n_b = min(n_blocks, n)
+            edges = np.linspace(0, n, n_b + 1).astype(np.int64)
+            block_sums = np.zeros(n_b)
+            offset = 0
+            for y in self._values(level, fn, chunk_size):
+                ids = np.searchsorted(edges, np.arange(offset, offset + y.size), side="right") - 1
+                block_sums += np.bincount(ids, weights=y, minlength=n_b)[:n_b]
+                offset += y.size
+            block_sizes = np.diff(edges)
+            picks = rng.integers(0, n_b, size=(n_boot, n_b))
+            replicates += block_sums[picks].sum(axis=1) / block_sizes[picks].sum(axis=1)
+        return replicates
+
+    def bootstrap_ci(self, level=0.95, **kwargs):
+        """Percentile bootstrap confidence interval of the MLMC estimate."""
+        replicates = self.bootstrap(**kwargs)
+        tail = (1.0 - level) / 2.0
+        return tuple(np.quantile(replicates, [tail, 1.0 - tail]))